@@ -1,9 +1,14 @@
 import os
-from flask import Flask, request, jsonify
+import json
+from flask import Flask, Response, request, jsonify, url_for
 from flask_cors import CORS
 from openai import OpenAI
 from dotenv import load_dotenv
 import time
+import threading
+
+from jobs import COMPLETED, FAILED, JobQueue, QueueFull
+from summary_cache import SummaryCache, content_key
 
 load_dotenv() 
 
@@ -24,172 +29,276 @@ client = OpenAI(api_key=api_key)
 # --- Helper to manage Assistant --- 
 ASSISTANT_ID_FILE = "assistant_id.txt"
 assistant_cache = None  # Cache the assistant to avoid recreating it
+assistant_lock = threading.Lock()
 
 def get_or_create_assistant():
     global assistant_cache
+
+    # Workers start concurrently; only one of them may create the assistant
+    with assistant_lock:
+        # Return cached assistant if we have one
+        if assistant_cache is not None:
+            return assistant_cache
     
-    # Return cached assistant if we have one
-    if assistant_cache is not None:
-        return assistant_cache
-    
-    if os.path.exists(ASSISTANT_ID_FILE):
-        with open(ASSISTANT_ID_FILE, "r") as f:
-            assistant_id = f.read().strip()
-            if assistant_id:
-                try:
-                    print(f"Attempting to retrieve assistant with ID: {assistant_id}")
-                    assistant = client.beta.assistants.retrieve(assistant_id)
-                    print(f"Successfully retrieved assistant: {assistant.id}")
-                    assistant_cache = assistant  # Cache it
-                    return assistant
-                except Exception as e:
-                    print(f"Failed to retrieve assistant {assistant_id}, creating a new one: {e}")
-            else:
-                print("Assistant ID file is empty, creating a new assistant.")
-    else:
-        print("Assistant ID file not found, creating a new assistant.")
+        if os.path.exists(ASSISTANT_ID_FILE):
+            with open(ASSISTANT_ID_FILE, "r") as f:
+                assistant_id = f.read().strip()
+                if assistant_id:
+                    try:
+                        print(f"Attempting to retrieve assistant with ID: {assistant_id}")
+                        assistant = client.beta.assistants.retrieve(assistant_id)
+                        print(f"Successfully retrieved assistant: {assistant.id}")
+                        file_search = getattr(assistant.tool_resources, "file_search", None)
+                        if file_search and file_search.vector_store_ids:
+                            # Left over from when uploads were attached to the assistant itself
+                            assistant = client.beta.assistants.update(
+                                assistant_id=assistant.id,
+                                tool_resources={"file_search": {"vector_store_ids": []}},
+                            )
+                            print(f"Detached stale vector stores from assistant {assistant.id}")
+                        assistant_cache = assistant  # Cache it
+                        return assistant
+                    except Exception as e:
+                        print(f"Failed to retrieve assistant {assistant_id}, creating a new one: {e}")
+                else:
+                    print("Assistant ID file is empty, creating a new assistant.")
+        else:
+            print("Assistant ID file not found, creating a new assistant.")
     
-    try:
-        assistant = client.beta.assistants.create(
-            name="EHR File Processor",
-            instructions="You are an AI assistant that processes Electronic Health Record (EHR) files. Analyze the content and provide a summary or answer questions based on the file.",
-            model="gpt-4o",
-            tools=[{"type": "file_search"}],
-        )
-        with open(ASSISTANT_ID_FILE, "w") as f:
-            f.write(assistant.id)
-        print(f"Created new assistant with ID: {assistant.id} and saved to {ASSISTANT_ID_FILE}")
-        assistant_cache = assistant  # Cache it
-        return assistant
-    except Exception as e:
-        print(f"Error creating OpenAI assistant: {e}")
-        raise e
+        try:
+            assistant = client.beta.assistants.create(
+                name="EHR File Processor",
+                instructions="You are an AI assistant that processes Electronic Health Record (EHR) files. Analyze the content and provide a summary or answer questions based on the file.",
+                model="gpt-4o",
+                tools=[{"type": "file_search"}],
+            )
+            with open(ASSISTANT_ID_FILE, "w") as f:
+                f.write(assistant.id)
+            print(f"Created new assistant with ID: {assistant.id} and saved to {ASSISTANT_ID_FILE}")
+            assistant_cache = assistant  # Cache it
+            return assistant
+        except Exception as e:
+            print(f"Error creating OpenAI assistant: {e}")
+            raise e
 
 # Don't create assistant on startup - wait until it's needed!
 
-@app.route("/", methods=["GET"])
-def health_check():
-    return jsonify({"status": "healthy", "message": "EHR File Processor API is running"})
 
-@app.route("/api/process-file", methods=["POST"])
-def process_file():
+class ProcessingError(Exception):
+    """An EHR file that could not be summarized (message is returned to the client)"""
+
+
+def summarize_ehr(filename, file_content):
+    """Run one EHR file through the assistant and return its summary"""
     try:
         assistant = get_or_create_assistant()  # Get assistant when needed
     except Exception as e:
-        return jsonify({"error": f"Failed to initialize AI assistant: {str(e)}"}), 500
+        raise ProcessingError(f"Failed to initialize AI assistant: {str(e)}")
+    vector_store = None
+    thread = None
+    try:
+        print(f"Processing file: {filename}")
+
+        # Step 1: Create a Vector Store
+        # Vector stores have a default expiration policy of 7 days if created via thread helpers.
+        # Here, we create it explicitly and can manage its lifecycle.
+        vector_store = client.vector_stores.create(
+            name=f"EHR Upload - {filename} - {time.time()}", # Unique name
+            # expires_after={"anchor": "last_active_at", "days": 1} # Optional: manage expiration
+        )
+        print(f"Created vector store: {vector_store.id} for file {filename}")
+
+        # Step 2: Upload the file and add it to the Vector Store
+        file_batch = client.vector_stores.file_batches.upload_and_poll(
+            vector_store_id=vector_store.id,
+            files=[(filename, file_content)]
+        )
+        print(f"File batch status for vector store {vector_store.id}: {file_batch.status}")
+        if file_batch.status != 'completed':
+            error_message = "File processing batch failed."
+            if hasattr(file_batch, 'last_error') and file_batch.last_error:
+                error_message = f"File processing failed: {file_batch.last_error.message if hasattr(file_batch.last_error, 'message') else file_batch.last_error}"
+            raise ProcessingError(error_message)
+
+        # Step 3: Create a Thread with the Vector Store attached to it
+        # The store is a thread-level tool resource, so the shared assistant is never
+        # modified and concurrent requests each search only their own file.
+        thread_message_content = "Please summarize the key information in the provided EHR document. Focus on diagnosis, medications, and chief complaints."
+        thread = client.beta.threads.create(
+            messages=[
+                {
+                    "role": "user",
+                    "content": thread_message_content,
+                }
+            ],
+            tool_resources={"file_search": {"vector_store_ids": [vector_store.id]}},
+        )
+        print(f"Created thread: {thread.id} with vector store {vector_store.id} and initial message: '{thread_message_content}'")
+
+        # Step 4: Create a Run and poll for completion
+        print(f"Creating run on thread {thread.id} with assistant {assistant.id}")
+        run = client.beta.threads.runs.create_and_poll(
+            thread_id=thread.id,
+            assistant_id=assistant.id,
+        )
+        print(f"Run {run.id} status: {run.status}")
+
+        if run.status != 'completed':
+            print(f"Run did not complete successfully. Status: {run.status}, Error: {run.last_error}")
+            error_detail = f"Run failed or was cancelled. Status: {run.status}"
+            if run.last_error and hasattr(run.last_error, 'message'):
+                error_detail += f" - {run.last_error.message}"
+            raise ProcessingError(error_detail)
+
+        messages = client.beta.threads.messages.list(
+            thread_id=thread.id, order="asc"
+        )
+        assistant_response = None
+        for msg in reversed(messages.data):
+            if msg.role == "assistant":
+                # Ensure content is not empty and is of expected type
+                if msg.content and isinstance(msg.content, list) and len(msg.content) > 0:
+                    content_item = msg.content[0]
+                    if hasattr(content_item, 'text') and hasattr(content_item.text, 'value'):
+                        assistant_response = content_item.text.value
+                        break
+
+        if not assistant_response:
+            print("Assistant did not provide a text response.")
+            raise ProcessingError("Assistant did not provide a text response.")
+
+        print(f"Assistant response: {assistant_response[:200]}...") # Log snippet
+        return assistant_response
+    finally:
+        # Clean up the thread and vector store created for this request
+        if thread is not None:
+            try:
+                client.beta.threads.delete(thread.id)
+            except Exception as e_del_thread:
+                print(f"Error deleting thread {thread.id}: {e_del_thread}")
+        if vector_store is not None:
+            try:
+                client.vector_stores.delete(vector_store.id)
+                print(f"Successfully deleted vector store: {vector_store.id}")
+            except Exception as e_del_vs:
+                print(f"Error deleting vector store {vector_store.id}: {e_del_vs}")
+
+
+# --- Summary cache: identical files (by content hash) are summarized once ---
+summary_cache = SummaryCache(
+    ttl=int(os.environ.get("EHR_CACHE_TTL", 24 * 3600)),
+    max_entries=int(os.environ.get("EHR_CACHE_SIZE", 256)),
+)
+
+
+def summarize_upload(filename, file_content, digest):
+    summary = summary_cache.get(digest)
+    if summary is None:
+        summary = summarize_ehr(filename, file_content)
+        summary_cache.put(digest, summary)
+    return summary
+
+
+# --- Job queue: uploads are processed by a worker pool, not the request thread ---
+jobs = JobQueue(
+    summarize_upload,
+    workers=int(os.environ.get("EHR_WORKERS", 4)),
+    max_queued=int(os.environ.get("EHR_MAX_QUEUED", 32)),
+    ttl=int(os.environ.get("EHR_JOB_TTL", 3600)),
+)
+SYNC_WAIT_SECONDS = float(os.environ.get("EHR_SYNC_WAIT", 25))  # Stay under proxy request timeouts
+
+
+def submit_upload():
+    """Validate the uploaded file and queue it; returns (job, None) or (None, error response)"""
     if 'file' not in request.files:
-        return jsonify({"error": "No file part"}), 400
-    
+        return None, (jsonify({"error": "No file part"}), 400)
+
     file = request.files['file']
     if file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
+        return None, (jsonify({"error": "No selected file"}), 400)
 
-    if file:
-        try:
-            print(f"Processing file: {file.filename}")
-            file_content = file.read() # Read file content
-            file.seek(0) # Reset stream position if needed later, though not strictly for OpenAI upload here
-
-            # Step 1: Create a Vector Store
-            # Vector stores have a default expiration policy of 7 days if created via thread helpers.
-            # Here, we create it explicitly and can manage its lifecycle.
-            vector_store = client.vector_stores.create(
-                name=f"EHR Upload - {file.filename} - {time.time()}", # Unique name
-                # expires_after={"anchor": "last_active_at", "days": 1} # Optional: manage expiration
-            )
-            print(f"Created vector store: {vector_store.id} for file {file.filename}")
+    file_content = file.read()
+    digest = content_key(file_content)
+    summary = summary_cache.get(digest)
+    if summary is not None:
+        print(f"Cache hit for file {file.filename} ({digest[:12]})")
+        return jobs.finished(summary), None
 
-            # Step 2: Upload the file and add it to the Vector Store
-            file_batch = client.vector_stores.file_batches.upload_and_poll(
-                vector_store_id=vector_store.id,
-                files=[(file.filename, file_content)] 
-            )
-            print(f"File batch status for vector store {vector_store.id}: {file_batch.status}")
-            if file_batch.status != 'completed':
-                error_message = "File processing batch failed."
-                if hasattr(file_batch, 'last_error') and file_batch.last_error:
-                    error_message = f"File processing failed: {file_batch.last_error.message if hasattr(file_batch.last_error, 'message') else file_batch.last_error}"
-                client.vector_stores.delete(vector_store.id) # Clean up failed vector store
-                print(f"Deleted vector store {vector_store.id} due to batch failure.")
-                return jsonify({"error": error_message}), 500
-
-            # Step 3: Update the assistant to use this new Vector Store
-            # IMPORTANT: An assistant can only be linked to ONE vector store via tool_resources.file_search.vector_store_ids[0]
-            # If you need to query multiple permanent stores, this strategy needs adjustment.
-            # For this single-file-query use case, replacing it is fine.
-            assistant = client.beta.assistants.update(
-                assistant_id=assistant.id,
-                tool_resources={"file_search": {"vector_store_ids": [vector_store.id]}},
-            )
-            print(f"Updated assistant {assistant.id} to use vector store {vector_store.id}")
-
-            # Step 4: Create a Thread
-            thread_message_content = "Please summarize the key information in the provided EHR document. Focus on diagnosis, medications, and chief complaints."
-            thread = client.beta.threads.create(
-                messages=[
-                    {
-                        "role": "user",
-                        "content": thread_message_content,
-                    }
-                ]
-            )
-            print(f"Created thread: {thread.id} with initial message: '{thread_message_content}'")
+    try:
+        # Concurrent uploads of the same file share one job
+        job = jobs.submit(file.filename, file_content, digest, key=digest)
+    except QueueFull as e:
+        response = jsonify({"error": f"Server is busy, please retry shortly ({e})"})
+        response.headers["Retry-After"] = "10"
+        return None, (response, 503)
+    print(f"Queued job {job.id} for file {file.filename}")
+    return job, None
 
-            # Step 5: Create a Run and poll for completion
-            print(f"Creating run on thread {thread.id} with assistant {assistant.id}")
-            run = client.beta.threads.runs.create_and_poll(
-                thread_id=thread.id,
-                assistant_id=assistant.id,
-            )
-            print(f"Run {run.id} status: {run.status}")
-
-            if run.status == 'completed':
-                messages = client.beta.threads.messages.list(
-                    thread_id=thread.id, order="asc"
-                )
-                assistant_response = None
-                for msg in reversed(messages.data):
-                    if msg.role == "assistant":
-                        # Ensure content is not empty and is of expected type
-                        if msg.content and isinstance(msg.content, list) and len(msg.content) > 0:
-                            content_item = msg.content[0]
-                            if hasattr(content_item, 'text') and hasattr(content_item.text, 'value'):
-                                assistant_response = content_item.text.value
-                                break
-                
-                if assistant_response:
-                    print(f"Assistant response: {assistant_response[:200]}...") # Log snippet
-                    # Clean up the specific vector store created for this request
-                    try:
-                        client.vector_stores.delete(vector_store.id)
-                        print(f"Successfully deleted vector store: {vector_store.id}")
-                    except Exception as e_del_vs:
-                        print(f"Error deleting vector store {vector_store.id}: {e_del_vs}")
-                    return jsonify({"response": assistant_response})
-                else:
-                    print("Assistant did not provide a text response.")
-                    return jsonify({"error": "Assistant did not provide a text response."}), 500
-            else:
-                print(f"Run did not complete successfully. Status: {run.status}, Error: {run.last_error}")
-                error_detail = f"Run failed or was cancelled. Status: {run.status}"
-                if run.last_error and hasattr(run.last_error, 'message'):
-                    error_detail += f" - {run.last_error.message}"
-                return jsonify({"error": error_detail}), 500
 
-        except Exception as e:
-            print(f"Unhandled error processing file: {e}")
-            # Attempt to clean up vector store if it was created and an error occurred later
-            if 'vector_store' in locals() and vector_store and vector_store.id:
-                try:
-                    client.vector_stores.delete(vector_store.id)
-                    print(f"Cleaned up vector store {vector_store.id} due to error: {e}")
-                except Exception as e_cleanup:
-                    print(f"Error during cleanup of vector store {vector_store.id}: {e_cleanup}")
-            return jsonify({"error": str(e)}), 500
-
-    return jsonify({"error": "File processing failed due to an unknown issue"}), 500
+def job_response(job):
+    data = job.to_dict()
+    data["status_url"] = url_for("job_status", job_id=job.id)
+    data["stream_url"] = url_for("job_stream", job_id=job.id)
+    if job.status == FAILED:
+        return jsonify(data), 500
+    return jsonify(data), (200 if job.done else 202)
+
+
+@app.route("/", methods=["GET"])
+def health_check():
+    return jsonify({"status": "healthy", "message": "EHR File Processor API is running", "jobs": jobs.stats(), "cached_summaries": len(summary_cache)})
+
+@app.route("/api/jobs", methods=["POST"])
+def create_job():
+    job, error = submit_upload()
+    if error:
+        return error
+    return job_response(job)
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    return job_response(job)
+
+@app.route("/api/jobs/<job_id>/stream", methods=["GET"])
+def job_stream(job_id):
+    """Server-sent events: one `data:` message per status change, ending with the result"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+
+    def events():
+        status = None
+        while True:
+            if job.status != status:
+                status = job.status
+                yield f"data: {json.dumps(job.to_dict())}\n\n"
+                if job.done:
+                    return
+            if job.wait(timeout=15, seen=status) == status:
+                yield ": keep-alive\n\n"
+
+    return Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/process-file", methods=["POST"])
+def process_file():
+    """
+    Backwards-compatible upload: waits up to EHR_SYNC_WAIT seconds for the
+    job and returns {"response": ...} as before; slower jobs answer 202 with
+    the job id to poll instead of timing out.
+    """
+    job, error = submit_upload()
+    if error:
+        return error
+    job.wait(timeout=SYNC_WAIT_SECONDS)
+    if job.status == COMPLETED:
+        return jsonify({"response": job.result})
+    return job_response(job)
 
 if __name__ == "__main__":
     # Production ready configuration
     port = int(os.environ.get("PORT", 5001))  # Use PORT from environment if available
-    app.run(host='0.0.0.0', debug=False, port=port) 
\ No newline at end of file
+    app.run(host='0.0.0.0', debug=False, port=port, threaded=True) 
\ No newline at end of file
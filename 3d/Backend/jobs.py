@@ -0,0 +1,165 @@
+"""
+In-process job queue for the EHR processing API.
+
+Uploads are turned into jobs and handed to a fixed pool of worker threads
+through a bounded queue, so a web request only has to enqueue the file and
+return a job id; clients then poll (or stream) the job until it finishes.
+When the queue is full, submit() raises QueueFull instead of letting
+requests pile up behind the OpenAI calls.
+
+Jobs live in memory, so the app must run as a single process (any number of
+threads); finished jobs are forgotten after `ttl` seconds. Jobs submitted
+with a `key` (e.g. a content hash) share the queued or running job for that
+key instead of doing the same work twice.
+"""
+
+import time
+import uuid
+import queue
+import threading
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when max_queued jobs are already waiting"""
+
+
+class Job:
+    def __init__(self, args, key=None):
+        self.id = uuid.uuid4().hex
+        self.args = args
+        self.key = key
+        self.cached = False
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.changed = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in (COMPLETED, FAILED)
+
+    def update(self, status, result=None, error=None):
+        with self.changed:
+            self.status = status
+            self.result = result
+            self.error = error
+            if self.done:
+                self.finished_at = time.time()
+            self.changed.notify_all()
+
+    def wait(self, timeout=None, seen=None):
+        """Block until the job's status differs from `seen` (default: until done); returns the status"""
+        with self.changed:
+            if seen is None:
+                self.changed.wait_for(lambda: self.done, timeout)
+            else:
+                self.changed.wait_for(lambda: self.status != seen, timeout)
+            return self.status
+
+    def to_dict(self):
+        data = {"job_id": self.id, "status": self.status, "created_at": self.created_at}
+        if self.status == COMPLETED:
+            data["response"] = self.result
+            data["cached"] = self.cached
+        elif self.status == FAILED:
+            data["error"] = self.error
+        return data
+
+
+class JobQueue:
+    """
+    Runs handler(*args) for submitted jobs on `workers` threads. The handler's
+    return value becomes the job result; an exception fails the job with its
+    message.
+    """
+
+    def __init__(self, handler, workers=4, max_queued=32, ttl=3600):
+        self.handler = handler
+        self.workers = workers
+        self.ttl = ttl
+        self.pending = queue.Queue(maxsize=max_queued)
+        self.jobs = {}
+        self.active = {}  # key -> queued/running job
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def start(self):
+        """Start the worker threads (once)"""
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"ehr-worker-{i}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+        print(f"🧵 Started {self.workers} workers (queue limit {self.pending.maxsize})")
+
+    def submit(self, *args, key=None):
+        self.start()
+        self._evict_expired()
+        with self.lock:
+            if key is not None and key in self.active:
+                return self.active[key]
+            job = Job(args, key)
+            try:
+                self.pending.put_nowait(job)
+            except queue.Full:
+                raise QueueFull(f"{self.pending.maxsize} jobs are already queued")
+            self.jobs[job.id] = job
+            if key is not None:
+                self.active[key] = job
+        return job
+
+    def finished(self, result):
+        """Record an already-completed job (e.g. a cache hit) so it can be polled like any other"""
+        self._evict_expired()
+        job = Job(None)
+        job.cached = True
+        job.update(COMPLETED, result=result)
+        with self.lock:
+            self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def stats(self):
+        with self.lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return {
+            "workers": self.workers,
+            "queued": statuses.count(QUEUED),
+            "running": statuses.count(RUNNING),
+            "queue_limit": self.pending.maxsize,
+        }
+
+    def _evict_expired(self):
+        cutoff = time.time() - self.ttl
+        with self.lock:
+            expired = [job_id for job_id, job in self.jobs.items() if job.done and job.finished_at < cutoff]
+            for job_id in expired:
+                del self.jobs[job_id]
+
+    def _work(self):
+        while True:
+            job = self.pending.get()
+            job.update(RUNNING)
+            try:
+                job.update(COMPLETED, result=self.handler(*job.args))
+            except Exception as e:
+                print(f"Job {job.id} failed: {e}")
+                job.update(FAILED, error=str(e))
+            finally:
+                job.args = None  # Drop the uploaded bytes
+                with self.lock:
+                    if job.key is not None and self.active.get(job.key) is job:
+                        del self.active[job.key]
+                self.pending.task_done()
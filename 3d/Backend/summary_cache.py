@@ -0,0 +1,54 @@
+"""
+Content-addressed cache of EHR summaries.
+
+Summaries are keyed by the sha256 of the uploaded bytes, so re-uploading
+the same file (under any name) is answered without touching OpenAI.
+Entries expire `ttl` seconds after they were stored, and the least recently
+used ones are evicted beyond `max_entries`.
+"""
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def content_key(file_content):
+    return hashlib.sha256(file_content).hexdigest()
+
+
+class SummaryCache:
+    def __init__(self, ttl=86400, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expires_at, summary), least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, summary = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return summary
+
+    def put(self, key, summary):
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, summary)
+            self.entries.move_to_end(key)
+            self._evict()
+
+    def _evict(self):
+        now = time.time()
+        for key in [key for key, (expires_at, _) in self.entries.items() if expires_at < now]:
+            del self.entries[key]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
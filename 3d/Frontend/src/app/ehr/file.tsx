@@ -95,7 +95,14 @@ export const FileUpload: React.FC<{ onChange?: (files: File[]) => void }> = ({ o
         throw new Error(errorMsg);
       }
 
-      const result = await response.json();
+      let result = await response.json();
+      // Long uploads come back as a queued job (202): poll it until it finishes
+      while (response.status === 202 && result.status !== 'completed') {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        const poll = await fetch(`${API_CONFIG.BASE_URL}${result.status_url}`);
+        result = await poll.json();
+        if (!poll.ok) throw new Error(result.error || `HTTP error! status: ${poll.status}`);
+      }
       if (!result.response) throw new Error('No response data from server.');
       
       setProcessedData(result.response);
@@ -2,14 +2,85 @@ from openai import OpenAI
 import os
 import json
 import re
+import glob
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from prompt import DiagnosticsPrompt, PCCPrompt, UncertaintyPrompt, TreatmentPrompt
 
+# Judged benchmark sections: (section name, grading prompt, max points)
+BENCHMARK_SECTIONS = [
+    ("Diagnostics", DiagnosticsPrompt, 35),
+    ("Patient-Centered Communication", PCCPrompt, 55),
+    ("Uncertainty Management & Safety", UncertaintyPrompt, 50),
+    ("Treatment Recommendations", TreatmentPrompt, 30)
+]
+
+JUDGE_MODEL = "gpt-4o-mini"
+
+
+def section_key(section_name: str) -> str:
+    """Results key for a section, e.g. 'uncertainty_management_and_safety'"""
+    return section_name.lower().replace(" ", "_").replace("&", "and")
+
+
+class JudgeCache:
+    """Thread-safe on-disk cache of judge results keyed by conversation hash"""
+
+    def __init__(self, cache_file="judge_cache.json"):
+        self.cache_file = cache_file
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        if cache_file and os.path.exists(cache_file):
+            with open(cache_file, 'r') as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def make_key(model: str, section_name: str, max_points: int, prompt: str, conversation: str) -> str:
+        raw = "\n".join([model, section_name, str(max_points), prompt, conversation])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return result
+
+    def set(self, key, result):
+        with self.lock:
+            self.entries[key] = result
+
+    def save(self):
+        if not self.cache_file:
+            return
+        with self.lock:
+            tmp_file = self.cache_file + ".tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_file, self.cache_file)
+
+
 class MedicalBenchmark:
-    def __init__(self, client: OpenAI):
+    def __init__(self, client: OpenAI, cache: JudgeCache = None, model: str = JUDGE_MODEL):
         self.client = client
+        self.cache = cache
+        self.model = model
 
     def evaluate_response(self, prompt: str, conversation: str, section_name: str, max_points: int) -> dict:
+        cache_key = None
+        if self.cache is not None:
+            cache_key = JudgeCache.make_key(self.model, section_name, max_points, prompt, conversation)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
         evaluation_prompt = f"""
         {prompt}
         
@@ -52,7 +123,7 @@ class MedicalBenchmark:
         """
         
         response = self.client.chat.completions.create(
-            model="gpt-4o-mini",
+            model=self.model,
             messages=[{"role": "user", "content": evaluation_prompt}],
             temperature=0.1  # Lower temperature for more consistent JSON
         )
@@ -69,6 +140,9 @@ class MedicalBenchmark:
             # Validate the result has required fields
             if "total_score" not in result or "individual_scores" not in result:
                 raise json.JSONDecodeError("Missing required fields", response_text, 0)
+            # Only cache real judge output, never fallback estimates
+            if cache_key is not None:
+                self.cache.set(cache_key, result)
             return result
         except json.JSONDecodeError as e:
             print(f"JSON parsing failed for {section_name}: {e}")
@@ -155,7 +229,50 @@ def extract_doctor_responses(conversation_data):
             doctor_responses.append(exchange["message"])
     return "\n".join([f"Doctor: {response}" for response in doctor_responses])
 
-def run_benchmark(conversation_file="clinical_conversation.json"):
+def evaluate_sections(benchmark, doctor_conversation, max_workers=4):
+    """Judge all benchmark sections for one conversation concurrently"""
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(benchmark.evaluate_response, prompt, doctor_conversation, section_name, max_points): section_name
+            for section_name, prompt, max_points in BENCHMARK_SECTIONS
+        }
+        for future in as_completed(futures):
+            results[section_key(futures[future])] = future.result()
+
+    # Keep the canonical section order regardless of completion order
+    return {section_key(name): results[section_key(name)] for name, _, _ in BENCHMARK_SECTIONS}
+
+
+def build_benchmark_results(conversation_file, conversation_data, doctor_conversation, results, evaluation_date):
+    """Assemble the per-conversation results document"""
+    total_points = sum(evaluation["total_score"] for evaluation in results.values())
+    max_total_points = sum(max_points for _, _, max_points in BENCHMARK_SECTIONS)
+    overall_percentage = (total_points / max_total_points) * 100
+
+    return {
+        "metadata": {
+            "conversation_file": conversation_file,
+            "scenario": conversation_data['patient_scenario'],
+            "evaluation_date": evaluation_date,
+            "doctor_responses": doctor_conversation
+        },
+        "overall_performance": {
+            "total_score": total_points,
+            "max_possible_score": max_total_points,
+            "percentage": round(overall_percentage, 2),
+            "grade": get_letter_grade(overall_percentage)
+        },
+        "section_results": results,
+        "summary": {
+            "top_performing_areas": get_top_areas(results),
+            "areas_needing_improvement": get_weak_areas(results),
+            "recommendations": generate_recommendations(results)
+        }
+    }
+
+
+def run_benchmark(conversation_file="clinical_conversation.json", cache_file="judge_cache.json"):
     # Load conversation data
     with open(conversation_file, 'r') as f:
         conversation_data = json.load(f)
@@ -165,7 +282,8 @@ def run_benchmark(conversation_file="clinical_conversation.json"):
     
     # Initialize OpenAI client
     client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    benchmark = MedicalBenchmark(client)
+    cache = JudgeCache(cache_file)
+    benchmark = MedicalBenchmark(client, cache=cache)
     
     evaluation_date = datetime.now().strftime("%Y-%m-%d")
     
@@ -173,59 +291,26 @@ def run_benchmark(conversation_file="clinical_conversation.json"):
     print(f"Scenario: {conversation_data['patient_scenario']}")
     print(f"Date: {evaluation_date}\n")
     
-    # Define benchmark categories
-    benchmarks = [
-        ("Diagnostics", DiagnosticsPrompt, 35),
-        ("Patient-Centered Communication", PCCPrompt, 55),
-        ("Uncertainty Management & Safety", UncertaintyPrompt, 50),
-        ("Treatment Recommendations", TreatmentPrompt, 30)
-    ]
-    
-    # Run all benchmarks
-    results = {}
-    total_points = 0
-    max_total_points = 0
+    # Run all benchmark sections concurrently
+    results = evaluate_sections(benchmark, doctor_conversation)
+    cache.save()
     
-    for section_name, prompt, max_points in benchmarks:
+    for section_name, _, max_points in BENCHMARK_SECTIONS:
+        evaluation = results[section_key(section_name)]
         print(f"Evaluating: {section_name}")
         print("-" * 50)
         
-        evaluation = benchmark.evaluate_response(prompt, doctor_conversation, section_name, max_points)
-        results[section_name.lower().replace(" ", "_").replace("&", "and")] = evaluation
-        
-        total_points += evaluation["total_score"]
-        max_total_points += max_points
-        
         # Print summary
         print(f"Score: {evaluation['total_score']}/{max_points} ({evaluation['percentage']:.1f}%)")
         print(f"Strengths: {', '.join(evaluation['overall_assessment']['strengths'][:2])}")
         print(f"Areas for improvement: {', '.join(evaluation['overall_assessment']['weaknesses'][:2])}")
         print("\n")
     
-    # Calculate overall performance
-    overall_percentage = (total_points / max_total_points) * 100
-    
     # Create comprehensive benchmark results
-    benchmark_results = {
-        "metadata": {
-            "conversation_file": conversation_file,
-            "scenario": conversation_data['patient_scenario'],
-            "evaluation_date": evaluation_date,
-            "doctor_responses": doctor_conversation
-        },
-        "overall_performance": {
-            "total_score": total_points,
-            "max_possible_score": max_total_points,
-            "percentage": round(overall_percentage, 2),
-            "grade": get_letter_grade(overall_percentage)
-        },
-        "section_results": results,
-        "summary": {
-            "top_performing_areas": get_top_areas(results),
-            "areas_needing_improvement": get_weak_areas(results),
-            "recommendations": generate_recommendations(results)
-        }
-    }
+    benchmark_results = build_benchmark_results(
+        conversation_file, conversation_data, doctor_conversation, results, evaluation_date
+    )
+    overall = benchmark_results["overall_performance"]
     
     # Save detailed results
     output_filename = conversation_file.replace(".json", "_results.json")
@@ -234,13 +319,99 @@ def run_benchmark(conversation_file="clinical_conversation.json"):
     
     # Print final summary
     print("=" * 60)
-    print(f"OVERALL PERFORMANCE: {total_points}/{max_total_points} ({overall_percentage:.1f}%)")
-    print(f"GRADE: {get_letter_grade(overall_percentage)}")
+    print(f"OVERALL PERFORMANCE: {overall['total_score']}/{overall['max_possible_score']} ({overall['percentage']:.1f}%)")
+    print(f"GRADE: {overall['grade']}")
     print("=" * 60)
     print(f"Detailed results saved to {output_filename}")
     
     return benchmark_results
 
+def run_batch_benchmark(conversation_files, max_workers=16, cache_file="judge_cache.json",
+                        summary_file="batch_benchmark_summary.json"):
+    """
+    Evaluate many conversation files in one go. Every (file, section) judge call
+    goes into a single bounded thread pool, and judge results are cached by
+    conversation hash so re-running an eval set only pays for new conversations.
+    """
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    cache = JudgeCache(cache_file)
+    benchmark = MedicalBenchmark(client, cache=cache)
+    evaluation_date = datetime.now().strftime("%Y-%m-%d")
+
+    # Load every conversation up front (small files, avoids I/O inside the pool)
+    conversations = {}
+    for conversation_file in conversation_files:
+        with open(conversation_file, 'r') as f:
+            conversation_data = json.load(f)
+        conversations[conversation_file] = (conversation_data, extract_doctor_responses(conversation_data))
+
+    print(f"=== BATCH BENCHMARK: {len(conversations)} conversations x {len(BENCHMARK_SECTIONS)} sections "
+          f"({max_workers} workers) ===")
+
+    section_results = {conversation_file: {} for conversation_file in conversations}
+    failures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for conversation_file, (_, doctor_conversation) in conversations.items():
+            for section_name, prompt, max_points in BENCHMARK_SECTIONS:
+                future = executor.submit(benchmark.evaluate_response, prompt, doctor_conversation, section_name, max_points)
+                futures[future] = (conversation_file, section_name)
+
+        for completed, future in enumerate(as_completed(futures), 1):
+            conversation_file, section_name = futures[future]
+            try:
+                section_results[conversation_file][section_key(section_name)] = future.result()
+            except Exception as e:
+                print(f"❌ {conversation_file} / {section_name} failed: {e}")
+                failures.append({"conversation_file": conversation_file, "section": section_name, "error": str(e)})
+            if completed % 50 == 0 or completed == len(futures):
+                print(f"Progress: {completed}/{len(futures)} judge calls (cache hits: {cache.hits})")
+                cache.save()
+
+    all_results = []
+    for conversation_file, (conversation_data, doctor_conversation) in conversations.items():
+        results = section_results[conversation_file]
+        if len(results) != len(BENCHMARK_SECTIONS):
+            continue
+        results = {section_key(name): results[section_key(name)] for name, _, _ in BENCHMARK_SECTIONS}
+        benchmark_results = build_benchmark_results(
+            conversation_file, conversation_data, doctor_conversation, results, evaluation_date
+        )
+        with open(conversation_file.replace(".json", "_results.json"), "w") as f:
+            json.dump(benchmark_results, f, indent=2)
+        all_results.append(benchmark_results)
+
+    percentages = [r["overall_performance"]["percentage"] for r in all_results]
+    section_means = {
+        section_key(name): round(sum(r["section_results"][section_key(name)]["percentage"] for r in all_results) / len(all_results), 2)
+        for name, _, _ in BENCHMARK_SECTIONS
+    } if all_results else {}
+    summary = {
+        "evaluation_date": evaluation_date,
+        "num_conversations": len(conversations),
+        "num_scored": len(all_results),
+        "mean_percentage": round(sum(percentages) / len(percentages), 2) if percentages else None,
+        "section_mean_percentages": section_means,
+        "cache": {"hits": cache.hits, "misses": cache.misses},
+        "failures": failures,
+        "per_conversation": {
+            r["metadata"]["conversation_file"]: r["overall_performance"] for r in all_results
+        },
+    }
+    with open(summary_file, "w") as f:
+        json.dump(summary, f, indent=2)
+
+    print("=" * 60)
+    print(f"Scored {len(all_results)}/{len(conversations)} conversations")
+    if percentages:
+        print(f"MEAN OVERALL: {summary['mean_percentage']:.1f}%")
+        for name, mean in section_means.items():
+            print(f"  {name}: {mean:.1f}%")
+    print(f"Judge cache: {cache.hits} hits / {cache.misses} misses")
+    print(f"Summary saved to {summary_file}")
+    print("=" * 60)
+    return summary
+
 def get_letter_grade(percentage):
     """Convert percentage to letter grade"""
     if percentage >= 90: return "A"
@@ -275,4 +446,19 @@ def generate_recommendations(results):
     return recommendations
 
 if __name__ == "__main__":
-    run_benchmark() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Judge clinician conversations with the medical benchmark")
+    parser.add_argument("conversations", nargs="*", help="Conversation JSON files or glob patterns")
+    parser.add_argument("--workers", type=int, default=16, help="Max concurrent judge calls")
+    parser.add_argument("--cache", default="judge_cache.json", help="Judge result cache file")
+    parser.add_argument("--summary", default="batch_benchmark_summary.json", help="Batch summary output file")
+    args = parser.parse_args()
+
+    if not args.conversations:
+        run_benchmark(cache_file=args.cache)
+    else:
+        conversation_files = []
+        for pattern in args.conversations:
+            matches = sorted(glob.glob(pattern)) or [pattern]
+            conversation_files.extend(m for m in matches if not m.endswith("_results.json"))
+        run_batch_benchmark(conversation_files, max_workers=args.workers,
+                            cache_file=args.cache, summary_file=args.summary) 
\ No newline at end of file
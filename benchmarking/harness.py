@@ -0,0 +1,316 @@
+import os
+import json
+import time
+import random
+import argparse
+import statistics
+from datetime import datetime
+from openai import OpenAI
+
+from benchmark import (
+    BENCHMARK_SECTIONS,
+    JudgeCache,
+    MedicalBenchmark,
+    evaluate_sections,
+    extract_doctor_responses,
+    section_key,
+)
+from tracing import StageTracer
+import models
+import our_model
+
+# ============================================================================
+# Fixed vignette suite - keep ids stable so runs stay comparable
+# ============================================================================
+VIGNETTE_SUITE = [
+    {
+        "id": "tension_headache",
+        "scenario": "A 35-year-old office worker with a 3-day history of persistent, severe headaches.",
+        "profile": "You are a 35-year-old office worker with throbbing temple headaches for 3 days, about 6/10, only briefly relieved by ibuprofen. You sleep poorly and have had a stressful deadline at work. You are otherwise healthy.",
+        "opening": "Hi doctor, I've been having these really bad headaches for a few days now and they're not going away.",
+    },
+    {
+        "id": "community_pneumonia",
+        "scenario": "A 67-year-old retired teacher with fever, productive cough and shortness of breath for 4 days.",
+        "profile": "You are a 67-year-old retired teacher. For 4 days you've had fever up to 38.9C, a cough with yellow-green sputum, chills and feeling short of breath climbing stairs. Your right side hurts when you breathe deeply. You have type 2 diabetes on metformin.",
+        "opening": "I've had this awful cough and fever for a few days and now I get winded just walking up the stairs.",
+    },
+    {
+        "id": "appendicitis",
+        "scenario": "A 22-year-old university student with abdominal pain that moved to the right lower quadrant.",
+        "profile": "You are a 22-year-old student. Yesterday evening you had a dull ache around your belly button; overnight it moved to your lower right abdomen and is now sharp, 7/10, worse when you walk or cough. You feel nauseous, vomited once, and have no appetite. Mild fever.",
+        "opening": "My stomach started hurting last night and now it's really sharp down on the right side.",
+    },
+    {
+        "id": "hypothyroidism",
+        "scenario": "A 45-year-old woman with months of fatigue, weight gain and cold intolerance.",
+        "profile": "You are a 45-year-old accountant. Over the last 6 months you've felt exhausted, gained about 6 kg without eating more, feel cold when others don't, are constipated, and your skin is dry. Your periods have become heavier. Your mother has a thyroid problem.",
+        "opening": "I've just been so tired for months, and I keep gaining weight even though I'm not eating any differently.",
+    },
+    {
+        "id": "panic_disorder",
+        "scenario": "A 29-year-old software developer with recurrent episodes of palpitations and fear of dying.",
+        "profile": "You are a 29-year-old software developer. Over the last 2 months you've had sudden episodes of racing heart, chest tightness, sweating, shaking and a feeling you're about to die, peaking within 10 minutes. You now avoid the subway. You drink 4 coffees a day. You are embarrassed and worried it is your heart.",
+        "opening": "I keep having these attacks where my heart races and I honestly think I'm going to die.",
+    },
+    {
+        "id": "dvt",
+        "scenario": "A 58-year-old man with a swollen, painful left calf after a long-haul flight.",
+        "profile": "You are a 58-year-old sales manager. Three days after a 14-hour flight your left calf became swollen, warm, and tender, and it hurts to walk. You are a smoker and slightly overweight. No chest pain or shortness of breath.",
+        "opening": "My left leg has gotten swollen and sore since I got back from a long trip.",
+    },
+]
+
+QUALITY_METRICS = [section_key(name) for name, _, _ in BENCHMARK_SECTIONS] + ["overall"]
+COST_METRICS = ["latency_s", "prompt_tokens", "completion_tokens", "total_tokens", "cached_ratio", "turns"]
+
+
+# ============================================================================
+# Running a model over the suite
+# ============================================================================
+def run_openai_case(vignette, max_turns=10):
+    """Run OpenAIClinicianAI on one vignette; returns (conversation_data, metrics)"""
+    ai_clinician = models.OpenAIClinicianAI()
+    patient_agent = models.PatientAgent(profile=vignette["profile"])
+
+    start = time.perf_counter()
+    conversation_history = models.conduct_openai_conversation(
+        ai_clinician, patient_agent, vignette["opening"], max_turns
+    )
+    latency = time.perf_counter() - start
+
+    conversation_data = {"patient_scenario": vignette["scenario"], "conversation": conversation_history}
+    turns = sum(1 for turn in conversation_history if turn["speaker"] == "Doctor")
+    return conversation_data, dict(ai_clinician.usage, latency_s=latency, turns=turns)
+
+
+def run_multistage_case(vignette, max_iterations=12):
+    """Run MultiStageClinicianAI on one vignette with the shared OpenAI patient simulator"""
+    model_client = our_model.model_client
+    model_client.reset_usage()
+    tracer = StageTracer(run_id=vignette["id"])
+    clinician_ai = our_model.MultiStageClinicianAI(model_client, tracer=tracer)
+    patient_agent = models.PatientAgent(profile=vignette["profile"])
+
+    history = [{"speaker": "Patient", "message": vignette["opening"]}]
+
+    def respond_to_doctor(doctor_question, prev_vignette, call_info=None):
+        history.append({"speaker": "Doctor", "message": doctor_question})
+        reply = patient_agent.generate_response(history, call_info=call_info)
+        history.append({"speaker": "Patient", "message": reply})
+        return reply
+
+    start = time.perf_counter()
+    result = our_model.conduct_multi_stage_conversation(
+        clinician_ai, respond_to_doctor, vignette["opening"], max_iterations=max_iterations
+    )
+    latency = time.perf_counter() - start
+
+    # Close with the treatment plan so the judge sees it as a doctor turn
+    history.append({"speaker": "Doctor", "message": result["treatment_plan"]})
+    conversation_data = {"patient_scenario": vignette["scenario"], "conversation": history}
+    tracer.export_jsonl("stage_spans.jsonl")
+    return conversation_data, dict(
+        model_client.usage, latency_s=latency, turns=result["total_iterations"], stages=tracer.summary()
+    )
+
+
+MODEL_RUNNERS = {
+    "openai": run_openai_case,
+    "multistage": run_multistage_case,
+}
+
+
+def run_suite(model_name, run_name=None, output_dir="runs", cache_file="judge_cache.json", vignette_ids=None):
+    """Run one model over the vignette suite, judge every conversation and save the run file"""
+    runner = MODEL_RUNNERS[model_name]
+    run_name = run_name or f"{model_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    os.makedirs(output_dir, exist_ok=True)
+
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    cache = JudgeCache(cache_file)
+    benchmark = MedicalBenchmark(client, cache=cache)
+
+    suite = [v for v in VIGNETTE_SUITE if not vignette_ids or v["id"] in vignette_ids]
+    cases = []
+    for vignette in suite:
+        print(f"\n{'#' * 20} {model_name} :: {vignette['id']} {'#' * 20}")
+        try:
+            conversation_data, metrics = runner(vignette)
+        except Exception as e:
+            print(f"❌ {vignette['id']} failed: {e}")
+            cases.append({"vignette_id": vignette["id"], "error": str(e)})
+            continue
+
+        results = evaluate_sections(benchmark, extract_doctor_responses(conversation_data))
+        total = sum(r["total_score"] for r in results.values())
+        max_total = sum(max_points for _, _, max_points in BENCHMARK_SECTIONS)
+
+        scores = {key: result["percentage"] for key, result in results.items()}
+        scores["overall"] = round(total / max_total * 100, 2)
+        metrics["total_tokens"] = metrics.get("prompt_tokens", 0) + metrics.get("completion_tokens", 0)
+        prompt_tokens = metrics.get("prompt_tokens", 0)
+        metrics["cached_ratio"] = metrics.get("cached_tokens", 0) / prompt_tokens if prompt_tokens else 0.0
+
+        cases.append({
+            "vignette_id": vignette["id"],
+            "scores": scores,
+            "metrics": {key: metrics.get(key) for key in COST_METRICS},
+            "stages": metrics.get("stages"),
+            "conversation": conversation_data["conversation"],
+        })
+        print(f"✅ {vignette['id']}: overall {scores['overall']:.1f}% in {metrics['latency_s']:.1f}s, "
+              f"{metrics['total_tokens']} tokens")
+    cache.save()
+
+    run = {
+        "run_name": run_name,
+        "model": model_name,
+        "timestamp": datetime.now().isoformat(),
+        "suite": [v["id"] for v in suite],
+        "cases": cases,
+        "summary": summarize_run(cases),
+    }
+    output_file = os.path.join(output_dir, f"{run_name}.json")
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2, ensure_ascii=False)
+
+    print_summary(run)
+    print(f"💾 Run saved to {output_file}")
+    return output_file
+
+
+# ============================================================================
+# Statistics
+# ============================================================================
+def describe(values):
+    """Distribution summary for one metric"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        "n": len(values),
+        "mean": round(statistics.mean(values), 3),
+        "std": round(statistics.stdev(values), 3) if len(values) > 1 else 0.0,
+        "min": ordered[0],
+        "p50": ordered[len(ordered) // 2],
+        "max": ordered[-1],
+        "values": values,
+    }
+
+
+def bootstrap_ci(values, confidence=0.95, resamples=2000, seed=0):
+    """Percentile bootstrap CI of the mean (no scipy needed, fine for small suites)"""
+    if len(values) < 2:
+        return (values[0], values[0]) if values else (None, None)
+    rng = random.Random(seed)
+    means = sorted(
+        statistics.mean(rng.choices(values, k=len(values))) for _ in range(resamples)
+    )
+    lo = means[int((1 - confidence) / 2 * resamples)]
+    hi = means[int((1 + confidence) / 2 * resamples) - 1]
+    return round(lo, 3), round(hi, 3)
+
+
+def _case_values(case, metric):
+    if metric in case.get("scores", {}):
+        return case["scores"][metric]
+    return case.get("metrics", {}).get(metric)
+
+
+def summarize_run(cases):
+    scored = [case for case in cases if "scores" in case]
+    summary = {"num_cases": len(cases), "num_scored": len(scored)}
+    for metric in QUALITY_METRICS + COST_METRICS:
+        values = [_case_values(case, metric) for case in scored]
+        values = [v for v in values if v is not None]
+        summary[metric] = describe(values)
+        if values:
+            summary[metric]["ci95"] = bootstrap_ci(values)
+    return summary
+
+
+def compare_runs(baseline_file, candidate_file, output_file=None):
+    """Paired per-vignette deltas (candidate - baseline) with bootstrap 95% CIs"""
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(candidate_file, "r", encoding="utf-8") as f:
+        candidate = json.load(f)
+
+    base_cases = {c["vignette_id"]: c for c in baseline["cases"] if "scores" in c}
+    cand_cases = {c["vignette_id"]: c for c in candidate["cases"] if "scores" in c}
+    shared = sorted(set(base_cases) & set(cand_cases))
+
+    comparison = {
+        "baseline": baseline["run_name"],
+        "candidate": candidate["run_name"],
+        "paired_vignettes": shared,
+        "metrics": {},
+    }
+    for metric in QUALITY_METRICS + COST_METRICS:
+        deltas = []
+        for vignette_id in shared:
+            b = _case_values(base_cases[vignette_id], metric)
+            c = _case_values(cand_cases[vignette_id], metric)
+            if b is not None and c is not None:
+                deltas.append(c - b)
+        if not deltas:
+            continue
+        lo, hi = bootstrap_ci(deltas)
+        comparison["metrics"][metric] = {
+            "baseline_mean": round(statistics.mean(_case_values(base_cases[v], metric) for v in shared), 3),
+            "candidate_mean": round(statistics.mean(_case_values(cand_cases[v], metric) for v in shared), 3),
+            "mean_delta": round(statistics.mean(deltas), 3),
+            "ci95": [lo, hi],
+            "significant": lo is not None and (lo > 0 or hi < 0),
+        }
+
+    print("=" * 80)
+    print(f"📊 {comparison['candidate']} vs {comparison['baseline']} ({len(shared)} paired vignettes)")
+    print("=" * 80)
+    print(f"{'metric':<40}{'baseline':>10}{'candidate':>11}{'delta':>10}   95% CI")
+    for metric, row in comparison["metrics"].items():
+        flag = " *" if row["significant"] else ""
+        print(f"{metric:<40}{row['baseline_mean']:>10.2f}{row['candidate_mean']:>11.2f}"
+              f"{row['mean_delta']:>+10.2f}   [{row['ci95'][0]:+.2f}, {row['ci95'][1]:+.2f}]{flag}")
+    print("(* = CI excludes zero)")
+
+    if output_file:
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(comparison, f, indent=2)
+        print(f"💾 Comparison saved to {output_file}")
+    return comparison
+
+
+def print_summary(run):
+    summary = run["summary"]
+    print("=" * 60)
+    print(f"📊 {run['run_name']} ({summary['num_scored']}/{summary['num_cases']} scored)")
+    for metric in QUALITY_METRICS + COST_METRICS:
+        stats = summary.get(metric)
+        if stats:
+            print(f"  {metric:<40} mean {stats['mean']:>9.2f}  CI95 {stats['ci95']}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark harness over the fixed vignette suite")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run a model over the vignette suite")
+    run_parser.add_argument("--model", choices=sorted(MODEL_RUNNERS), required=True)
+    run_parser.add_argument("--name", default=None, help="Run name (defaults to model + timestamp)")
+    run_parser.add_argument("--output-dir", default="runs")
+    run_parser.add_argument("--cache", default="judge_cache.json")
+    run_parser.add_argument("--vignettes", nargs="*", default=None, help="Subset of vignette ids")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two saved runs")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--output", default=None)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run_suite(args.model, args.name, args.output_dir, args.cache, args.vignettes)
+    else:
+        compare_runs(args.baseline, args.candidate, args.output)
@@ -0,0 +1,220 @@
+import re
+import json
+import time
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Once an ANSWER: has started, any of these means the model has moved on to
+# hallucinating the next prompt block, so generation can stop there.
+ANSWER_STOP_SEQUENCES = ["\nInstruction:", "\nInput:", "\nOutput:", "\nTHINKING:"]
+END_RE = re.compile(r"\bEND\b")
+# Mid-stream, "END" may still be the start of a word ("ENDOCRINE"): only a
+# following non-word character confirms it
+STREAM_END_RE = re.compile(r"\bEND(?=\W)")
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) for endpoints that don't report usage"""
+    return max(1, len(text) // 4) if text else 0
+
+
+def find_early_stop(text, partial=False):
+    """
+    Return the index to cut the completion at, or None to keep generating.
+
+    Stops after the answer is complete: at a stop sequence following ANSWER:,
+    or right after an END marker inside the answer (END is kept so callers
+    can still detect it). With partial=True (a stream still in progress) an
+    END at the very end of the text is not trusted yet.
+    """
+    answer_at = text.find("ANSWER:")
+    if answer_at == -1:
+        return None
+    answer_body_at = answer_at + len("ANSWER:")
+    cut = None
+    for stop in ANSWER_STOP_SEQUENCES:
+        at = text.find(stop, answer_body_at)
+        if at != -1 and (cut is None or at < cut):
+            cut = at
+    end = (STREAM_END_RE if partial else END_RE).search(text, answer_body_at)
+    if end and (cut is None or end.end() < cut):
+        cut = end.end()
+    return cut
+
+
+class HuggingFaceInference:
+    """
+    Client for a HF Inference Endpoint (TGI).
+
+    - One pooled requests.Session per client, so turns reuse keep-alive
+      connections instead of a fresh TCP/TLS handshake per call.
+    - return_full_text=False on the wire: the prompt is never echoed back.
+      Set return_full_text=True on the client to get prompt + completion
+      locally for callers that still expect the old shape.
+    - Token streaming over SSE with early stop once the ANSWER: section is
+      complete (or END is emitted); closing the stream cancels generation.
+    """
+
+    def __init__(self, endpoint_url, api_token, stream=True, return_full_text=False,
+                 pool_size=16, timeout=120, temperature=0.7):
+        self.endpoint_url = endpoint_url
+        self.headers = {
+            "Authorization": f"Bearer {api_token}",
+            "Content-Type": "application/json",
+        }
+        self.stream = stream
+        self.return_full_text = return_full_text
+        self.timeout = timeout
+        self.temperature = temperature
+
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+        self.usage_lock = threading.Lock()
+
+    def reset_usage(self):
+        with self.usage_lock:
+            self.usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+
+    def close(self):
+        self.session.close()
+
+    def _payload(self, prompt, max_new_tokens, stream):
+        return {
+            "inputs": prompt,
+            "stream": stream,
+            "parameters": {
+                "max_new_tokens": max_new_tokens,
+                "temperature": self.temperature,
+                "do_sample": True,
+                "return_full_text": False,
+                "details": True,
+                # Server-side stops also cut non-streamed generations short
+                "stop": ANSWER_STOP_SEQUENCES,
+            },
+        }
+
+    def _post(self, prompt, max_new_tokens, stream, max_retries):
+        retries = 0
+        while True:
+            try:
+                response = self.session.post(
+                    self.endpoint_url,
+                    json=self._payload(prompt, max_new_tokens, stream),
+                    stream=stream,
+                    timeout=self.timeout,
+                )
+                # Endpoint cold starts / throttling are worth a short retry
+                if response.status_code in (429, 503) and retries < max_retries:
+                    response.close()
+                    retries += 1
+                    time.sleep(2 ** retries)
+                    continue
+                response.raise_for_status()
+                return response, retries
+
+            except requests.exceptions.RequestException as e:
+                print(f"❌ API request failed: {e}")
+                if hasattr(e, "response") and e.response is not None:
+                    print(f"Status: {e.response.status_code}")
+                    print(f"Response: {e.response.text}")
+                raise
+
+    def _read_stream(self, response, info):
+        """Accumulate SSE token events, stopping early once the answer is done"""
+        text = ""
+        completion_tokens = 0
+        payload_bytes = 0
+        start = time.perf_counter()
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                payload_bytes += len(line)
+                event = json.loads(line[len("data:"):].strip())
+                if "error" in event:
+                    raise RuntimeError(f"Endpoint stream error: {event['error']}")
+
+                token = event.get("token") or {}
+                if token.get("special"):
+                    continue
+                if not text:
+                    info["ttft_s"] = round(time.perf_counter() - start, 4)
+                text += token.get("text", "")
+                completion_tokens += 1
+
+                cut = find_early_stop(text, partial=True)
+                if cut is not None:
+                    text = text[:cut]
+                    info["early_stop"] = True
+                    break
+            else:
+                # The stream ended, so a trailing END is a whole word
+                cut = find_early_stop(text)
+                if cut is not None:
+                    text = text[:cut]
+        finally:
+            # Dropping the connection tells TGI to stop generating
+            response.close()
+
+        info["payload_bytes"] = payload_bytes
+        return text, completion_tokens
+
+    def _read_full(self, response, info):
+        info["payload_bytes"] = len(response.content)
+        result = response.json()
+
+        # Handle the response format
+        if isinstance(result, list) and len(result) > 0:
+            result = result[0]
+        if isinstance(result, dict):
+            text = result.get("generated_text", "")
+            details = result.get("details") or {}
+            completion_tokens = details.get("generated_tokens")
+        else:
+            text, completion_tokens = str(result), None
+
+        cut = find_early_stop(text)
+        if cut is not None:
+            text = text[:cut]
+        return text, completion_tokens
+
+    def generate(self, prompt, max_new_tokens=400, call_info=None, max_retries=2, stream=None):
+        """
+        call_info, if given, is filled with prompt/completion/cached token counts,
+        retries, cache_hit, ttft_s, payload_bytes and early_stop so callers can
+        attach them to a stage span.
+        """
+        stream = self.stream if stream is None else stream
+        info = {"ttft_s": None, "early_stop": False}
+
+        response, retries = self._post(prompt, max_new_tokens, stream, max_retries)
+        if stream:
+            completion, completion_tokens = self._read_stream(response, info)
+        else:
+            completion, completion_tokens = self._read_full(response, info)
+
+        prompt_tokens = estimate_tokens(prompt)
+        completion_tokens = completion_tokens or estimate_tokens(completion)
+        with self.usage_lock:
+            self.usage["calls"] += 1
+            self.usage["prompt_tokens"] += prompt_tokens
+            self.usage["completion_tokens"] += completion_tokens
+        if call_info is not None:
+            call_info.update(
+                info,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                retries=retries,
+                cache_hit=False,
+                # TGI doesn't report prefix-cache reuse
+                cached_tokens=0,
+            )
+
+        return prompt + completion if self.return_full_text else completion
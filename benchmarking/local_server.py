@@ -0,0 +1,312 @@
+"""
+Local stand-in for the HF Inference Endpoint used by our_model.py / true.py.
+
+Speaks the same TGI payload format ({"inputs", "parameters", "stream"}), both
+as a plain JSON response and as SSE token streams, so the whole multi-stage
+pipeline can be load-tested and profiled offline:
+
+    python local_server.py --backend scripted --ttft-ms 300 --tokens-per-sec 40
+    HF_ENDPOINT_URL=http://127.0.0.1:8080 python our_model.py
+
+Backends:
+    scripted  deterministic THINKING/ANSWER responder keyed on the stage instruction
+    hf        a small causal LM on CPU via transformers (--model distilgpt2, ...)
+
+Requests are collected into batches (--max-batch-size within --batch-window-ms)
+before hitting the backend, and latency is simulated per batch and per token.
+"""
+
+import re
+import json
+import time
+import queue
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOKEN_RE = re.compile(r"\s*\S+|\s+")
+
+
+# ============================================================================
+# Backends
+# ============================================================================
+class ScriptedBackend:
+    """Canned, stage-aware THINKING/ANSWER outputs; no model needed"""
+
+    QUESTIONS = [
+        "When did this first start, and has it changed since then?",
+        "Can you describe exactly where you feel it and whether it spreads anywhere?",
+        "Have you noticed anything that makes it better or worse?",
+        "Have you had any fever, weight changes, or night sweats?",
+        "Do you take any medications or have any other medical conditions?",
+        "Has anyone in your family had similar problems?",
+    ]
+
+    def __init__(self, end_after=3, seed=0):
+        self.end_after = end_after
+        self.rng = random.Random(seed)
+        self.late_calls = 0
+        self.lock = threading.Lock()
+
+    def respond(self, prompt):
+        head = prompt[:600]
+        if "clinical summarizer" in head:
+            return (" The patient describes their main complaint, its timing and severity, and prior self-treatment."
+                    "\nANSWER: Chief complaint and history as reported; no red flags documented so far.")
+        if "behavioral identifying agent" in head:
+            return (" The patient answers openly but sounds anxious."
+                    "\nANSWER: Mild health anxiety; otherwise reliable historian.")
+        if "board-certified clinician" in head:
+            return (" Start with conservative, evidence-based management and arrange follow-up."
+                    "\nANSWER: Initial management with symptomatic treatment, safety-net advice, and review in 1-2 weeks.")
+        if "diagnostic reasoning model (Late" in head:
+            with self.lock:
+                self.late_calls += 1
+                done = self.late_calls % self.end_after == 0
+            return (" The findings now point to a single leading diagnosis."
+                    "\nANSWER: 1. Leading diagnosis 2. Alternative diagnosis" + (" END" if done else ""))
+        if "diagnostic reasoning model" in head:
+            return (" Considering common and serious causes that fit the vignette."
+                    "\nANSWER: 1. Most likely diagnosis 2. Second possibility 3. Must-not-miss condition")
+        if "questioning agent" in head:
+            with self.lock:
+                question = self.rng.choice(self.QUESTIONS)
+            return f" Need to narrow the differential with a targeted question.\nANSWER: {question}"
+        # Anything else is treated as the patient agent
+        return " ANSWER: It started a few days ago and it's been bothering me most of the day."
+
+    def generate_batch(self, prompts, max_new_tokens):
+        return [self.respond(prompt) for prompt in prompts]
+
+
+class TransformersBackend:
+    """Small causal LM on CPU; prompts in a batch are left-padded and generated together"""
+
+    def __init__(self, model_name, temperature=0.7):
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.model = AutoModelForCausalLM.from_pretrained(model_name)
+        self.model.eval()
+        self.temperature = temperature
+
+    def generate_batch(self, prompts, max_new_tokens):
+        import torch
+
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True, truncation=True, max_length=1024)
+        with torch.no_grad():
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=True,
+                temperature=self.temperature,
+                pad_token_id=self.tokenizer.pad_token_id,
+            )
+        new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+        return self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+
+
+# ============================================================================
+# Dynamic batching
+# ============================================================================
+class Batcher:
+    """Collects concurrent requests into batches for the backend"""
+
+    def __init__(self, backend, max_batch_size=8, batch_window_ms=20, batch_latency_ms=0):
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window_ms / 1000
+        self.batch_latency = batch_latency_ms / 1000
+        self.requests = queue.Queue()
+        self.stats = {"batches": 0, "requests": 0, "max_batch": 0}
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def submit(self, prompt, max_new_tokens):
+        done = threading.Event()
+        slot = {"prompt": prompt, "max_new_tokens": max_new_tokens, "done": done}
+        self.requests.put(slot)
+        done.wait()
+        if "error" in slot:
+            raise slot["error"]
+        return slot["text"]
+
+    def _loop(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                if self.batch_latency:
+                    time.sleep(self.batch_latency)
+                texts = self.backend.generate_batch(
+                    [slot["prompt"] for slot in batch],
+                    max(slot["max_new_tokens"] for slot in batch),
+                )
+                for slot, text in zip(batch, texts):
+                    slot["text"] = text
+            except Exception as e:
+                for slot in batch:
+                    slot["error"] = e
+
+            self.stats["batches"] += 1
+            self.stats["requests"] += len(batch)
+            self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+            for slot in batch:
+                slot["done"].set()
+
+
+# ============================================================================
+# HTTP handler
+# ============================================================================
+def apply_stops(text, stops):
+    cut = len(text)
+    for stop in stops or []:
+        at = text.find(stop)
+        if at != -1:
+            cut = min(cut, at)
+    return text[:cut]
+
+
+def truncate_tokens(text, max_new_tokens):
+    tokens = TOKEN_RE.findall(text)
+    return tokens[:max_new_tokens]
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "LocalInference/0.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path in ("/health", "/info"):
+            self._send_json(200, {"status": "ok", "batching": self.server.batcher.stats})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            prompt = body["inputs"]
+        except (ValueError, KeyError) as e:
+            self._send_json(400, {"error": f"bad request: {e}"})
+            return
+
+        params = body.get("parameters", {})
+        max_new_tokens = int(params.get("max_new_tokens", 400))
+        stream = bool(body.get("stream", False))
+        config = self.server.config
+
+        # Time to first token: queueing + batch + configured prefill latency
+        start = time.perf_counter()
+        try:
+            text = self.server.batcher.submit(prompt, max_new_tokens)
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+        tokens = truncate_tokens(apply_stops(text, params.get("stop")), max_new_tokens)
+        prefill = config.ttft_ms / 1000 * (1 + random.uniform(-config.jitter, config.jitter))
+        time.sleep(max(0.0, prefill - (time.perf_counter() - start)))
+        per_token = 1 / config.tokens_per_sec if config.tokens_per_sec else 0
+
+        if not stream:
+            time.sleep(per_token * len(tokens))
+            generated = "".join(tokens)
+            if params.get("return_full_text"):
+                generated = prompt + generated
+            self._send_json(200, [{
+                "generated_text": generated,
+                "details": {"generated_tokens": len(tokens), "finish_reason": "length"},
+            }])
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, token in enumerate(tokens):
+                last = i == len(tokens) - 1
+                event = {
+                    "index": i,
+                    "token": {"id": i, "text": token, "logprob": 0.0, "special": False},
+                    "generated_text": "".join(tokens) if last else None,
+                    "details": {"generated_tokens": len(tokens), "finish_reason": "length"} if last else None,
+                }
+                self._write_chunk(f"data:{json.dumps(event)}\n\n".encode("utf-8"))
+                time.sleep(per_token)
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client stopped early (e.g. ANSWER complete); nothing left to do
+            pass
+
+
+def serve(args):
+    if args.backend == "hf":
+        backend = TransformersBackend(args.model)
+    else:
+        backend = ScriptedBackend(end_after=args.end_after, seed=args.seed)
+
+    server = ThreadingHTTPServer((args.host, args.port), InferenceHandler)
+    server.daemon_threads = True
+    server.config = args
+    server.verbose = args.verbose
+    server.batcher = Batcher(backend, args.max_batch_size, args.batch_window_ms, args.batch_latency_ms)
+
+    print(f"🚀 Local inference server ({args.backend}) on http://{args.host}:{args.port}")
+    print(f"   ttft={args.ttft_ms}ms tokens/s={args.tokens_per_sec} "
+          f"batch<= {args.max_batch_size} window={args.batch_window_ms}ms")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n📊 Batching stats: {server.batcher.stats}")
+        server.server_close()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Local stand-in for the HF inference endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--backend", choices=["scripted", "hf"], default="scripted")
+    parser.add_argument("--model", default="distilgpt2", help="Model for --backend hf")
+    parser.add_argument("--ttft-ms", type=float, default=200, help="Simulated time to first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=50, help="Simulated decode speed (0 = instant)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Relative +/- jitter on TTFT")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--batch-window-ms", type=float, default=20)
+    parser.add_argument("--batch-latency-ms", type=float, default=0, help="Extra fixed cost per batch")
+    parser.add_argument("--end-after", type=int, default=3, help="Scripted: emit END every N late-stage diagnoses")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true")
+    return parser
+
+
+if __name__ == "__main__":
+    serve(build_parser().parse_args())
@@ -10,9 +10,16 @@ except TypeError:
     print("Error: OPENAI_API_KEY not set. Please set the environment variable.")
     exit()
 
+def cached_prompt_tokens(usage):
+    """Prompt tokens OpenAI served from its prompt cache (0 if not reported)"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", 0) or 0
+
+
 class OpenAIClinicianAI:
     def __init__(self, model="gpt-4o-mini"):
         self.model = model
+        self.usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
         self.system_prompt = """
 You are an expert AI clinician. Your goal is to conduct a diagnostic interview with a patient.
 - Ask clear, targeted questions to understand the patient's symptoms and history.
@@ -34,10 +41,24 @@ You are an expert AI clinician. Your goal is to conduct a diagnostic interview w
             temperature=0.7,
             max_tokens=300,
         )
+        self.usage["calls"] += 1
+        if response.usage:
+            self.usage["prompt_tokens"] += response.usage.prompt_tokens
+            self.usage["completion_tokens"] += response.usage.completion_tokens
+            self.usage["cached_tokens"] += cached_prompt_tokens(response.usage)
         return response.choices[0].message.content.strip()
 
+    def reset_usage(self):
+        self.usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+
+PATIENT_SYSTEM_TEMPLATE = """
+You are roleplaying a patient. Here is your scenario:
+{profile}
+- Respond naturally to the doctor's questions based on this profile. Keep your responses concise.
+"""
+
 class PatientAgent:
-    def __init__(self, model="gpt-4o-mini"):
+    def __init__(self, model="gpt-4o-mini", profile=None):
         self.model = model
         self.system_prompt = """
 You are roleplaying a patient. Here is your scenario:
@@ -49,8 +70,11 @@ You are a 35-year-old office worker who has been experiencing persistent headach
 - You are otherwise healthy with no significant medical history.
 - Respond naturally to the doctor's questions based on this profile. You are a little anxious about the situation. Keep your responses concise.
 """
+        if profile:
+            self.system_prompt = PATIENT_SYSTEM_TEMPLATE.format(profile=profile)
 
-    def generate_response(self, conversation_history):
+    def generate_response(self, conversation_history, call_info=None):
+        """call_info, if given, is filled with the call's prompt/completion/cached token counts"""
         messages = [{"role": "system", "content": self.system_prompt}]
         for turn in conversation_history:
             role = "user" if turn['speaker'] == "Patient" else "assistant"
@@ -62,19 +86,24 @@ You are a 35-year-old office worker who has been experiencing persistent headach
             temperature=0.8,
             max_tokens=150,
         )
+        if call_info is not None and response.usage:
+            call_info.update(
+                prompt_tokens=response.usage.prompt_tokens,
+                completion_tokens=response.usage.completion_tokens,
+                cached_tokens=cached_prompt_tokens(response.usage),
+            )
         return response.choices[0].message.content.strip()
 
-def run_openai_conversation(max_turns=10):
-    ai_clinician = OpenAIClinicianAI()
-    patient_agent = PatientAgent()
-    
-    patient_scenario = "A 35-year-old office worker with a 3-day history of persistent, severe headaches."
-    
-    # Initial patient response to start the conversation
-    patient_response = "Hi doctor, I've been having these really bad headaches for a few days now and they're not going away."
-    conversation_history = [{"speaker": "Patient", "message": patient_response}]
+def is_concluding(doctor_message):
+    """Heuristic end condition for the OpenAI doctor"""
+    text = doctor_message.lower()
+    return "recommend" in text or "plan is to" in text or "propose we" in text
+
+def conduct_openai_conversation(ai_clinician, patient_agent, opening_message, max_turns=10):
+    """Alternate doctor/patient turns until the doctor concludes or max_turns is hit"""
+    conversation_history = [{"speaker": "Patient", "message": opening_message}]
     
-    print(f"Patient: {patient_response}")
+    print(f"Patient: {opening_message}")
 
     for i in range(max_turns):
         print(f"\n--- Turn {i+1} ---")
@@ -85,7 +114,7 @@ def run_openai_conversation(max_turns=10):
         conversation_history.append({"speaker": "Doctor", "message": doctor_question})
         
         # Check for end condition from doctor
-        if "recommend" in doctor_question.lower() or "plan is to" in doctor_question.lower() or "propose we" in doctor_question.lower():
+        if is_concluding(doctor_question):
              print("\n🏁 Doctor concluding conversation.")
              break
 
@@ -94,6 +123,18 @@ def run_openai_conversation(max_turns=10):
         print(f"💬 Patient: {patient_response}")
         conversation_history.append({"speaker": "Patient", "message": patient_response})
 
+    return conversation_history
+
+def run_openai_conversation(max_turns=10):
+    ai_clinician = OpenAIClinicianAI()
+    patient_agent = PatientAgent()
+    
+    patient_scenario = "A 35-year-old office worker with a 3-day history of persistent, severe headaches."
+    
+    # Initial patient response to start the conversation
+    patient_response = "Hi doctor, I've been having these really bad headaches for a few days now and they're not going away."
+    conversation_history = conduct_openai_conversation(ai_clinician, patient_agent, patient_response, max_turns)
+
     print("\n✅ Conversation finished.")
     
     # Save conversation to file
@@ -1,60 +1,23 @@
-import requests
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from hf_client import END_RE, HuggingFaceInference
+from stage_graph import StageGraph
+from tracing import StageTracer
+
 # ============================================================================
 # REPLACE THESE WITH YOUR ACTUAL VALUES
 # ============================================================================
-ENDPOINT_URL = "cloudurl"  # Your endpoint URL from the screenshot
+ENDPOINT_URL = os.getenv("HF_ENDPOINT_URL", "cloudurl")  # Your endpoint URL (or a local_server.py URL)
 HF_TOKEN = "huggingface"  # Your HuggingFace token
 
-class HuggingFaceInference:
-    def __init__(self, endpoint_url, api_token):
-        self.endpoint_url = endpoint_url
-        self.headers = {
-            "Authorization": f"Bearer {api_token}",
-            "Content-Type": "application/json",
-        }
-
-    def generate(self, prompt, max_new_tokens=400):
-        payload = {
-            "inputs": prompt,
-            "parameters": {
-                "max_new_tokens": max_new_tokens,
-                "temperature": 0.7,
-                "do_sample": True,
-                "return_full_text": True,
-            },
-        }
-
-        try:
-            response = requests.post(
-                self.endpoint_url, headers=self.headers, json=payload
-            )
-            response.raise_for_status()
-
-            result = response.json()
-
-            # Handle the response format
-            if isinstance(result, list) and len(result) > 0:
-                generated_text = result[0].get("generated_text", "")
-            else:
-                generated_text = str(result)
-
-            return generated_text
-
-        except requests.exceptions.RequestException as e:
-            print(f"❌ API request failed: {e}")
-            if hasattr(e, "response") and e.response is not None:
-                print(f"Status: {e.response.status_code}")
-                print(f"Response: {e.response.text}")
-            raise
-
 
 class MultiStageClinicianAI:
-    def __init__(self, model_client):
+    def __init__(self, model_client, tracer=None):
         self.model_client = model_client
+        self.tracer = tracer or StageTracer()
         self.stage_thresholds = {
             'early': (0, 3),    # Iterations 0-3
             'middle': (4, 7),   # Iterations 4-7
@@ -87,6 +50,23 @@ class MultiStageClinicianAI:
             'late_questions': "You are a questioning agent (Late Stage). Based on narrowed differentials and previous dialogue, generate a focused question that would help confirm or eliminate the final 1-2 suspected diagnoses."
         }
 
+    def _prompt(self, prompt_key, input_text):
+        """
+        Build a stage prompt. The "Instruction: ..." line is static per stage
+        and always comes first, byte-identical across calls, so prefix caches
+        (provider-side or the local engine's KV cache) can reuse it; only the
+        Input part changes from turn to turn.
+        """
+        return f"\nInstruction: {self.prompts[prompt_key]}\nInput: {input_text}\nOutput: THINKING:\n"
+
+    def _generate(self, stage, input_text, max_new_tokens):
+        """Call the model inside a tracing span for this stage"""
+        with self.tracer.span(stage) as span:
+            output = self.model_client.generate(
+                self._prompt(stage, input_text), max_new_tokens=max_new_tokens, call_info=span
+            )
+        return output
+
     def determine_stage(self, iteration):
         """Determine current stage based on iteration number"""
         if iteration <= self.stage_thresholds['early'][1]:
@@ -98,37 +78,22 @@ class MultiStageClinicianAI:
 
     def generate_clinical_summary(self, patient_response, prev_vignette=""):
         """Generate clinical summary using summarizer prompt"""
-        input_text = f"""
-Instruction: {self.prompts['summarizer']}
-Input: {patient_response} Previous Vignette: {prev_vignette}
-Output: THINKING: 
-"""
-        
-        output = self.model_client.generate(input_text, max_new_tokens=400)
+        input_text = f"{patient_response} Previous Vignette: {prev_vignette}"
+        output = self._generate('summarizer', input_text, max_new_tokens=400)
         self.all_outputs['summarizer'].append(output)
         return output
 
     def generate_behavioral_analysis(self, patient_responses):
         """Generate behavioral analysis"""
-        input_text = f"""
-Instruction: {self.prompts['behavioral']}
-Input: {' '.join(patient_responses)}
-Output: THINKING: 
-"""
-        
-        output = self.model_client.generate(input_text, max_new_tokens=300)
+        input_text = ' '.join(patient_responses)
+        output = self._generate('behavioral', input_text, max_new_tokens=300)
         self.all_outputs['behavioral'].append(output)
         return output
 
     def generate_treatment_plan(self, diagnosis, vignette):
         """Generate treatment plan"""
-        input_text = f"""
-Instruction: {self.prompts['treatment']}
-Input: DIAGNOSIS: {diagnosis} VIGNETTE: {vignette}
-Output: THINKING: 
-"""
-        
-        output = self.model_client.generate(input_text, max_new_tokens=400)
+        input_text = f"DIAGNOSIS: {diagnosis} VIGNETTE: {vignette}"
+        output = self._generate('treatment', input_text, max_new_tokens=400)
         self.all_outputs['treatment'].append(output)
         return output
 
@@ -137,25 +102,13 @@ Output: THINKING:
         prompt_key = f"{stage}_diagnostic"
         
         if stage == 'early':
-            input_text = f"""
-Instruction: {self.prompts[prompt_key]}
-Input: {vignette}
-Output: THINKING:
-"""
+            input_text = vignette
         elif stage == 'middle':
-            input_text = f"""
-Instruction: {self.prompts[prompt_key]}
-Input: VIGNETTE: {vignette} PREVIOUS DIAGNOSIS: {prev_diagnosis} CONVERSATION: {conversation_history}
-Output: THINKING:
-"""
+            input_text = f"VIGNETTE: {vignette} PREVIOUS DIAGNOSIS: {prev_diagnosis} CONVERSATION: {conversation_history}"
         else:  # late
-            input_text = f"""
-Instruction: {self.prompts[prompt_key]}
-Input: VIGNETTE: {vignette} FULL CONVERSATION: {conversation_history}
-Output: THINKING:
-"""
+            input_text = f"VIGNETTE: {vignette} FULL CONVERSATION: {conversation_history}"
         
-        output = self.model_client.generate(input_text, max_new_tokens=400)
+        output = self._generate(prompt_key, input_text, max_new_tokens=400)
         self.all_outputs[prompt_key].append(output)
         return output
 
@@ -164,25 +117,13 @@ Output: THINKING:
         prompt_key = f"{stage}_questions"
         
         if stage == 'early':
-            input_text = f"""
-Instruction: {self.prompts[prompt_key]}
-Input: VIGNETTE: {vignette} DIAGNOSIS: {diagnosis} PREVIOUS Questions: {prev_questions} Conversation History: {conversation_history}
-Output: THINKING:
-"""
+            input_text = f"VIGNETTE: {vignette} DIAGNOSIS: {diagnosis} PREVIOUS Questions: {prev_questions} Conversation History: {conversation_history}"
         elif stage == 'middle':
-            input_text = f"""
-Instruction: {self.prompts[prompt_key]}
-Input: VIGNETTE: {vignette} CURRENT DIAGNOSIS: {diagnosis} PREVIOUS Questions: {prev_questions} CONVERSATION: {conversation_history}
-Output: THINKING:
-"""
+            input_text = f"VIGNETTE: {vignette} CURRENT DIAGNOSIS: {diagnosis} PREVIOUS Questions: {prev_questions} CONVERSATION: {conversation_history}"
         else:  # late
-            input_text = f"""
-Instruction: {self.prompts[prompt_key]}
-Input: VIGNETTE: {vignette} NARROWED DIFFERENTIALS: {diagnosis} PREVIOUS DIALOGUE: {conversation_history}
-Output: THINKING:
-"""
+            input_text = f"VIGNETTE: {vignette} NARROWED DIFFERENTIALS: {diagnosis} PREVIOUS DIALOGUE: {conversation_history}"
         
-        output = self.model_client.generate(input_text, max_new_tokens=400)
+        output = self._generate(prompt_key, input_text, max_new_tokens=400)
         self.all_outputs[prompt_key].append(output)
         return output
 
@@ -207,8 +148,9 @@ Output: THINKING:
                 print(f"💾 Saved {filename}")
 
     def check_for_end_condition(self, diagnostic_output):
-        """Check if the diagnostic output contains END signal"""
-        return "END" in diagnostic_output.upper()
+        """Check if the diagnostic output's answer contains a standalone END signal"""
+        # Case-sensitive and word-bounded: upper() + substring matched RECOMMEND, ENDOCRINE, ...
+        return bool(END_RE.search(diagnostic_output.split("ANSWER:", 1)[-1]))
 
 
 class PatientAgent:
@@ -217,8 +159,8 @@ class PatientAgent:
         self.patient_profile = {}
         self.conversation_history = []
     
-    def generate_response(self, doctor_question, patient_context=""):
-        """Generate patient response to doctor's question"""
+    def generate_response(self, doctor_question, patient_context="", call_info=None):
+        """Generate patient response to doctor's question (call_info: the stage span to fill)"""
         prompt = f"""
 You are a 35-year-old office worker with persistent headaches for 3 days. The pain is throbbing, located in your temples, and rates about 6/10 in intensity. You've tried ibuprofen but it only helps temporarily. You're worried because you've never had headaches this severe before.
 
@@ -228,7 +170,7 @@ Respond naturally as the patient:
 """
         
         try:
-            response = self.model_client.generate(prompt, max_new_tokens=150)
+            response = self.model_client.generate(prompt, max_new_tokens=150, call_info=call_info)
             # Extract just the patient response part
             if "ANSWER:" in response:
                 patient_response = response.split("ANSWER:")[-1].strip()
@@ -288,21 +230,29 @@ def test_connection():
         return False
 
 
-def run_multi_stage_conversation():
-    """Run the multi-stage clinical conversation"""
-    # Test connection first
-    if not test_connection():
-        print("Please check your ENDPOINT_URL and HF_TOKEN")
-        return
+def extract_doctor_question(question_output):
+    """Pull the question to ask out of a questioner THINKING/ANSWER output"""
+    return question_output.split("ANSWER:")[-1].strip() if "ANSWER:" in question_output else question_output.strip()
 
-    print("\n" + "=" * 80)
-    print("🏥 Starting Multi-Stage Clinical Diagnostic Conversation")
-    print("=" * 80)
 
-    # Initialize agents
-    clinician_ai = MultiStageClinicianAI(model_client)
-    patient_agent = PatientAgent(model_client)
-    
+def _preview(text, limit=200):
+    return text[:limit] + "..." if len(text) > limit else text
+
+
+def conduct_multi_stage_conversation(clinician_ai, respond_to_doctor, initial_response, max_iterations=12,
+                                     max_workers=3):
+    """
+    Drive the multi-stage clinician against a patient until END or max_iterations.
+
+    respond_to_doctor(doctor_question, prev_vignette, call_info=None) returns the
+    patient's reply, filling call_info (the "patient" span) with its token usage.
+
+    Each turn is a StageGraph: summary -> diagnosis -> question -> patient is the
+    critical path, while the behavioral analysis (which only needs the patient
+    responses so far) runs alongside it and overlaps the patient's reply. In the
+    late stage the END check gates question vs. treatment. max_workers=1
+    reproduces the old strictly serial order.
+    """
     # Conversation tracking
     conversation = []
     prev_questions = []
@@ -311,102 +261,147 @@ def run_multi_stage_conversation():
     
     # Initial patient presentation
     conversation.append("Doctor: What brings you in today?")
-    initial_response = "I am a 35-year-old office worker who has been experiencing persistent headaches for 3 days. The pain is throbbing, located in my temples, and rates about 6/10 in intensity. I've tried ibuprofen but it only helps temporarily. I'm worried because I've never had headaches this severe before."
     conversation.append(f"Patient: {initial_response}")
     patient_responses.append(initial_response)
     
     current_diagnosis = ""
+    treatment_plan = ""
     
-    # Main conversation loop
-    max_iterations = 12
-    for iteration in range(max_iterations):
-        current_stage = clinician_ai.determine_stage(iteration)
-        
-        print(f"\n{'='*25} Iteration {iteration+1} - {current_stage.upper()} STAGE {'='*25}")
-        
-        # 1. Clinical Summary Generation
-        print("🔄 Generating clinical summary...")
-        clinical_summary = clinician_ai.generate_clinical_summary(
-            patient_responses[-1], prev_vignette
-        )
-        print("📋 Clinical Summary:")
-        print(clinical_summary[:200] + "..." if len(clinical_summary) > 200 else clinical_summary)
-        
-        # 2. Behavioral Analysis (every few iterations)
-        if iteration % 3 == 0:
-            print("\n🔄 Generating behavioral analysis...")
-            behavioral_analysis = clinician_ai.generate_behavioral_analysis(patient_responses)
-            print("🧠 Behavioral Analysis:")
-            print(behavioral_analysis[:200] + "..." if len(behavioral_analysis) > 200 else behavioral_analysis)
-        
-        # 3. Diagnostic Reasoning (stage-specific)
-        print(f"\n🔄 Generating {current_stage} stage diagnostic reasoning...")
-        diagnostic_reasoning = clinician_ai.generate_diagnostic_reasoning(
-            current_stage, 
-            clinical_summary, 
-            current_diagnosis, 
-            ' '.join(conversation)
-        )
-        print(f"🩺 {current_stage.title()} Stage Diagnosis:")
-        print(diagnostic_reasoning[:200] + "..." if len(diagnostic_reasoning) > 200 else diagnostic_reasoning)
-        
-        # Check for END condition in late stage
-        if current_stage == 'late' and clinician_ai.check_for_end_condition(diagnostic_reasoning):
-            print("\n🏁 END condition detected. Generating final treatment plan...")
-            treatment_plan = clinician_ai.generate_treatment_plan(diagnostic_reasoning, clinical_summary)
-            print("💊 Treatment Plan:")
-            print(treatment_plan[:300] + "..." if len(treatment_plan) > 300 else treatment_plan)
-            break
-        
-        # 4. Question Generation (stage-specific)
-        print(f"\n🔄 Generating {current_stage} stage question...")
-        question_output = clinician_ai.generate_question(
-            current_stage,
-            clinical_summary,
-            diagnostic_reasoning,
-            prev_questions,
-            ' '.join(conversation)
-        )
-        
-        # Extract the actual question from the output
-        doctor_question = question_output.split("ANSWER:")[-1].strip() if "ANSWER:" in question_output else question_output.strip()
-        
-        print(f"❓ {current_stage.title()} Stage Question:")
-        print(question_output[:200] + "..." if len(question_output) > 200 else question_output)
-        
-        # 5. Patient Response
-        print(f"\n🩺 Doctor: {doctor_question}")
-        conversation.append(f"Doctor: {doctor_question}")
-        prev_questions.append(doctor_question)
-        
-        patient_response = patient_agent.generate_response(doctor_question, prev_vignette)
-        print(f"👤 Patient: {patient_response}")
-        conversation.append(f"Patient: {patient_response}")
-        patient_responses.append(patient_response)
-        
-        # Update for next iteration
-        prev_vignette = clinical_summary
-        current_diagnosis = diagnostic_reasoning
-        
-        print(f"\n{'='*80}")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Main conversation loop
+        for iteration in range(max_iterations):
+            current_stage = clinician_ai.determine_stage(iteration)
+            
+            print(f"\n{'='*25} Iteration {iteration+1} - {current_stage.upper()} STAGE {'='*25}")
+            
+            # Snapshot turn inputs so concurrently running stages see a consistent view
+            transcript = ' '.join(conversation)
+            responses_so_far = list(patient_responses)
+            vignette_before = prev_vignette
+            diagnosis_before = current_diagnosis
+            questions_so_far = list(prev_questions)
+
+            def is_end(results, stage=current_stage):
+                return stage == 'late' and clinician_ai.check_for_end_condition(results['diagnosis'])
+
+            graph = StageGraph(executor)
+            # 1. Clinical Summary Generation
+            graph.add('summary', lambda r: clinician_ai.generate_clinical_summary(
+                responses_so_far[-1], vignette_before
+            ))
+            # 2. Behavioral Analysis (every few iterations, off the critical path)
+            graph.add('behavioral', lambda r: clinician_ai.generate_behavioral_analysis(responses_so_far),
+                      when=lambda r, i=iteration: i % 3 == 0)
+            # 3. Diagnostic Reasoning (stage-specific)
+            graph.add('diagnosis', lambda r, stage=current_stage: clinician_ai.generate_diagnostic_reasoning(
+                stage, r['summary'], diagnosis_before, transcript
+            ), deps=['summary'])
+            # 4a. END in late stage -> treatment plan
+            graph.add('treatment', lambda r: clinician_ai.generate_treatment_plan(r['diagnosis'], r['summary']),
+                      deps=['summary', 'diagnosis'], when=is_end)
+            # 4b. Otherwise -> question generation (stage-specific)
+            graph.add('question', lambda r, stage=current_stage: clinician_ai.generate_question(
+                stage, r['summary'], r['diagnosis'], questions_so_far, transcript
+            ), deps=['summary', 'diagnosis'], when=lambda r: not is_end(r))
+            # 5. Patient Response (overlaps the behavioral analysis)
+            def patient_turn(r):
+                with clinician_ai.tracer.span("patient") as span:
+                    return respond_to_doctor(extract_doctor_question(r['question']), vignette_before, call_info=span)
+            graph.add('patient', patient_turn, deps=['question'])
+
+            results = graph.run()
+
+            clinical_summary = results['summary']
+            diagnostic_reasoning = results['diagnosis']
+            print("📋 Clinical Summary:")
+            print(_preview(clinical_summary))
+            if 'behavioral' in results:
+                print("🧠 Behavioral Analysis:")
+                print(_preview(results['behavioral']))
+            print(f"🩺 {current_stage.title()} Stage Diagnosis:")
+            print(_preview(diagnostic_reasoning))
+            
+            # END condition in late stage
+            if 'treatment' in results:
+                print("\n🏁 END condition detected. Final treatment plan:")
+                treatment_plan = results['treatment']
+                print("💊 Treatment Plan:")
+                print(_preview(treatment_plan, 300))
+                current_diagnosis = diagnostic_reasoning
+                break
+            
+            question_output = results['question']
+            doctor_question = extract_doctor_question(question_output)
+            print(f"❓ {current_stage.title()} Stage Question:")
+            print(_preview(question_output))
+            
+            print(f"\n🩺 Doctor: {doctor_question}")
+            conversation.append(f"Doctor: {doctor_question}")
+            prev_questions.append(doctor_question)
+            
+            patient_response = results['patient']
+            print(f"👤 Patient: {patient_response}")
+            conversation.append(f"Patient: {patient_response}")
+            patient_responses.append(patient_response)
+            
+            # Update for next iteration
+            prev_vignette = clinical_summary
+            current_diagnosis = diagnostic_reasoning
+            
+            print(f"\n{'='*80}")
     
     # Final treatment plan if not already generated
-    if iteration == max_iterations - 1:
+    if not treatment_plan:
         print("\n🔄 Generating final treatment plan...")
         treatment_plan = clinician_ai.generate_treatment_plan(current_diagnosis, prev_vignette)
         print("💊 Final Treatment Plan:")
         print(treatment_plan)
+
+    return {
+        "conversation": conversation,
+        "patient_responses": patient_responses,
+        "final_diagnosis": current_diagnosis,
+        "treatment_plan": treatment_plan,
+        "total_iterations": iteration + 1,
+    }
+
+
+def run_multi_stage_conversation():
+    """Run the multi-stage clinical conversation"""
+    # Test connection first
+    if not test_connection():
+        print("Please check your ENDPOINT_URL and HF_TOKEN")
+        return
+
+    print("\n" + "=" * 80)
+    print("🏥 Starting Multi-Stage Clinical Diagnostic Conversation")
+    print("=" * 80)
+
+    # Initialize agents
+    clinician_ai = MultiStageClinicianAI(model_client)
+    patient_agent = PatientAgent(model_client)
+    
+    initial_response = "I am a 35-year-old office worker who has been experiencing persistent headaches for 3 days. The pain is throbbing, located in my temples, and rates about 6/10 in intensity. I've tried ibuprofen but it only helps temporarily. I'm worried because I've never had headaches this severe before."
+    result = conduct_multi_stage_conversation(
+        clinician_ai, patient_agent.generate_response, initial_response, max_iterations=12
+    )
+    conversation = result["conversation"]
     
     # Save all outputs
     print("\n💾 Saving all outputs to JSON files...")
     clinician_ai.save_all_outputs()
+
+    # Stage latency / token spans
+    clinician_ai.tracer.print_summary()
+    clinician_ai.tracer.export_jsonl("stage_spans.jsonl")
+    print("💾 Stage spans appended to stage_spans.jsonl")
     
     # Save main conversation
     conversation_data = {
         "conversation": conversation,
-        "patient_responses": patient_responses,
-        "final_diagnosis": current_diagnosis,
-        "total_iterations": iteration + 1,
+        "patient_responses": result["patient_responses"],
+        "final_diagnosis": result["final_diagnosis"],
+        "total_iterations": result["total_iterations"],
         "timestamp": datetime.now().isoformat(),
         "metadata": {
             "endpoint_url": ENDPOINT_URL,
@@ -414,7 +409,8 @@ def run_multi_stage_conversation():
                 "max_new_tokens": 400,
                 "temperature": 0.7,
                 "do_sample": True,
-                "return_full_text": True
+                "return_full_text": False,
+                "stream": model_client.stream
             }
         }
     }
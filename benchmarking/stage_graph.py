@@ -0,0 +1,58 @@
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+class StageGraph:
+    """
+    Tiny dependency-graph scheduler for one turn of the multi-stage pipeline.
+
+    Each stage declares the stages it depends on; a stage is submitted to the
+    executor as soon as all of its dependencies have finished, so independent
+    stages (e.g. behavioral analysis vs. summary -> diagnosis -> question) run
+    concurrently. A stage with a `when` predicate is skipped if the predicate
+    is false once its dependencies are done, and skipping cascades to every
+    stage that depends on it.
+    """
+
+    SKIPPED = object()
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.stages = {}
+
+    def add(self, name, fn, deps=(), when=None):
+        """fn(results) receives the dict of finished stage results"""
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+        self.stages[name] = {"fn": fn, "deps": tuple(deps), "when": when}
+        return self
+
+    def run(self):
+        """Run every stage; returns {stage: result} with skipped stages omitted"""
+        results = {}
+        pending = dict(self.stages)
+        running = {}
+
+        while pending or running:
+            # Submit (or skip) every stage whose dependencies are resolved
+            for name, stage in list(pending.items()):
+                if any(dep in pending or dep in running.values() for dep in stage["deps"]):
+                    continue
+                del pending[name]
+                if any(results.get(dep) is self.SKIPPED for dep in stage["deps"]) or (
+                    stage["when"] is not None and not stage["when"](results)
+                ):
+                    results[name] = self.SKIPPED
+                    continue
+                running[self.executor.submit(stage["fn"], results)] = name
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                # Re-raise stage errors in the caller's thread
+                results[name] = future.result()
+
+        return {name: result for name, result in results.items() if result is not self.SKIPPED}
@@ -0,0 +1,128 @@
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class StageTracer:
+    """
+    Collects one span per model call in the multi-stage pipeline.
+
+    Each span records the stage name, wall time, prompt/completion tokens,
+    retries and cache hits reported by the model client. Spans can be exported
+    as JSONL and summarized as p50/p95 per stage.
+    """
+
+    def __init__(self, run_id=None):
+        self.run_id = run_id or datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.spans = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage, **attributes):
+        record = {
+            "run_id": self.run_id,
+            "stage": stage,
+            "start": time.time(),
+            "wall_time_s": None,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cached_tokens": 0,
+            "retries": 0,
+            "cache_hit": False,
+            "error": None,
+        }
+        record.update(attributes)
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record["error"] = str(e)
+            raise
+        finally:
+            record["wall_time_s"] = round(time.perf_counter() - start, 4)
+            with self.lock:
+                self.spans.append(record)
+
+    def export_jsonl(self, path, append=True):
+        """Write spans as one JSON object per line"""
+        with self.lock:
+            spans = list(self.spans)
+        with open(path, "a" if append else "w", encoding="utf-8") as f:
+            for record in spans:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return len(spans)
+
+    def summary(self):
+        """Per-stage call count, p50/p95 wall time, token totals, cached-token ratio, retries and cache hits"""
+        with self.lock:
+            spans = list(self.spans)
+
+        by_stage = {}
+        for record in spans:
+            by_stage.setdefault(record["stage"], []).append(record)
+
+        summary = {}
+        for stage, records in by_stage.items():
+            times = [r["wall_time_s"] for r in records]
+            ttfts = [r["ttft_s"] for r in records if r.get("ttft_s") is not None]
+            prompt_tokens = sum(r["prompt_tokens"] for r in records)
+            cached_tokens = sum(r.get("cached_tokens", 0) for r in records)
+            summary[stage] = {
+                "calls": len(records),
+                "total_s": round(sum(times), 3),
+                "p50_s": percentile(times, 50),
+                "p95_s": percentile(times, 95),
+                "p50_ttft_s": percentile(ttfts, 50),
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": sum(r["completion_tokens"] for r in records),
+                "cached_tokens": cached_tokens,
+                "cached_ratio": round(cached_tokens / prompt_tokens, 3) if prompt_tokens else 0.0,
+                "retries": sum(r["retries"] for r in records),
+                "cache_hits": sum(1 for r in records if r["cache_hit"]),
+                "errors": sum(1 for r in records if r["error"]),
+            }
+        return summary
+
+    def print_summary(self):
+        summary = self.summary()
+        if not summary:
+            return
+        total = sum(stats["total_s"] for stats in summary.values()) or 1.0
+        print("\n⏱️  Stage latency breakdown")
+        print(f"{'stage':<20}{'calls':>6}{'p50 s':>9}{'p95 s':>9}{'total s':>10}{'share':>8}"
+              f"{'prompt tok':>12}{'compl tok':>11}{'cached %':>10}{'retries':>9}{'hits':>6}")
+        for stage, stats in sorted(summary.items(), key=lambda item: -item[1]["total_s"]):
+            print(f"{stage:<20}{stats['calls']:>6}{stats['p50_s']:>9.2f}{stats['p95_s']:>9.2f}"
+                  f"{stats['total_s']:>10.2f}{stats['total_s'] / total * 100:>7.1f}%"
+                  f"{stats['prompt_tokens']:>12}{stats['completion_tokens']:>11}"
+                  f"{stats['cached_ratio'] * 100:>9.1f}%{stats['retries']:>9}{stats['cache_hits']:>6}")
+
+
+def summarize_jsonl(path):
+    """Rebuild a per-stage summary from an exported spans file (e.g. across many runs)"""
+    tracer = StageTracer(run_id="summary")
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                tracer.spans.append(json.loads(line))
+    return tracer
+
+
+if __name__ == "__main__":
+    import sys
+
+    for spans_file in sys.argv[1:] or ["stage_spans.jsonl"]:
+        print(f"📄 {spans_file}")
+        summarize_jsonl(spans_file).print_summary()
@@ -1,5 +1,8 @@
 import json
 import os
+import sqlite3
+import hashlib
+import argparse
 
 # File paths
 combined_dataset_path = (
@@ -9,40 +12,151 @@ new_dataset_path = (
     "/Users/owner/Downloads/coding projects/AMIE-app/datasets/new_dataset.jsonl"
 )
 
-def append_to_combined_dataset(combined_path, new_path):
+
+def entry_hash(entry):
+    """Content hash of an entry, independent of key order and whitespace"""
+    canonical = json.dumps(entry, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).digest()
+
+
+class HashIndex:
+    """
+    Persistent set of entry hashes for a JSONL corpus, kept in a SQLite
+    sidecar (<corpus>.hashes.sqlite) next to it.
+
+    The sidecar also records how many bytes of the corpus it covers. Lines
+    appended by anything else (or left unindexed by an interrupted run) are
+    hashed from that offset on open, and a corpus that shrank is re-indexed
+    from scratch. Only the size is checked: after rewriting the corpus in
+    place, delete the sidecar so it is rebuilt.
+    """
+
+    def __init__(self, corpus_path):
+        self.corpus_path = corpus_path
+        self.db = sqlite3.connect(corpus_path + ".hashes.sqlite")
+        self.db.execute("CREATE TABLE IF NOT EXISTS hashes (digest BLOB PRIMARY KEY) WITHOUT ROWID")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        self.catch_up()
+
+    @property
+    def indexed_bytes(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'indexed_bytes'").fetchone()
+        return row[0] if row else 0
+
+    def set_indexed_bytes(self, offset):
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('indexed_bytes', ?)", (offset,))
+
+    def catch_up(self):
+        """Hash any corpus lines past the indexed offset"""
+        size = os.path.getsize(self.corpus_path) if os.path.exists(self.corpus_path) else 0
+        offset = self.indexed_bytes
+        if size < offset:
+            print(f"⚠️ {self.corpus_path} shrank since it was indexed, rebuilding hash index")
+            self.db.execute("DELETE FROM hashes")
+            offset = 0
+        if size == offset:
+            return
+
+        added = 0
+        with open(self.corpus_path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn last line; picked up once it is completed
+                offset += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    added += self.add(entry_hash(json.loads(line)))
+                except json.JSONDecodeError:
+                    continue
+        self.set_indexed_bytes(offset)
+        self.db.commit()
+        print(f"Indexed {added} existing entries of {self.corpus_path}")
+
+    def add(self, digest):
+        """Insert a hash; returns False if it was already present"""
+        return self.db.execute("INSERT OR IGNORE INTO hashes VALUES (?)", (digest,)).rowcount == 1
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+def iter_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def append_to_combined_dataset(combined_path, new_path, dedup=True):
     """
     Append a new dataset to the combined dataset.
 
+    Only the new entries are read and written: the combined file is opened
+    in append mode, and with dedup the duplicate check is a lookup in the
+    hash index sidecar instead of a rescan of the corpus.
+
     Args:
         combined_path (str): Path to the combined dataset JSONL file.
         new_path (str): Path to the new dataset JSONL file.
+        dedup (bool): Skip entries whose content is already in the combined
+            dataset (or earlier in the new one).
     """
-    # Load the combined dataset
-    combined_data = []
-    if os.path.exists(combined_path):
-        with open(combined_path, "r", encoding="utf-8") as f:
-            combined_data = [json.loads(line) for line in f if line.strip()]
-    else:
+    if not os.path.exists(combined_path):
         print(f"Combined dataset not found at {combined_path}. Creating a new one.")
 
-    # Load the new dataset
-    with open(new_path, "r", encoding="utf-8") as f:
-        new_data = [json.loads(line) for line in f if line.strip()]
-
-    # Ensure the new data is a list of dictionaries
-    if not all(isinstance(entry, dict) for entry in new_data):
+    # Ensure the new data is a list of dictionaries before anything is written
+    new_entries = list(iter_jsonl(new_path))
+    if not all(isinstance(entry, dict) for entry in new_entries):
         raise ValueError("The new dataset must be a JSONL file with one JSON object per line.")
 
-    # Append the new data to the combined dataset
-    combined_data.extend(new_data)
+    index = HashIndex(combined_path) if dedup else None
+    appended = skipped = 0
+    try:
+        with open(combined_path, "a+b") as out:
+            # Don't glue the first new entry onto an unterminated last line
+            if out.tell() > 0:
+                out.seek(-1, os.SEEK_END)
+                if out.read(1) != b"\n":
+                    out.write(b"\n")
+                    out.flush()
+                    if index is not None:
+                        index.catch_up()  # The completed line was skipped as torn
+
+            for entry in new_entries:
+                if index is not None and not index.add(entry_hash(entry)):
+                    skipped += 1
+                    continue
+                out.write((json.dumps(entry) + "\n").encode("utf-8"))
+                appended += 1
+
+            out.flush()
+            if index is not None:
+                # Corpus bytes first, then the index that covers them: a crash
+                # in between only leaves lines for the next catch_up()
+                index.set_indexed_bytes(out.tell())
+                index.db.commit()
+    finally:
+        if index is not None:
+            index.close()
+
+    print(f"Successfully appended {appended} entries to the combined dataset.")
+    if dedup:
+        print(f"Skipped {skipped} duplicate entries.")
+
 
-    # Save the updated combined dataset
-    with open(combined_path, "w", encoding="utf-8") as f:
-        for entry in combined_data:
-            f.write(json.dumps(entry) + "\n")
+def build_parser():
+    parser = argparse.ArgumentParser(description="Append a JSONL dataset to the combined dataset")
+    parser.add_argument("--combined", default=combined_dataset_path)
+    parser.add_argument("--new", default=new_dataset_path)
+    parser.add_argument("--no-dedup", action="store_true", help="Append every entry, without the hash index")
+    return parser
 
-    print(f"Successfully appended {len(new_data)} entries to the combined dataset.")
-    print(f"Total entries in the combined dataset: {len(combined_data)}")
 
-# Run the function
-append_to_combined_dataset(combined_dataset_path, new_dataset_path)
\ No newline at end of file
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    append_to_combined_dataset(args.combined, args.new, dedup=not args.no_dedup)
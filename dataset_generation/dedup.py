@@ -0,0 +1,282 @@
+"""
+Streaming exact + near-duplicate removal for instruction/input/output corpora.
+
+Every row gets two checks, in one pass and without holding the corpus in
+memory:
+
+  - exact: a hash of the whitespace/case-normalized (instruction, input,
+    output) triple;
+  - near: MinHash signatures over word shingles of the input and of the
+    output, looked up in an LSH index (bands x rows). Only rows with the same
+    instruction are compared, since most files reuse one long instruction
+    template that would otherwise make every row look alike. A band collision
+    is confirmed by the estimated Jaccard similarity of the input AND of the
+    output, so turns that share a long vignette but answer differently are
+    kept apart.
+
+The first row of each cluster is kept; the rest are dropped (or written to a
+side file) and counted against it, which gives the cluster-size report:
+
+    python dedup.py "../datasets/SFT" "../datasets/SFT Near" --out deduped.jsonl --dups dups.jsonl
+"""
+
+import os
+import re
+import json
+import zlib
+import hashlib
+import argparse
+from collections import Counter
+
+import numpy as np
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64(0xFFFFFFFF)
+WORD_RE = re.compile(r"\w+")
+FIELDS = ("instruction", "input", "output")
+
+
+def normalize_text(value):
+    return " ".join(str(value or "").lower().split())
+
+
+def digest(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def exact_key(entry):
+    return digest("\x1f".join(normalize_text(entry.get(field)) for field in FIELDS))
+
+
+def shingle_hashes(text, k=5):
+    """32-bit hashes of the word k-grams of text (the whole text if shorter)"""
+    words = WORD_RE.findall(text.lower())
+    if len(words) <= k:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = [" ".join(words[i:i + k]) for i in range(len(words) - k + 1)]
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in set(grams)), dtype=np.uint64)
+
+
+class MinHasher:
+    """num_perm universal hash functions (a*x + b) mod p, vectorized over shingles"""
+
+    def __init__(self, num_perm=128, seed=1):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, 1 << 31, size=num_perm).astype(np.uint64)[:, None]
+        self.b = rng.randint(0, 1 << 31, size=num_perm).astype(np.uint64)[:, None]
+        self.num_perm = num_perm
+
+    def signature(self, hashes):
+        if hashes.size == 0:
+            return np.full(self.num_perm, MAX_HASH, dtype=np.uint32)
+        return (((self.a * hashes + self.b) % MERSENNE_PRIME) & MAX_HASH).min(axis=1).astype(np.uint32)
+
+
+class LSHIndex:
+    """
+    Banded LSH over MinHash signatures of cluster representatives.
+
+    Signatures are `parts` equal-length field signatures laid end to end.
+    With `bands` bands of `rows` values each, a field with Jaccard s lands a
+    shared bucket with probability 1 - (1 - s**rows)**(bands / parts);
+    16 bands over 2 x 64 puts the knee around 0.75. Candidates only count
+    once every part's estimated Jaccard reaches `threshold`.
+    """
+
+    def __init__(self, num_perm=128, bands=16, threshold=0.8, parts=1):
+        if num_perm % bands or bands % parts:
+            raise ValueError(f"num_perm ({num_perm}) must split into {bands} bands over {parts} parts")
+        self.rows = num_perm // bands
+        self.bands = bands
+        self.threshold = threshold
+        self.parts = parts
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = {}
+
+    def _keys(self, group, signature):
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows]
+            yield band, group + chunk.tobytes()
+
+    def match(self, group, signature):
+        """Representative id of a near-duplicate already in the index, or None"""
+        seen = set()
+        for band, key in self._keys(group, signature):
+            candidate = self.buckets[band].get(key)
+            if candidate is None or candidate in seen:
+                continue
+            seen.add(candidate)
+            agreement = (self.signatures[candidate] == signature).reshape(self.parts, -1).mean(axis=1)
+            if agreement.min() >= self.threshold:
+                return candidate
+        return None
+
+    def insert(self, group, signature, row_id):
+        self.signatures[row_id] = signature
+        for band, key in self._keys(group, signature):
+            self.buckets[band].setdefault(key, row_id)
+
+
+class Deduplicator:
+    """
+    Feed rows with check(); each returns (kind, representative id), where
+    kind is None for a new row, "exact" or "near" for a duplicate of an
+    earlier kept row.
+    """
+
+    def __init__(self, near=True, num_perm=128, bands=16, threshold=0.8, shingle_size=5):
+        self.exact = {}
+        # One half of the signature per field: input, output
+        self.minhashers = (MinHasher(num_perm // 2, seed=1), MinHasher(num_perm // 2, seed=2)) if near else None
+        self.lsh = LSHIndex(num_perm, bands, threshold, parts=2) if near else None
+        self.shingle_size = shingle_size
+        self.cluster_sizes = Counter()
+        self.sources = {}
+        self.stats = Counter()
+
+    def check(self, entry, source=None):
+        row_id = self.stats["rows"]
+        self.stats["rows"] += 1
+
+        key = exact_key(entry)
+        representative = self.exact.get(key)
+        if representative is not None:
+            self.stats["exact"] += 1
+            self.cluster_sizes[representative] += 1
+            return "exact", representative
+
+        if self.lsh is not None:
+            group = digest(normalize_text(entry.get("instruction")))
+            signature = np.concatenate([
+                minhasher.signature(shingle_hashes(str(entry.get(field) or ""), self.shingle_size))
+                for minhasher, field in zip(self.minhashers, ("input", "output"))
+            ])
+            representative = self.lsh.match(group, signature)
+            if representative is not None:
+                self.stats["near"] += 1
+                self.cluster_sizes[representative] += 1
+                return "near", representative
+            self.lsh.insert(group, signature, row_id)
+
+        self.exact[key] = row_id
+        self.cluster_sizes[row_id] = 1
+        self.sources[row_id] = source
+        self.stats["kept"] += 1
+        return None, row_id
+
+    def report(self, top=10):
+        stats = self.stats
+        print(f"📊 {stats['rows']} rows: {stats['kept']} kept, "
+              f"{stats['exact']} exact and {stats['near']} near duplicates removed")
+        size_histogram = Counter(size for size in self.cluster_sizes.values() if size > 1)
+        if not size_histogram:
+            return
+        print(f"   {sum(size_histogram.values())} duplicate clusters, by size:")
+        for size, count in sorted(size_histogram.items()):
+            print(f"     {size:>4} rows: {count} clusters")
+        print("   Largest clusters:")
+        for row_id, size in self.cluster_sizes.most_common(top):
+            if size > 1:
+                print(f"     {size:>4} x {self.sources.get(row_id)}")
+
+
+def iter_entries(path):
+    """(index, entry) pairs of a JSON array or JSONL file, streamed where possible"""
+    with open(path, "r", encoding="utf-8") as f:
+        first_char = ""
+        while True:
+            c = f.read(1)
+            if not c or not c.isspace():
+                first_char = c
+                break
+
+    if first_char == "[":
+        if ijson is not None:
+            with open(path, "rb") as f:
+                yield from enumerate(ijson.items(f, "item", use_float=True))
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                try:
+                    yield from enumerate(json.load(f))
+                except json.JSONDecodeError as e:
+                    print(f"⚠️ Failed to parse JSON array in {path}: {e}")
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield i, json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"⚠️ Skipping malformed JSON at line {i} of {path}: {e}")
+
+
+def iter_corpus(paths):
+    """(source label, entry) for every JSON/JSONL file under the given files/folders"""
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if name.endswith(".json") or name.endswith(".jsonl")
+            )
+        else:
+            files = [path]
+        for file_path in files:
+            for index, entry in iter_entries(file_path):
+                if isinstance(entry, dict):
+                    yield f"{file_path}#{index}", entry
+
+
+def dedup_corpus(paths, out_path, dups_path=None, **options):
+    dedup = Deduplicator(**options)
+    dups = open(dups_path, "w", encoding="utf-8") if dups_path else None
+    try:
+        with open(out_path, "w", encoding="utf-8") as out:
+            for source, entry in iter_corpus(paths):
+                kind, representative = dedup.check(entry, source)
+                if kind is None:
+                    out.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                elif dups:
+                    record = {"kind": kind, "source": source, "duplicate_of": dedup.sources[representative]}
+                    dups.write(json.dumps(record, ensure_ascii=False) + "\n")
+    finally:
+        if dups:
+            dups.close()
+    dedup.report()
+    return dedup.stats
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Remove exact and near-duplicate rows across datasets")
+    parser.add_argument("paths", nargs="+", help="JSON/JSONL files or folders of them")
+    parser.add_argument("--out", required=True, help="Deduplicated JSONL output")
+    parser.add_argument("--dups", default=None, help="Also write one JSONL record per dropped row here")
+    parser.add_argument("--exact-only", action="store_true", help="Skip MinHash near-duplicate detection")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Estimated Jaccard for a near duplicate")
+    parser.add_argument("--num-perm", type=int, default=128)
+    parser.add_argument("--bands", type=int, default=16)
+    parser.add_argument("--shingle-size", type=int, default=5, help="Words per shingle")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    dedup_corpus(
+        args.paths,
+        args.out,
+        args.dups,
+        near=not args.exact_only,
+        num_perm=args.num_perm,
+        bands=args.bands,
+        threshold=args.threshold,
+        shingle_size=args.shingle_size,
+    )
@@ -1,6 +1,8 @@
 import json
 import os
 
+from dedup import Deduplicator
+
 # Input folder containing all JSON/JSONL files
 input_folder = "/Users/owner/Downloads/coding projects/AMIE-app/datasets/SFT"
 # Output JSONL file path
@@ -49,22 +51,35 @@ def format_entry(entry):
     }
 
 
-def merge_datasets(input_folder, output_jsonl_path):
-    combined_data = []
-    for file_name in os.listdir(input_folder):
-        file_path = os.path.join(input_folder, file_name)
-        if not (file_name.endswith(".json") or file_name.endswith(".jsonl")):
-            print(f"Skipping non-JSON file: {file_name}")
-            continue
-        entries = load_json_file(file_path)
-        for entry in entries:
-            combined_data.append(format_entry(entry))
-
+def merge_datasets(input_folder, output_jsonl_path, dedup=True):
+    """
+    Concatenate every JSON/JSONL file in input_folder (a folder or a list of
+    folders) into one JSONL, dropping exact and near-duplicate rows unless
+    dedup is False. Entries are written as they are read.
+    """
+    folders = [input_folder] if isinstance(input_folder, str) else input_folder
+    deduplicator = Deduplicator() if dedup else None
+    written = 0
     with open(output_jsonl_path, "w", encoding="utf-8") as out:
-        for entry in combined_data:
-            out.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        for folder in folders:
+            for file_name in sorted(os.listdir(folder)):
+                file_path = os.path.join(folder, file_name)
+                if not (file_name.endswith(".json") or file_name.endswith(".jsonl")):
+                    print(f"Skipping non-JSON file: {file_name}")
+                    continue
+                entries = load_json_file(file_path)
+                for index, entry in enumerate(entries):
+                    entry = format_entry(entry)
+                    if deduplicator:
+                        kind, _ = deduplicator.check(entry, f"{file_path}#{index}")
+                        if kind is not None:
+                            continue
+                    out.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                    written += 1
 
-    print(f"Combined dataset saved to {output_jsonl_path} with {len(combined_data)} entries")
+    print(f"Combined dataset saved to {output_jsonl_path} with {written} entries")
+    if deduplicator:
+        deduplicator.report()
 
 if __name__ == "__main__":
-    merge_datasets(input_folder, output_jsonl_path)
\ No newline at end of file
+    merge_datasets(input_folder, output_jsonl_path)
@@ -10,6 +10,7 @@ from sklearn.metrics.pairwise import cosine_similarity
 from typing import List, Dict, Optional, Any
 from openai import OpenAI
 from role_responder import RoleResponder
+from structured_output import role_schema
 from prompts import (
     PATIENT_INTERPRETER_PROMPT,
     BEHAVIORAL_ANALYSIS_PROMPT,
@@ -338,7 +339,7 @@ class DiagnosticsExpert:
         print(f"   - Cache path: {cache_path}")
         
         self.role_instruction = "You are a board-certified diagnostician."
-        self.responder = RoleResponder(self.role_instruction, client, model)
+        self.responder = RoleResponder(self.role_instruction, client, model, structured=role_schema("diagnoser"))
         self.client = client
         self.embedding_model = embedding_model
         self.cache_path = cache_path
@@ -874,7 +875,9 @@ class ClinicalQuestioner:
     Use the disease context above to inform your questioning strategy. Look for symptoms, risk factors, and clinical features mentioned in similar diseases to guide your inquiry."""
         
         # Create questioner with enhanced role
-        questioner = RoleResponder(enhanced_questioning_role, self.client, self.model)
+        questioner = RoleResponder(
+            enhanced_questioning_role, self.client, self.model, structured=role_schema("questioner")
+        )
         
         # Generate prompt
         prompt = QUESTIONING_PROMPT.format(
@@ -3,13 +3,14 @@
 Main entry point for the medical diagnosis simulation system.
 """
 
-import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from process_vignette import process_vignette
 from utils import (
     setup_output_directories,
     aggregate_results,
     print_summary_statistics,
-    load_vignettes,
+    iter_vignettes,
+    bounded_map,
 )
 import os
 
@@ -19,7 +20,7 @@ MODEL = "gpt-4.1-nano"
 
 
 def run_vignette_task(args):
-    """Wrapper for multiprocessing pool"""
+    """Wrapper for the process pool"""
     idx, vignette_text, disease, api_key, model = args
     
     # Create OpenAI client within the process to avoid pickling issues
@@ -49,24 +50,31 @@ def main():
     DESIRED_TYPES = ["typical", "severe"]  # Change these as needed
     # Options: "typical", "early", "severe", "mixed"
     
-    # Load vignettes
-    flattened_vignettes = load_vignettes(
+    # Stream vignettes: workers start on the first ones while the rest of
+    # the file is still being read
+    vignettes = iter_vignettes(
         "patient_roleplay_scripts.json",
         desired_types=DESIRED_TYPES
     )
     
-    print(f"📊 Processing {len(flattened_vignettes)} vignettes...")
-    
-    # Launch multiprocessing pool
-    with multiprocessing.Pool(processes=8) as pool:
-        results = pool.map(
-            run_vignette_task,
-            [
-                (idx, vignette_text, disease, API_KEY, MODEL)
-                for idx, (disease, vignette_text) in enumerate(flattened_vignettes)
-            ],
+    # Launch the process pool; bounded_map keeps ~2 tasks per process in
+    # flight (Pool.imap and Executor.map would read every vignette up front)
+    processes = 8
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = list(
+            bounded_map(
+                executor,
+                run_vignette_task,
+                (
+                    (idx, vignette_text, disease, API_KEY, MODEL)
+                    for idx, (disease, vignette_text) in enumerate(vignettes)
+                ),
+                window=2 * processes,
+            )
         )
     
+    print(f"📊 Processed {len(results)} vignettes")
+    
     # Filter out any failed results (None values)
     successful_results = [r for r in results if r is not None]
     
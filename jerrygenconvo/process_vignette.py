@@ -5,6 +5,7 @@ Core vignette processing logic for the medical diagnosis simulation.
 
 import json
 from role_responder import RoleResponder
+from structured_output import role_schema
 from agents import (
     PatientInterpreter,
     BehaviorAnalyzer,
@@ -54,7 +55,7 @@ def process_vignette(idx, vignette_text, gold_label, client, model):
     patient_instructions = generate_patient_prompt_modifiers(
         behavior_config, is_initial=True
     )
-    patient = RoleResponder(patient_instructions, client, model)
+    patient = RoleResponder(patient_instructions, client, model, structured=role_schema("patient"))
 
     # Age and gender requirements with behavior consideration
     age_gender_instruction = 'YOU MUST mention your age, and biological gender in the first of the three sentences. E.g. "I am 25, and I am a biological male."'
@@ -188,7 +189,7 @@ def process_vignette(idx, vignette_text, gold_label, client, model):
                     behavior_type=behavior_type
                 )
 
-                treatment_result = diagnostics_expert.responder.ask(treatment_prompt)
+                treatment_result = diagnostics_expert.responder.ask(treatment_prompt, structured=False)
                 raw_treatment = treatment_result["raw"]
 
                 treatment_plans.append(
@@ -234,7 +235,9 @@ def process_vignette(idx, vignette_text, gold_label, client, model):
             patient_followup_instructions = generate_patient_prompt_modifiers(
                 behavior_config, is_initial=False
             )
-            patient = RoleResponder(patient_followup_instructions, client, model)
+            patient = RoleResponder(
+                patient_followup_instructions, client, model, structured=role_schema("patient")
+            )
 
             # Adjust response style based on behavior and conversation stage
             response_guidance = "in one or two sentences"
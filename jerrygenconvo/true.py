@@ -1,58 +1,19 @@
-import requests
 import json
 import os
+import sys
 from datetime import datetime
 
+# Streaming, session-pooled endpoint client shared with the benchmark
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarking"))
+from hf_client import HuggingFaceInference
+
 # ============================================================================
 # REPLACE THESE WITH YOUR ACTUAL VALUES
 # ============================================================================
-ENDPOINT_URL = "url"  # Your endpoint URL from the screenshot
+ENDPOINT_URL = os.getenv("HF_ENDPOINT_URL", "url")  # Your endpoint URL (or benchmarking/local_server.py)
 HF_TOKEN = "hf"  # Your HuggingFace token
 
 
-class HuggingFaceInference:
-    def __init__(self, endpoint_url, api_token):
-        self.endpoint_url = endpoint_url
-        self.headers = {
-            "Authorization": f"Bearer {api_token}",
-            "Content-Type": "application/json",
-        }
-
-    def generate(self, prompt, max_new_tokens=800):
-        payload = {
-            "inputs": prompt,
-            "parameters": {
-                "max_new_tokens": max_new_tokens,
-                "temperature": 0.7,
-                "do_sample": True,
-                "return_full_text": True,
-            },
-        }
-
-        try:
-            response = requests.post(
-                self.endpoint_url, headers=self.headers, json=payload
-            )
-            response.raise_for_status()
-
-            result = response.json()
-
-            # Handle the response format
-            if isinstance(result, list) and len(result) > 0:
-                generated_text = result[0].get("generated_text", "")
-            else:
-                generated_text = str(result)
-
-            return generated_text
-
-        except requests.exceptions.RequestException as e:
-            print(f"❌ API request failed: {e}")
-            if hasattr(e, "response") and e.response is not None:
-                print(f"Status: {e.response.status_code}")
-                print(f"Response: {e.response.text}")
-            raise
-
-
 # Initialize the inference client
 model_client = HuggingFaceInference(ENDPOINT_URL, HF_TOKEN)
 
@@ -85,7 +46,12 @@ def extract_thinking_and_answer(raw_output):
     thinking = ""
     answer = ""
 
-    if "THINKING:" in raw_output:
+    # The prompt ends with "THINKING:" and the endpoint no longer echoes it,
+    # so a completion may start straight with the thinking text
+    if "THINKING:" not in raw_output and "ANSWER:" in raw_output:
+        thinking = raw_output[: raw_output.find("ANSWER:")].strip()
+        answer = raw_output.split("ANSWER:")[-1].strip()
+    elif "THINKING:" in raw_output:
         thinking_start = raw_output.find("THINKING:") + len("THINKING:")
         if "ANSWER:" in raw_output:
             thinking_end = raw_output.find("ANSWER:")
@@ -4,9 +4,15 @@ Utility functions for the medical diagnosis simulation system.
 """
 
 import os
+import sys
 import shutil
 import json
 
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "new_data_gen", "actual_data_gen")
+)
+from script_loader import bounded_map, iter_roleplay_scripts
+
 
 def setup_output_directories():
     """Remove and recreate output directories to start empty"""
@@ -167,51 +173,17 @@ def calculate_accuracy_score(found, position, total_predictions):
         return 0.4
 
 
-def load_vignettes(filename, desired_types=None):
-    """Load vignettes from JSON file"""
-    with open(filename, "r") as f:
-        data = json.load(f)
-    
-    flattened_vignettes = []
-    
+def iter_vignettes(filename, desired_types=None, per_disease=2):
+    """
+    Stream (disease, vignette text) from the roleplay scripts file (or its
+    .jsonl log), keeping only desired_types and at most per_disease scripts
+    per disease, so work can start before the whole file is read.
+    """
     if desired_types is None:
         desired_types = ["typical", "severe"]
-    
-    # Handle roleplay scripts structure
-    if "roleplay_scripts" in data:
-        roleplay_dict = data["roleplay_scripts"]
-        for disease, scripts in roleplay_dict.items():
-            # Only process if we have a list of scripts
-            if not isinstance(scripts, list):
-                continue
-
-            # Select specific types
-            selected_scripts = []
-            for script in scripts:
-                if isinstance(script, dict) and "variation_type" in script:
-                    if script["variation_type"] in desired_types:
-                        selected_scripts.append(script)
-                else:
-                    # If no variation_type, include it (fallback)
-                    selected_scripts.append(script)
-
-            # Limit to 2 even from selected types
-            limited_scripts = selected_scripts[:2]
-
-            for script in limited_scripts:
-                # Extract the roleplay_script content as the vignette text
-                if isinstance(script, dict) and "roleplay_script" in script:
-                    flattened_vignettes.append((disease, script["roleplay_script"]))
-                else:
-                    # Fallback if script is just a string
-                    flattened_vignettes.append((disease, str(script)))
+    return iter_roleplay_scripts(filename, desired_types=desired_types, per_disease=per_disease)
 
-            print(
-                f"   {disease}: Selected {len(limited_scripts)} vignettes ({[s.get('variation_type', 'unknown') for s in limited_scripts]})"
-            )
-    else:
-        raise ValueError(
-            f"Expected 'roleplay_scripts' key in JSON structure. Found keys: {list(data.keys()) if isinstance(data, dict) else type(data)}"
-        )
-    
-    return flattened_vignettes
\ No newline at end of file
+
+def load_vignettes(filename, desired_types=None):
+    """Load vignettes from JSON file (all at once; prefer iter_vignettes)"""
+    return list(iter_vignettes(filename, desired_types))
@@ -0,0 +1,298 @@
+import re
+import copy
+import time
+import queue
+import threading
+from collections import OrderedDict
+
+import torch
+
+# Prompts in the clinical pipeline start with a static "Instruction: ..." line
+# followed by the per-call "Input: ..." part; the instruction line is the
+# prefix worth caching.
+INSTRUCTION_PREFIX_RE = re.compile(r"\s*Instruction:[^\n]*\n")
+STOP_STRINGS = ["\nInstruction:", "\nInput:"]
+
+
+def split_prefix(prompt):
+    """Return the cacheable instruction preamble of a prompt, or None"""
+    match = INSTRUCTION_PREFIX_RE.match(prompt)
+    return match.group(0) if match else None
+
+
+def trim_at_stops(text, stops=STOP_STRINGS):
+    cut = len(text)
+    for stop in stops:
+        at = text.find(stop)
+        if at != -1:
+            cut = min(cut, at)
+    return text[:cut]
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# Backends
+# ────────────────────────────────────────────────────────────────────────────────
+class TransformersBackend:
+    """
+    Batched generation with a resident transformers model (CPU friendly).
+
+    Requests that share an instruction preamble reuse its KV cache: the
+    preamble is prefilled once, kept in a small LRU, and deep-copied into
+    each generate call so only the dynamic Input part is prefilled. Prefix
+    reuse is applied to single requests; larger groups are left-padded and
+    generated together in one batch, since padded rows can't share one
+    prefix cache.
+    """
+
+    def __init__(self, model, tokenizer, prefix_cache_size=16, temperature=0.7, top_p=0.95):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token_id is None:
+            self.tokenizer.pad_token_id = self.tokenizer.eos_token_id
+        self.prefix_cache = OrderedDict()
+        self.prefix_cache_size = prefix_cache_size
+        self.temperature = temperature
+        self.top_p = top_p
+
+    def _sampling_kwargs(self, max_new_tokens):
+        return dict(
+            max_new_tokens=max_new_tokens,
+            do_sample=True,
+            temperature=self.temperature,
+            top_p=self.top_p,
+            pad_token_id=self.tokenizer.pad_token_id,
+            eos_token_id=self.tokenizer.eos_token_id,
+        )
+
+    def _prefix_kv(self, prefix):
+        """(prefix_ids, past_key_values, hit) for an instruction preamble"""
+        if prefix in self.prefix_cache:
+            self.prefix_cache.move_to_end(prefix)
+            prefix_ids, past = self.prefix_cache[prefix]
+            return prefix_ids, past, True
+
+        prefix_ids = self.tokenizer(prefix, return_tensors="pt").input_ids.to(self.model.device)
+        with torch.no_grad():
+            past = self.model(input_ids=prefix_ids, use_cache=True).past_key_values
+        self.prefix_cache[prefix] = (prefix_ids, past)
+        if len(self.prefix_cache) > self.prefix_cache_size:
+            self.prefix_cache.popitem(last=False)
+        return prefix_ids, past, False
+
+    def _generate_one(self, request):
+        prompt = request["prompt"]
+        input_ids = self.tokenizer(prompt, return_tensors="pt").input_ids.to(self.model.device)
+        kwargs = self._sampling_kwargs(request["max_new_tokens"])
+        info = {"cache_hit": False, "prefix_tokens": 0, "cached_tokens": 0}
+
+        prefix = split_prefix(prompt)
+        if prefix:
+            prefix_ids, past, hit = self._prefix_kv(prefix)
+            n = prefix_ids.shape[1]
+            # Only reuse the cache if the prompt tokenizes to the same leading ids
+            if n < input_ids.shape[1] and torch.equal(input_ids[0, :n], prefix_ids[0]):
+                kwargs["past_key_values"] = copy.deepcopy(past)
+                info.update(cache_hit=hit, prefix_tokens=n, cached_tokens=n if hit else 0)
+
+        with torch.no_grad():
+            output_ids = self.model.generate(
+                input_ids=input_ids, attention_mask=torch.ones_like(input_ids), **kwargs
+            )
+        new_ids = output_ids[0, input_ids.shape[1]:]
+        info.update(prompt_tokens=input_ids.shape[1], completion_tokens=len(new_ids))
+        return self.tokenizer.decode(new_ids, skip_special_tokens=True), info
+
+    def _generate_padded(self, requests):
+        inputs = self.tokenizer(
+            [r["prompt"] for r in requests], return_tensors="pt", padding=True
+        ).to(self.model.device)
+        max_new_tokens = max(r["max_new_tokens"] for r in requests)
+        with torch.no_grad():
+            output_ids = self.model.generate(**inputs, **self._sampling_kwargs(max_new_tokens))
+
+        results = []
+        prompt_len = inputs["input_ids"].shape[1]
+        for row, request in enumerate(requests):
+            new_ids = output_ids[row, prompt_len:prompt_len + request["max_new_tokens"]]
+            new_ids = new_ids[new_ids != self.tokenizer.pad_token_id]
+            info = {
+                "cache_hit": False,
+                "prefix_tokens": 0,
+                "cached_tokens": 0,
+                "prompt_tokens": int(inputs["attention_mask"][row].sum()),
+                "completion_tokens": len(new_ids),
+            }
+            results.append((self.tokenizer.decode(new_ids, skip_special_tokens=True), info))
+        return results
+
+    def generate_batch(self, requests):
+        if len(requests) == 1:
+            return [self._generate_one(requests[0])]
+        return self._generate_padded(requests)
+
+
+class VLLMBackend:
+    """
+    vLLM backend (GPU): continuous batching at the token level and automatic
+    prefix caching come from vLLM itself; the LoRA adapter is applied per
+    request.
+    """
+
+    def __init__(self, base_model, adapter_path=None, temperature=0.7, top_p=0.95, max_model_len=4096):
+        from vllm import LLM, SamplingParams
+        from vllm.lora.request import LoRARequest
+
+        self.SamplingParams = SamplingParams
+        self.llm = LLM(
+            model=base_model,
+            enable_prefix_caching=True,
+            enable_lora=adapter_path is not None,
+            max_model_len=max_model_len,
+            trust_remote_code=True,
+        )
+        self.lora = LoRARequest("clinical", 1, adapter_path) if adapter_path else None
+        self.temperature = temperature
+        self.top_p = top_p
+
+    def generate_batch(self, requests):
+        params = [
+            self.SamplingParams(
+                max_tokens=r["max_new_tokens"], temperature=self.temperature, top_p=self.top_p, stop=STOP_STRINGS
+            )
+            for r in requests
+        ]
+        outputs = self.llm.generate(
+            [r["prompt"] for r in requests], params, lora_request=self.lora, use_tqdm=False
+        )
+        results = []
+        for output in outputs:
+            completion = output.outputs[0]
+            cached = getattr(output, "num_cached_tokens", 0) or 0
+            info = {
+                "cache_hit": bool(cached),
+                "prefix_tokens": cached,
+                "cached_tokens": cached,
+                "prompt_tokens": len(output.prompt_token_ids),
+                "completion_tokens": len(completion.token_ids),
+            }
+            results.append((completion.text, info))
+        return results
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# Engine
+# ────────────────────────────────────────────────────────────────────────────────
+class LocalInferenceEngine:
+    """
+    Keeps one model resident and serves concurrent callers.
+
+    Callers block in generate() while a scheduler thread collects requests
+    into dynamic batches (up to max_batch_size, waiting at most
+    batch_window_ms for more to arrive). The interface matches
+    HuggingFaceInference.generate, so it can be passed to
+    MultiStageClinicianAI as its model_client.
+    """
+
+    def __init__(self, backend, max_batch_size=8, batch_window_ms=10):
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window_ms / 1000
+        self.requests = queue.Queue()
+        self.usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+        self.stats = {"batches": 0, "max_batch": 0, "prefix_hits": 0}
+        self.lock = threading.Lock()
+        self.scheduler = threading.Thread(target=self._loop, daemon=True)
+        self.scheduler.start()
+
+    def reset_usage(self):
+        self.usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+
+    def generate(self, prompt, max_new_tokens=400, call_info=None, **kwargs):
+        request = {"prompt": prompt, "max_new_tokens": max_new_tokens, "done": threading.Event()}
+        start = time.perf_counter()
+        self.requests.put(request)
+        request["done"].wait()
+        if "error" in request:
+            raise request["error"]
+
+        info = request["info"]
+        with self.lock:
+            self.usage["calls"] += 1
+            self.usage["prompt_tokens"] += info["prompt_tokens"]
+            self.usage["completion_tokens"] += info["completion_tokens"]
+            self.usage["cached_tokens"] += info["cached_tokens"]
+        if call_info is not None:
+            call_info.update(
+                info,
+                retries=0,
+                batch_size=request["batch_size"],
+                queue_s=round(request["started"] - start, 4),
+            )
+        return trim_at_stops(request["text"])
+
+    def _collect(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                results = self.backend.generate_batch(batch)
+                for request, (text, info) in zip(batch, results):
+                    request["text"], request["info"] = text, info
+            except Exception as e:
+                for request in batch:
+                    request["error"] = e
+
+            with self.lock:
+                self.stats["batches"] += 1
+                self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+                self.stats["prefix_hits"] += sum(1 for r in batch if r.get("info", {}).get("cache_hit"))
+            for request in batch:
+                request["started"] = started
+                request["batch_size"] = len(batch)
+                request["done"].set()
+
+
+def load_model(base_model, adapter_repo=None, tokenizer_repo=None, device="cpu", load_in_4bit=False):
+    """Load the base model (+ optional LoRA adapter) once for the engine"""
+    from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
+
+    tokenizer = AutoTokenizer.from_pretrained(
+        tokenizer_repo or adapter_repo or base_model, trust_remote_code=True
+    )
+    kwargs = {"trust_remote_code": True}
+    if load_in_4bit:
+        kwargs["quantization_config"] = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=torch.bfloat16,
+        )
+        kwargs["device_map"] = "auto"
+    model = AutoModelForCausalLM.from_pretrained(base_model, **kwargs)
+    if not load_in_4bit:
+        model = model.to(device)
+
+    if adapter_repo:
+        from peft import PeftModel
+
+        model.resize_token_embeddings(len(tokenizer))
+        model = PeftModel.from_pretrained(model, adapter_repo, trust_remote_code=True)
+        # Merging on CPU removes the per-token LoRA overhead during generation
+        if not load_in_4bit:
+            model = model.merge_and_unload()
+    model.config.use_cache = True
+    model.eval()
+    return model, tokenizer
@@ -65,25 +65,56 @@ model.resize_token_embeddings(len(tokenizer))
 model.print_trainable_parameters()
 
 # ────────── 3. LOAD INSTRUCTION DATA ──────────
-records = []
-with open("combined_dataset_clean.jsonl", "r") as f:
-    for line in f:
-        line = line.strip()
-        if not line:
-            continue
-        try:
-            rec = json.loads(line)
-        except json.JSONDecodeError:
-            continue
-        instr, inp, out = (
-            rec.get("instruction", "").strip(),
-            rec.get("input", "").strip(),
-            rec.get("output", "").strip(),
+# SFT_DATA picks the corpus: the cleaned JSONL by default, or a conversation
+# Parquet file (conversation_store.py, e.g. build_dataset.py's raw output).
+# For Parquet only the three text columns are read, vignettes pruned into
+# the tombstone log (SFT_TOMBSTONES, default: next to the Parquet file) are
+# skipped, and DATA_FILTERS narrows it by metadata,
+# e.g. {"role": "diagnoser", "stage": "L"}.
+DATA_PATH = os.getenv("SFT_DATA", "combined_dataset_clean.jsonl")
+DATA_FILTERS = {}
+
+
+def iter_instruction_records():
+    if DATA_PATH.endswith(".parquet"):
+        import sys
+
+        sys.path.append(
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "new_data_gen", "actual_data_gen")
+        )
+        from conversation_store import TOMBSTONES, load_tombstones, read_conversations
+
+        tombstone_path = os.getenv("SFT_TOMBSTONES", os.path.join(os.path.dirname(DATA_PATH), TOMBSTONES))
+        table = read_conversations(
+            DATA_PATH,
+            columns=["instruction", "input", "output"],
+            tombstones=load_tombstones(tombstone_path),
+            **DATA_FILTERS,
         )
-        if not (instr and out):
-            continue
-        prompt = f"{instr}\n\n{inp}" if inp else instr
-        records.append({"text": f"{prompt}\n\n### Response:\n{out}"})
+        yield from table.to_pylist()
+        return
+    with open(DATA_PATH, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+records = []
+for rec in iter_instruction_records():
+    instr, inp, out = (
+        (rec.get("instruction") or "").strip(),
+        (rec.get("input") or "").strip(),
+        (rec.get("output") or "").strip(),
+    )
+    if not (instr and out):
+        continue
+    prompt = f"{instr}\n\n{inp}" if inp else instr
+    records.append({"text": f"{prompt}\n\n### Response:\n{out}"})
 print(f"✅ Loaded {len(records)} examples.")
 ds = Dataset.from_list(records)
 
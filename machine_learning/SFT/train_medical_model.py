@@ -72,18 +72,36 @@ if tokenizer.pad_token_id is None:
 # ────────────────────────────────────────────────────────────────────────────────
 # 4) Load, clean & preprocess your JSONL
 # ────────────────────────────────────────────────────────────────────────────────
+# SFT_DATA picks the corpus: the cleaned JSONL by default, or a conversation
+# Parquet file (only its output column is read, minus tombstoned vignettes)
+DATA_PATH = os.getenv("SFT_DATA", "combined_dataset_clean.jsonl")
+
 records = []
-with open("combined_dataset_clean.jsonl", "r") as f:
-    for i, line in enumerate(f, start=1):
-        try:
-            rec = json.loads(line)
-        except json.JSONDecodeError:
-            print(f"⚠️  Skipping malformed JSON at line {i}")
-            continue
-        out = rec.get("output")
-        if not out:
-            continue
-        records.append({"text": f"Diagnosis: {out.strip()}\n"})
+if DATA_PATH.endswith(".parquet"):
+    import sys
+
+    sys.path.append(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "new_data_gen", "actual_data_gen")
+    )
+    from conversation_store import TOMBSTONES, load_tombstones, read_conversations
+
+    tombstone_path = os.getenv("SFT_TOMBSTONES", os.path.join(os.path.dirname(DATA_PATH), TOMBSTONES))
+    table = read_conversations(DATA_PATH, columns=["output"], tombstones=load_tombstones(tombstone_path))
+    for out in table.column("output").to_pylist():
+        if out:
+            records.append({"text": f"Diagnosis: {out.strip()}\n"})
+else:
+    with open(DATA_PATH, "r") as f:
+        for i, line in enumerate(f, start=1):
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"⚠️  Skipping malformed JSON at line {i}")
+                continue
+            out = rec.get("output")
+            if not out:
+                continue
+            records.append({"text": f"Diagnosis: {out.strip()}\n"})
 
 print(f"✅ Loaded {len(records)} valid examples.")
 
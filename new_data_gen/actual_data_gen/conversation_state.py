@@ -0,0 +1,153 @@
+import os
+import json
+from contextvars import ContextVar
+
+# Raw turns (DOCTOR/PATIENT lines) shown to the per-turn agents
+DEFAULT_WINDOW = 6
+
+
+def compact_json(value):
+    """Single-line JSON for embedding structured values in prompts"""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def compact_text(text):
+    """Collapse runs of whitespace/newlines into single spaces"""
+    return " ".join(str(text).split())
+
+
+def answer_part(text):
+    """The ANSWER: section of a THINKING/ANSWER output (the whole text if none)"""
+    return text.split("ANSWER:", 1)[1].strip() if "ANSWER:" in text else text.strip()
+
+
+def render_memory(outputs, n=2):
+    """Last n agent outputs as compact ANSWER-only lines, for "previous analyses" context"""
+    return "\n".join(
+        f"[{i}] {compact_text(answer_part(output))}"
+        for i, output in enumerate(outputs[-n:], 1)
+    )
+
+
+class ConversationWindow:
+    """
+    Bounded prompt view of a doctor-patient transcript.
+
+    `turns` still holds the full transcript (it is saved with the outputs),
+    but prompts only see:
+      - `summary`: the latest vignette, which already folds in every turn up
+        to `summarized_upto`;
+      - the turns added since that summary (for the summarizer), or the last
+        `window` raw turns (for the other agents).
+
+    The summarizer therefore updates the vignette incrementally instead of
+    re-reading the whole transcript, and per-turn prompt size stays bounded
+    however long the interview runs.
+    """
+
+    __slots__ = ("turns", "window", "summary", "summarized_upto")
+
+    def __init__(self, turns=None, window=DEFAULT_WINDOW):
+        self.turns = turns if turns is not None else []
+        self.window = window
+        self.summary = ""
+        self.summarized_upto = 0
+
+    def append(self, speaker, text):
+        self.turns.append(f"{speaker}: {text}")
+
+    def recent(self, n=None):
+        return self.turns[-(n or self.window):]
+
+    def replies(self, speaker, n=3):
+        prefix = f"{speaker}:"
+        return [turn for turn in self.turns if turn.startswith(prefix)][-n:]
+
+    def new_turns(self):
+        """Turns not yet folded into the summary"""
+        return self.turns[self.summarized_upto:]
+
+    def update_summary(self, summary):
+        self.summary = summary
+        self.summarized_upto = len(self.turns)
+
+    @staticmethod
+    def render(turns):
+        return "\n".join(compact_text(turn) for turn in turns)
+
+    def render_recent(self, n=None):
+        return self.render(self.recent(n))
+
+    def render_new(self):
+        return self.render(self.new_turns())
+
+
+# Session whose interview is running in the current thread / asyncio task
+active_session = ContextVar("active_session", default=None)
+
+
+def record_session_tokens(tokens):
+    """Add an LLM call's total tokens to the active session, if any"""
+    session = active_session.get()
+    if session is not None and tokens:
+        session.tokens_used += tokens
+
+
+# Per-vignette role outputs, and where VignetteSession.save() writes each one
+ROLE_OUTPUTS = {
+    "summarizer_outputs": ("2summarizer_outputs", "summarizer"),
+    "patient_response": ("2patient_followups", "patient"),
+    "diagnosing_doctor_outputs": ("2diagnosing_doctor_outputs", "diagnoser"),
+    "questioning_doctor_outputs": ("2questioning_doctor_outputs", "questioner"),
+    "treatment_plans": ("2treatment_plans", "treatment"),
+    "behavioral_analyses": ("2behavioral_analyses", "behavioral_analysis"),
+    "patient_interpretations": ("2patient_interpretations", "interpretation"),
+}
+
+
+class VignetteSession:
+    """
+    Everything one simulated interview produces, owned by that interview.
+
+    Replaces the module-level output lists the generators used to reset per
+    vignette, so several vignettes can run in threads (or asyncio tasks) of
+    one process without their outputs mixing.
+    """
+
+    __slots__ = ("idx", "vignette_text", "gold_label", "conversation", "history",
+                 "behavior_metadata", "tokens_used", *ROLE_OUTPUTS)
+
+    def __init__(self, idx, vignette_text, gold_label, window=DEFAULT_WINDOW):
+        self.idx = idx
+        self.vignette_text = vignette_text
+        self.gold_label = gold_label
+        self.conversation = []
+        self.history = ConversationWindow(self.conversation, window)
+        self.behavior_metadata = {}
+        self.tokens_used = 0
+        for name in ROLE_OUTPUTS:
+            setattr(self, name, [])
+
+    def activate(self):
+        """Make this the session LLM calls in the current thread/task bill their tokens to"""
+        active_session.set(self)
+        return self
+
+    def to_result(self):
+        """The per-vignette result dict the __main__ aggregation expects"""
+        result = {name: getattr(self, name) for name in ROLE_OUTPUTS}
+        result.update(
+            vignette_index=self.idx,
+            behavior_metadata=self.behavior_metadata,
+            gold_diagnosis=self.gold_label,
+        )
+        return result
+
+    def save(self):
+        """Write each role's outputs (and the behavior metadata) as compact JSON"""
+        outputs = {name: (getattr(self, name), *target) for name, target in ROLE_OUTPUTS.items()}
+        outputs["behavior_metadata"] = (self.behavior_metadata, "2behavior_metadata", "behavior")
+        for records, directory, prefix in outputs.values():
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f"{prefix}_{self.idx}.json"), "w") as f:
+                json.dump(records, f, ensure_ascii=False, separators=(",", ":"))
@@ -0,0 +1,232 @@
+"""
+Canonical columnar format for generated conversation datasets.
+
+One row per role output: instruction/input/output plus the metadata the
+pipeline filters on (role, stage, vignette_index, behavior_type,
+gold_diagnosis). Rows are written to Parquet in row groups that each hold a
+single (role, stage), so a filter on stage or role skips whole row groups
+via their statistics, and a column projection reads only those columns:
+
+    read_conversations("2conversations.parquet", columns=["input", "output"],
+                       role="diagnoser", stage="L")
+
+Legacy JSON arrays (split_outputs_*.json, 2behavior_metadata.json,
+datasets/GRPO/*.json, combined_conversations.json) convert with:
+
+    python conversation_store.py split_outputs_DD_L.json split_outputs_DD_L.parquet --role diagnoser
+"""
+
+import os
+import json
+import time
+import argparse
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from conversation_state import ROLE_OUTPUTS
+
+CONVERSATION_SCHEMA = pa.schema(
+    [
+        ("instruction", pa.string()),
+        ("input", pa.string()),
+        ("output", pa.string()),
+        ("role", pa.string()),
+        ("stage", pa.string()),  # E / M / L for staged roles, else null
+        ("vignette_index", pa.int64()),
+        ("behavior_type", pa.string()),
+        ("gold_diagnosis", pa.string()),
+    ]
+)
+
+SUMMARIZER_INSTRUCTION = "“You are a clinical summarizer. Given a transcript of a doctor–patient dialogue, extract a structured clinical vignette summarizing the key symptoms, relevant history, and any diagnostic clues.”"
+TREATMENT_INSTRUCTION = "You are a board-certified clinician. Based on the provided diagnosis and patient vignette, propose a realistic, evidence-based treatment plan suitable for initiation by a primary care physician or psychiatrist."
+DIAGNOSIS_INSTRUCTIONS = {
+    "E": "You are a diagnostic reasoning model (Early Stage). Based on the patient vignette and early-stage observations, generate a list of plausible diagnoses with reasoning. Focus on broad differentials, considering common and uncommon conditions.",
+    "M": "You are a diagnostic reasoning model (Middle Stage). Given the current vignette, prior dialogue, and diagnostic hypothesis, refine the list of possible diagnoses with concise justifications for each. Aim to reduce diagnostic uncertainty.",
+    "L": "You are a diagnostic reasoning model (Late Stage). Based on the final patient vignette summary and full conversation, provide the most likely diagnosis with structured reasoning. Confirm diagnostic certainty and include END if no more questioning is necessary.",
+}
+QUESTION_INSTRUCTIONS = {
+    "E": "You are a questioning agent (Early Stage). Your task is to propose highly relevant early-stage questions that can open the differential diagnosis widely. Use epidemiology, demographics, and vague presenting symptoms as guides.",
+    "M": "You are a questioning agent (Middle Stage). Using the current diagnosis, past questions, and patient vignette, generate a specific question to refine the current differential diagnosis. Return your reasoning and next question.",
+    "L": "You are a questioning agent (Late Stage). Based on narrowed differentials and previous dialogue, generate a focused question that would help confirm or eliminate the final 1-2 suspected diagnoses.",
+}
+
+# Training instruction per role: a string, or {stage letter: instruction}
+ROLE_INSTRUCTIONS = {
+    "summarizer": SUMMARIZER_INSTRUCTION,
+    "treatment": TREATMENT_INSTRUCTION,
+    "diagnoser": DIAGNOSIS_INSTRUCTIONS,
+    "questioner": QUESTION_INSTRUCTIONS,
+}
+
+# Append-only log of pruned vignettes; readers skip these indices
+TOMBSTONES = "2tombstones.jsonl"
+
+# Role name for each VignetteSession output list that holds input/output records
+SESSION_ROLES = {
+    attr: prefix
+    for attr, (_, prefix) in ROLE_OUTPUTS.items()
+    if prefix in ("summarizer", "patient", "diagnoser", "questioner", "treatment")
+}
+
+
+def role_instruction(role, stage=None):
+    """Training instruction for a role (and stage), or None if it has none"""
+    instruction = ROLE_INSTRUCTIONS.get(role)
+    if isinstance(instruction, dict):
+        return instruction.get(stage)
+    return instruction
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def to_row(record, role=None, instruction=None, behavior_type=None, stage=None):
+    """Map one pipeline record (any of the JSON layouts) onto CONVERSATION_SCHEMA"""
+    stage = stage or record.get("stage") or record.get("letter")
+    index = record.get("vignette_index")
+    return {
+        "instruction": _text(instruction or record.get("instruction") or role_instruction(role, stage)),
+        "input": _text(record.get("input")),
+        "output": _text(record.get("output")),
+        "role": role or record.get("role"),
+        "stage": stage,
+        "vignette_index": int(index) if index is not None else None,
+        "behavior_type": behavior_type or record.get("behavior_type"),
+        "gold_diagnosis": _text(record.get("gold_diagnosis")),
+    }
+
+
+def session_rows(result):
+    """Rows for one VignetteSession.to_result() dict"""
+    behavior_type = result.get("behavior_metadata", {}).get("behavior_type")
+    defaults = {
+        "vignette_index": result.get("vignette_index"),
+        "gold_diagnosis": result.get("gold_diagnosis"),
+    }
+    for attr, role in SESSION_ROLES.items():
+        for record in result.get(attr, []):
+            yield to_row({**defaults, **record}, role=role, behavior_type=behavior_type)
+
+
+class ConversationWriter:
+    """
+    Streams rows into a Parquet file with CONVERSATION_SCHEMA.
+
+    Rows are buffered per (role, stage) and each buffer is flushed as its own
+    row group once it reaches row_group_size, so row groups stay homogeneous
+    in role and stage and memory stays bounded by one buffer per bucket.
+    """
+
+    def __init__(self, path, row_group_size=2000):
+        self.writer = pq.ParquetWriter(path, CONVERSATION_SCHEMA, compression="zstd")
+        self.row_group_size = row_group_size
+        self.buckets = {}
+        self.rows_written = 0
+
+    def write(self, row):
+        bucket = self.buckets.setdefault((row["role"], row["stage"]), [])
+        bucket.append(row)
+        if len(bucket) >= self.row_group_size:
+            self._flush(bucket)
+
+    def write_all(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def _flush(self, bucket):
+        if bucket:
+            self.writer.write_table(pa.Table.from_pylist(bucket, schema=CONVERSATION_SCHEMA))
+            self.rows_written += len(bucket)
+            bucket.clear()
+
+    def close(self):
+        for bucket in self.buckets.values():
+            self._flush(bucket)
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_conversations(path, rows, row_group_size=2000):
+    with ConversationWriter(path, row_group_size) as writer:
+        writer.write_all(rows)
+    return writer.rows_written
+
+
+def load_tombstones(path=TOMBSTONES):
+    """Vignette indices pruned in a tombstone log (empty if there is none)"""
+    tombstones = set()
+    if not os.path.exists(path):
+        return tombstones
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                tombstones.add(int(json.loads(line)["vignette_index"]))
+            except (ValueError, KeyError, TypeError):
+                continue  # torn last line of an interrupted run
+    return tombstones
+
+
+def add_tombstones(path, reasons):
+    """Append {vignette_index: reason} to a tombstone log, skipping indices already in it"""
+    existing = load_tombstones(path)
+    added = 0
+    with open(path, "a", encoding="utf-8") as f:
+        for index, reason in sorted(reasons.items()):
+            if index in existing:
+                continue
+            record = {"vignette_index": index, "reason": reason, "pruned_at": time.time()}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            added += 1
+    return added
+
+
+def read_conversations(path, columns=None, role=None, stage=None, behavior_type=None, tombstones=None):
+    """
+    Read a conversation Parquet file as a pyarrow Table, projecting `columns`
+    and pushing role/stage/behavior_type filters down to the row groups.
+    Rows of vignettes in `tombstones` (see load_tombstones) are left out.
+    """
+    filters = [
+        (name, "=", value)
+        for name, value in (("role", role), ("stage", stage), ("behavior_type", behavior_type))
+        if value is not None
+    ]
+    if tombstones:
+        filters.append(("vignette_index", "not in", sorted(tombstones)))
+    return pq.read_table(path, columns=columns, filters=filters or None)
+
+
+def convert_json(json_path, parquet_path, role=None, stage=None, instruction=None):
+    """Convert a legacy JSON array of records to the canonical Parquet format"""
+    with open(json_path, "r", encoding="utf-8") as f:
+        records = json.load(f)
+    rows = (
+        to_row(record, role=role, instruction=instruction, stage=stage)
+        for record in records
+        if isinstance(record, dict)
+    )
+    return write_conversations(parquet_path, rows)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Convert a JSON array of records to conversation Parquet")
+    parser.add_argument("json_path")
+    parser.add_argument("parquet_path")
+    parser.add_argument("--role", default=None, help="summarizer / diagnoser / questioner / treatment / patient")
+    parser.add_argument("--stage", default=None, help="Stage letter for files without per-record 'letter'")
+    parser.add_argument("--instruction", default=None, help="Instruction for records that don't carry one")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    n = convert_json(args.json_path, args.parquet_path, args.role, args.stage, args.instruction)
+    print(f"✅ Wrote {n} rows to {args.parquet_path}")
@@ -0,0 +1,157 @@
+"""
+One-pass training-set builder.
+
+Replaces format_datasets.py -> quality_check/check.py (split_by_letter) ->
+combine.py, which each materialized the full dataset. Here every per-vignette
+role file is read once, each record is routed by role and stage letter to its
+instruction, records without a THINKING/ANSWER output (or of a vignette
+tombstoned by prune.py) are dropped, and the result is written as it goes (JSONL, and optionally the conversation Parquet
+format from conversation_store.py with role/stage/behavior metadata):
+
+    python build_dataset.py --out combined_conversations.jsonl [--parquet combined_conversations.parquet]
+
+Memory stays flat: one role file plus at most --batch-size Parquet rows per
+(role, stage).
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+from collections import Counter
+
+# Normalize script directory for relative paths
+script_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_ROOT = os.path.join(script_dir, "..", "..", "..")
+sys.path.append(os.path.dirname(script_dir))
+
+from conversation_state import ROLE_OUTPUTS
+from conversation_store import (
+    ROLE_INSTRUCTIONS,
+    TOMBSTONES,
+    ConversationWriter,
+    load_tombstones,
+    role_instruction,
+    to_row,
+)
+
+# Training roles and the directory each one's per-vignette outputs live in
+ROLE_DIRS = {
+    role: directory
+    for directory, role in ROLE_OUTPUTS.values()
+    if role in ROLE_INSTRUCTIONS
+}
+BEHAVIOR_DIR = "2behavior_metadata"
+
+THINKING_ANSWER_RE = re.compile(r"THINKING:\s*\S.*?ANSWER:\s*\S", re.DOTALL)
+LEADING_NUMBER_RE = re.compile(r"^\s*\d+\.\s*")
+
+
+def iter_role_records(folder):
+    """Records of every per-vignette JSON file in a role directory, one file at a time"""
+    try:
+        filenames = sorted(os.listdir(folder))
+    except OSError as e:
+        print(f"❌ Could not list contents of {folder}: {e}")
+        return
+    for filename in filenames:
+        if filename.startswith(".") or not filename.endswith(".json"):
+            continue
+        filepath = os.path.join(folder, filename)
+        try:
+            with open(filepath, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"⚠️ Failed to load {filepath}: {e}")
+            continue
+        if isinstance(data, dict):
+            yield data
+        elif isinstance(data, list):
+            yield from data
+
+
+class BehaviorLookup:
+    """behavior_type per vignette, read lazily from 2behavior_metadata/behavior_{idx}.json"""
+
+    def __init__(self, root):
+        self.folder = os.path.join(root, BEHAVIOR_DIR)
+        self.cache = {}
+
+    def __call__(self, index):
+        if index not in self.cache:
+            try:
+                with open(os.path.join(self.folder, f"behavior_{index}.json"), "r") as f:
+                    self.cache[index] = json.load(f).get("behavior_type")
+            except (OSError, ValueError, AttributeError):
+                self.cache[index] = None
+        return self.cache[index]
+
+
+def iter_examples(root, stats):
+    """Validated CONVERSATION_SCHEMA rows across all training roles, minus pruned vignettes"""
+    behavior_type = BehaviorLookup(root)
+    tombstones = load_tombstones(os.path.join(root, TOMBSTONES))
+    for role, directory in ROLE_DIRS.items():
+        folder = os.path.join(root, directory)
+        if not os.path.exists(folder):
+            print(f"❌ Folder not found: {folder}")
+            continue
+        for record in iter_role_records(folder):
+            if record.get("vignette_index") in tombstones:
+                stats[f"{role}:pruned"] += 1
+                continue
+            stage = record.get("letter")
+            instruction = role_instruction(role, stage)
+            if instruction is None:
+                stats[f"{role}:unrouted"] += 1
+                continue
+            output = str(record.get("output", ""))
+            if not THINKING_ANSWER_RE.search(output):
+                stats[f"{role}:bad_format"] += 1
+                continue
+            stats[f"{role}:{stage or '-'}"] += 1
+            row = to_row(
+                record,
+                role=role,
+                instruction=instruction,
+                behavior_type=behavior_type(record.get("vignette_index")),
+            )
+            row["input"] = LEADING_NUMBER_RE.sub("", row["input"] or "")
+            yield row
+
+
+def build(root, out_path, parquet_path=None, batch_size=2000):
+    stats = Counter()
+    parquet = ConversationWriter(parquet_path, batch_size) if parquet_path else None
+    written = 0
+    try:
+        with open(out_path, "w", encoding="utf-8") as out:
+            for row in iter_examples(root, stats):
+                example = {key: row[key] for key in ("instruction", "input", "output")}
+                out.write(json.dumps(example, ensure_ascii=False) + "\n")
+                if parquet:
+                    parquet.write(row)
+                written += 1
+    finally:
+        if parquet:
+            parquet.close()
+
+    for key in sorted(stats):
+        print(f"   {key}: {stats[key]}")
+    print(f"✅ Wrote {written} examples to {out_path}" + (f" and {parquet_path}" if parquet_path else ""))
+    return stats
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Stream role outputs into one training file")
+    parser.add_argument("--root", default=DEFAULT_ROOT, help="Directory holding the 2*_outputs folders")
+    parser.add_argument("--out", default="combined_conversations.jsonl")
+    parser.add_argument("--parquet", default=None, help="Also write the conversation Parquet format here")
+    parser.add_argument("--batch-size", type=int, default=2000, help="Parquet rows per (role, stage) row group")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    build(args.root, args.out, args.parquet, args.batch_size)
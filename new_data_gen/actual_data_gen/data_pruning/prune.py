@@ -1,6 +1,33 @@
+"""
+Leakage pruning for generated vignettes.
+
+The role folders are listed once into a vignette index -> artifact files map
+(parsed from "<prefix>_<idx>.json" with the prefixes VignetteSession.save
+writes, so index 12 never picks up _112 or _1_12 files). The scanned role's records are loaded into one Arrow table and
+every leakage rule is a single vectorized regex match over its text columns.
+Matching vignettes are tombstoned in the dataset store (2tombstones.jsonl,
+which build_dataset.py and read_conversations() skip) rather than deleted;
+--delete removes their files through the index map instead.
+
+    python prune.py --rule gold_leak=gold --keywords answer_leak="gold diagnosis,correct diagnosis"
+"""
+
 import os
+import re
+import sys
 import json
-import glob
+import argparse
+from collections import defaultdict
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Normalize script directory for relative paths
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(script_dir))
+
+from conversation_state import ROLE_OUTPUTS
+from conversation_store import TOMBSTONES, add_tombstones, read_conversations
 
 # -- CONFIGURE THESE --
 BASE_DIR = (
@@ -13,47 +40,124 @@ FOLDERS = [
     "2summarizer_outputs",
     "2treatment_plans",
 ]
-QUESTION_DIR = os.path.join(BASE_DIR, "2questioning_doctor_outputs")
+SCAN_ROLE = "questioner"
+# Leakage rules: name -> case-insensitive regex over input and output
+DEFAULT_RULES = {"gold_leak": r"gold"}
 # ----------------------
 
+# Only the prefixes VignetteSession.save writes (role names + "behavior"): a
+# generic ".+_" prefix would read "a_1_12.json" as vignette 12
+ARTIFACT_PREFIXES = sorted({prefix for _, prefix in ROLE_OUTPUTS.values()} | {"behavior"})
+ARTIFACT_RE = re.compile(
+    r"^(?P<prefix>" + "|".join(map(re.escape, ARTIFACT_PREFIXES)) + r")_(?P<index>\d+)\.json$"
+)
+
 
-def find_bad_indices():
-    bad = set()
-    for path in glob.glob(os.path.join(QUESTION_DIR, "*.json")):
-        try:
-            with open(path, "r") as f:
-                data = json.load(f)
-        except Exception:
+def build_artifact_index(base_dir, folders):
+    """{vignette index: [artifact paths]} from one directory listing per folder"""
+    artifacts = defaultdict(list)
+    for folder in folders:
+        folder_path = os.path.join(base_dir, folder)
+        if not os.path.isdir(folder_path):
             continue
-        for entry in data:
-            inp = str(entry.get("input", "")).lower()
-            out = str(entry.get("output", "")).lower()
-            if "gold" in inp or "gold" in out:
-                # assume each entry has a vignette_index field
-                idx = entry.get("vignette_index")
-                if idx is None:
-                    # fallback: extract from filename like questioner_123.json
-                    fname = os.path.basename(path)
-                    parts = fname.split("_")
-                    if len(parts) >= 2 and parts[-1].endswith(".json"):
-                        idx = int(parts[-1][:-5])
-                bad.add(idx)
-                break
-    return bad
-
-
-def prune_indices(bad_indices):
-    for folder in FOLDERS:
-        folder_path = os.path.join(BASE_DIR, folder)
-        for idx in bad_indices:
-            pattern = os.path.join(folder_path, f"*_{idx}.json")
-            for p in glob.glob(pattern):
-                print(f"Removing {p}")
-                os.remove(p)
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                match = ARTIFACT_RE.match(entry.name)
+                if match and entry.is_file():
+                    artifacts[int(match.group("index"))].append(entry.path)
+    return artifacts
+
+
+def keyword_rule(keywords):
+    """Regex matching any of the keywords as whole words"""
+    return r"\b(?:" + "|".join(re.escape(k.strip()) for k in keywords if k.strip()) + r")\b"
+
+
+def load_role_table(base_dir, role, artifacts):
+    """vignette_index/input/output of one role's records, from its per-vignette files"""
+    directory = next(d for d, prefix in ROLE_OUTPUTS.values() if prefix == role)
+    folder = os.path.join(base_dir, directory)
+    indices, inputs, outputs = [], [], []
+    for index, paths in artifacts.items():
+        for path in paths:
+            if os.path.dirname(path) != folder:
+                continue
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+            except Exception:
+                continue
+            for entry in data if isinstance(data, list) else [data]:
+                # The file name is authoritative; records may lack vignette_index
+                indices.append(index)
+                inputs.append(str(entry.get("input", "")))
+                outputs.append(str(entry.get("output", "")))
+    return pa.table({"vignette_index": pa.array(indices, pa.int64()), "input": inputs, "output": outputs})
+
+
+def find_leaks(table, rules):
+    """{vignette index: first matching rule name} across all rows of the table"""
+    leaks = {}
+    for name, pattern in rules.items():
+        hit = pc.or_(
+            pc.match_substring_regex(table["input"], pattern, ignore_case=True),
+            pc.match_substring_regex(table["output"], pattern, ignore_case=True),
+        )
+        for index in pc.unique(table["vignette_index"].filter(pc.fill_null(hit, False))).to_pylist():
+            leaks.setdefault(index, name)
+    return leaks
+
+
+def delete_artifacts(artifacts, indices):
+    for index in sorted(indices):
+        for path in artifacts.get(index, []):
+            print(f"Removing {path}")
+            os.remove(path)
+
+
+def parse_rules(args):
+    rules = {}
+    for spec in args.rule or []:
+        name, _, pattern = spec.partition("=")
+        rules[name] = pattern
+    for spec in args.keywords or []:
+        name, _, keywords = spec.partition("=")
+        rules[name] = keyword_rule(keywords.split(","))
+    return rules or dict(DEFAULT_RULES)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Tombstone (or delete) vignettes whose outputs leak the answer")
+    parser.add_argument("--base-dir", default=BASE_DIR)
+    parser.add_argument("--parquet", default=None, help="Scan a conversation Parquet file instead of the role folders")
+    parser.add_argument("--role", default=SCAN_ROLE, help="Role whose records are scanned")
+    parser.add_argument("--rule", action="append", metavar="NAME=REGEX", help="Leakage regex (repeatable)")
+    parser.add_argument("--keywords", action="append", metavar="NAME=KW1,KW2", help="Leakage keyword set (repeatable)")
+    parser.add_argument("--delete", action="store_true", help="Delete the vignettes' files instead of tombstoning")
+    parser.add_argument("--dry-run", action="store_true")
+    return parser
 
 
 if __name__ == "__main__":
-    bad = find_bad_indices()
-    print(f"Found {len(bad)} bad indices:", bad)
-    prune_indices(bad)
+    args = build_parser().parse_args()
+    rules = parse_rules(args)
+
+    artifacts = build_artifact_index(args.base_dir, FOLDERS)
+    if args.parquet:
+        table = read_conversations(args.parquet, columns=["vignette_index", "input", "output"], role=args.role)
+    else:
+        table = load_role_table(args.base_dir, args.role, artifacts)
+    print(f"🔍 Scanning {table.num_rows} {args.role} records from {len(artifacts)} vignettes")
+
+    leaks = find_leaks(table, rules)
+    print(f"Found {len(leaks)} bad indices:", sorted(leaks))
+    if args.dry_run or not leaks:
+        sys.exit(0)
+
+    if args.delete:
+        delete_artifacts(artifacts, leaks)
+    else:
+        tombstone_path = os.path.join(args.base_dir, TOMBSTONES)
+        added = add_tombstones(tombstone_path, leaks)
+        print(f"🪦 Tombstoned {added} new vignettes in {tombstone_path}")
     print("Done pruning.")
@@ -1,8 +1,43 @@
-from datasets import Dataset, DatasetDict
-import json
+"""
+Export the combined conversations as Parquet shards and publish the ones
+that changed:
 
-with open("combined_conversations.json") as f:
-    raw_data = json.load(f)
+    python upload.py combined_conversations.parquet
+    python upload.py combined_conversations.json --target-dir /tmp/hub-mirror   # offline
+"""
 
-dataset = Dataset.from_list(raw_data)
-dataset.push_to_hub("CodCodingCode/clinical-conversations-V2")
+import os
+import sys
+import argparse
+
+# Normalize script directory for relative paths
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(script_dir))
+
+from dataset_publish import HubTarget, LocalTarget, iter_source_batches, publish, write_shards
+
+REPO_ID = "CodCodingCode/clinical-conversations-V2"
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Publish a conversation dataset as sharded Parquet")
+    parser.add_argument("source", nargs="?", default="combined_conversations.json",
+                        help="Parquet, JSONL or JSON-array file")
+    parser.add_argument("--local-dir", default="publish/clinical-conversations-V2", help="Where shards are staged")
+    parser.add_argument("--repo-id", default=REPO_ID)
+    parser.add_argument("--target-dir", default=None, help="Publish to this directory instead of the Hub")
+    parser.add_argument("--max-shard-mb", type=int, default=256)
+    parser.add_argument("--split", default="train")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    write_shards(
+        iter_source_batches(args.source),
+        args.local_dir,
+        split=args.split,
+        max_shard_bytes=args.max_shard_mb * 1024 * 1024,
+    )
+    target = LocalTarget(args.target_dir) if args.target_dir else HubTarget(args.repo_id)
+    publish(args.local_dir, target)
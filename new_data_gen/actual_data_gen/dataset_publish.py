@@ -0,0 +1,237 @@
+"""
+Sharded, resumable dataset publishing.
+
+A dataset is exported as size-bounded Parquet shards under
+<local_dir>/data/<split>-NNNNN.parquet, with a manifest.json mapping each
+shard to its sha256. Publishing compares that manifest with the target's
+copy and only uploads shards whose hash changed (then deletes shards the
+target has but the export no longer does). The target's manifest is updated
+together with every shard, so an interrupted publish resumes where it
+stopped.
+
+Targets:
+  - LocalTarget(dir): a plain directory, for offline runs and testing;
+  - HubTarget(repo_id): a Hugging Face dataset repo (the data/<split>-*
+    layout is picked up by load_dataset as-is).
+"""
+
+import os
+import json
+import glob
+import shutil
+import hashlib
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    from huggingface_hub import HfApi, CommitOperationAdd, CommitOperationDelete, hf_hub_download
+    from huggingface_hub.utils import EntryNotFoundError, RepositoryNotFoundError
+except ImportError:
+    HfApi = None
+
+MANIFEST = "manifest.json"
+DEFAULT_SHARD_BYTES = 256 * 1024 * 1024
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(local_dir):
+    path = os.path.join(local_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(local_dir, manifest):
+    path = os.path.join(local_dir, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def _iter_json_array(path):
+    """Items of a top-level JSON array, parsed incrementally when ijson is installed"""
+    if ijson is not None:
+        with open(path, "rb") as f:
+            yield from ijson.items(f, "item", use_float=True)
+        return
+    print(f"⚠️ ijson not installed, loading {path} in one piece")
+    with open(path, "r", encoding="utf-8") as f:
+        yield from json.load(f)
+
+
+def iter_source_batches(path, batch_size=10000):
+    """
+    RecordBatches of a Parquet, JSONL or JSON-array file, read incrementally
+    (JSON arrays need ijson for that). Later JSON batches take the schema
+    inferred from the first one.
+    """
+    if path.endswith(".parquet"):
+        yield from pq.ParquetFile(path).iter_batches(batch_size=batch_size)
+        return
+    if path.endswith(".jsonl"):
+        import pyarrow.json as pa_json
+
+        yield from pa_json.open_json(path)
+        return
+
+    schema = None
+    rows = []
+    for item in _iter_json_array(path):
+        rows.append(item)
+        if len(rows) == batch_size:
+            batch = pa.RecordBatch.from_pylist(rows, schema=schema)
+            schema = batch.schema
+            rows = []
+            yield batch
+    if rows:
+        yield pa.RecordBatch.from_pylist(rows, schema=schema)
+
+
+def write_shards(batches, local_dir, split="train", max_shard_bytes=DEFAULT_SHARD_BYTES):
+    """
+    Write RecordBatches as Parquet shards of at most ~max_shard_bytes of
+    Arrow data each, replacing any earlier shards of the split, and record
+    their hashes in the manifest. Returns the manifest.
+    """
+    data_dir = os.path.join(local_dir, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    for old in glob.glob(os.path.join(data_dir, f"{split}-*.parquet")):
+        os.remove(old)
+
+    manifest = {rel: digest for rel, digest in load_manifest(local_dir).items()
+                if not rel.startswith(f"data/{split}-")}
+    writer = None
+    shard_bytes = 0
+    shard_paths = []
+
+    def close_shard():
+        nonlocal writer
+        if writer is not None:
+            writer.close()
+            writer = None
+
+    for batch in batches:
+        while batch.num_rows:
+            if writer is None:
+                shard_paths.append(os.path.join(data_dir, f"{split}-{len(shard_paths):05d}.parquet"))
+                writer = pq.ParquetWriter(shard_paths[-1], batch.schema, compression="zstd")
+                shard_bytes = 0
+            # Split a batch that would overflow the shard at the row boundary
+            row_bytes = max(1, batch.nbytes // batch.num_rows)
+            fits = max(1, (max_shard_bytes - shard_bytes) // row_bytes)
+            head, batch = batch.slice(0, fits), batch.slice(fits)
+            writer.write_batch(head)
+            shard_bytes += head.nbytes
+            if shard_bytes >= max_shard_bytes:
+                close_shard()
+    close_shard()
+
+    for path in shard_paths:
+        manifest[os.path.relpath(path, local_dir)] = file_sha256(path)
+    save_manifest(local_dir, manifest)
+    print(f"📦 Wrote {len(shard_paths)} {split} shards to {data_dir}")
+    return manifest
+
+
+class LocalTarget:
+    """Publish into a local directory (offline mirror of a Hub dataset repo)"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def manifest(self):
+        return load_manifest(self.directory)
+
+    def put(self, local_path, rel, manifest):
+        dest = os.path.join(self.directory, rel)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copyfile(local_path, dest + ".tmp")
+        os.replace(dest + ".tmp", dest)
+        save_manifest(self.directory, manifest)
+
+    def delete(self, rels, manifest):
+        for rel in rels:
+            path = os.path.join(self.directory, rel)
+            if os.path.exists(path):
+                os.remove(path)
+        save_manifest(self.directory, manifest)
+
+
+class HubTarget:
+    """Publish into a Hugging Face dataset repo, one commit per shard"""
+
+    def __init__(self, repo_id, token=None, private=False):
+        if HfApi is None:
+            raise ImportError("huggingface_hub is required to publish to the Hub")
+        self.repo_id = repo_id
+        self.token = token
+        self.api = HfApi(token=token)
+        self.api.create_repo(repo_id, repo_type="dataset", private=private, exist_ok=True)
+
+    def manifest(self):
+        try:
+            path = hf_hub_download(self.repo_id, MANIFEST, repo_type="dataset", token=self.token)
+        except (EntryNotFoundError, RepositoryNotFoundError):
+            return {}
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _manifest_op(self, manifest):
+        data = json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8")
+        return CommitOperationAdd(path_in_repo=MANIFEST, path_or_fileobj=data)
+
+    def put(self, local_path, rel, manifest):
+        self.api.create_commit(
+            self.repo_id,
+            repo_type="dataset",
+            operations=[CommitOperationAdd(path_in_repo=rel, path_or_fileobj=local_path), self._manifest_op(manifest)],
+            commit_message=f"Upload {rel}",
+        )
+
+    def delete(self, rels, manifest):
+        self.api.create_commit(
+            self.repo_id,
+            repo_type="dataset",
+            operations=[CommitOperationDelete(path_in_repo=rel) for rel in rels] + [self._manifest_op(manifest)],
+            commit_message=f"Remove {len(rels)} stale shards",
+        )
+
+
+def publish(local_dir, target):
+    """Upload the shards whose hash differs from the target's manifest; returns the uploaded paths"""
+    local = load_manifest(local_dir)
+    remote = target.manifest()
+
+    uploaded = []
+    for rel, digest in sorted(local.items()):
+        if remote.get(rel) == digest:
+            continue
+        remote[rel] = digest
+        target.put(os.path.join(local_dir, rel), rel, remote)
+        uploaded.append(rel)
+        print(f"⬆️  {rel}")
+
+    stale = sorted(rel for rel in remote if rel not in local)
+    if stale:
+        for rel in stale:
+            del remote[rel]
+        target.delete(stale, remote)
+
+    print(f"✅ Published {len(uploaded)} changed shards "
+          f"({len(local) - len(uploaded)} unchanged, {len(stale)} removed)")
+    return uploaded
@@ -1,97 +1,104 @@
-def generate_empathetic_questioning_prompt(
-    base_role, behavioral_cues="", turn_stage="early"
-):
-    """
-    Generate questioning prompts that incorporate empathy based on detected behavioral cues
-    """
-    base_empathy_instructions = """
-    You are a compassionate physician who recognizes that patients have different communication styles and emotional needs.
-    
-    CORE EMPATHY PRINCIPLES:
-    - Validate the patient's feelings and concerns
-    - Use language that matches the patient's emotional state
-    - Build trust through understanding
-    - Adapt your communication style to the patient's needs
-    """
+# Static part of every empathetic questioner prompt. It is kept byte-identical
+# across calls and placed first so provider prompt caching / KV-prefix reuse
+# can skip it; only the stage guidance and detected cues vary per turn.
+EMPATHY_BASE_INSTRUCTIONS = """You are a compassionate physician who recognizes that patients have different communication styles and emotional needs.
 
-    stage_specific_guidance = {
-        "early": "Focus on building rapport and making the patient feel heard and safe.",
-        "middle": "Show understanding of their concerns while gathering focused information.",
-        "late": "Provide reassurance and clear communication about next steps.",
-    }
+CORE EMPATHY PRINCIPLES:
+- Validate the patient's feelings and concerns
+- Use language that matches the patient's emotional state
+- Build trust through understanding
+- Adapt your communication style to the patient's needs
 
-    empathy_adaptations = ""
-    if "anxiety" in behavioral_cues.lower() or "fear" in behavioral_cues.lower():
-        empathy_adaptations += """
-        ANXIETY/FEAR DETECTED - Empathetic Adaptations:
-        - Acknowledge their fears explicitly: "I can see this is really worrying you..."
-        - Provide reassurance: "We're going to figure this out together"
-        - Explain your reasoning: "I'm asking this because..."
-        - Offer hope: "Many conditions that cause these symptoms are very treatable"
-        """
+COMMUNICATION GUIDELINES:
+- Ask ONE clear question at a time
+- Include empathetic acknowledgment before your question
+- Use warm, professional language
+- Show genuine interest in the patient as a person
+- Validate their experience before seeking more information"""
 
-    if "embarrass" in behavioral_cues.lower() or "hesitat" in behavioral_cues.lower():
-        empathy_adaptations += """
-        EMBARRASSMENT/HESITATION DETECTED - Empathetic Adaptations:
-        - Normalize their experience: "This is very common, and there's nothing to be embarrassed about"
-        - Create safe space: "Everything we discuss is confidential"
-        - Use gentle, non-judgmental language
-        - Thank them for sharing: "I appreciate you telling me about this"
-        """
+STAGE_SPECIFIC_GUIDANCE = {
+    "early": "Focus on building rapport and making the patient feel heard and safe.",
+    "middle": "Show understanding of their concerns while gathering focused information.",
+    "late": "Provide reassurance and clear communication about next steps.",
+}
 
-    if "minimiz" in behavioral_cues.lower() or "tough" in behavioral_cues.lower():
-        empathy_adaptations += """
-        STOICISM/MINIMIZATION DETECTED - Empathetic Adaptations:
-        - Acknowledge their strength: "I can see you're someone who handles things well"
-        - Respect their perspective: "I understand you don't like to make a big deal of things"
-        - Frame health-seeking as strength: "Taking care of this shows good judgment"
-        - Be direct and practical in your approach
-        """
+# (trigger substrings, adaptation block), in a fixed order so the same cues
+# always produce the same prompt text
+EMPATHY_ADAPTATIONS = [
+    (
+        ("anxiety", "fear"),
+        '''ANXIETY/FEAR DETECTED - Empathetic Adaptations:
+- Acknowledge their fears explicitly: "I can see this is really worrying you..."
+- Provide reassurance: "We're going to figure this out together"
+- Explain your reasoning: "I'm asking this because..."
+- Offer hope: "Many conditions that cause these symptoms are very treatable"''',
+    ),
+    (
+        ("embarrass", "hesitat"),
+        '''EMBARRASSMENT/HESITATION DETECTED - Empathetic Adaptations:
+- Normalize their experience: "This is very common, and there's nothing to be embarrassed about"
+- Create safe space: "Everything we discuss is confidential"
+- Use gentle, non-judgmental language
+- Thank them for sharing: "I appreciate you telling me about this"''',
+    ),
+    (
+        ("minimiz", "tough"),
+        """STOICISM/MINIMIZATION DETECTED - Empathetic Adaptations:
+- Acknowledge their strength: "I can see you're someone who handles things well"
+- Respect their perspective: "I understand you don't like to make a big deal of things"
+- Frame health-seeking as strength: "Taking care of this shows good judgment"
+- Be direct and practical in your approach""",
+    ),
+    (
+        ("confus", "uncertain"),
+        '''CONFUSION/UNCERTAINTY DETECTED - Empathetic Adaptations:
+- Show patience: "Take your time, there's no rush"
+- Normalize confusion: "It's completely normal to have trouble remembering exact timelines"
+- Break down questions into smaller parts
+- Offer gentle guidance: "Let's start with what you remember most clearly"''',
+    ),
+    (
+        ("story", "detail"),
+        """STORYTELLING/DETAIL-SHARING DETECTED - Empathetic Adaptations:
+- Show appreciation for context: "Thank you for giving me that background"
+- Gently redirect when needed: "That's helpful context. Let me ask specifically about..."
+- Acknowledge family/social connections they mention
+- Validate their need to provide context""",
+    ),
+    (
+        ("family", "pressure"),
+        """FAMILY PRESSURE/CAREGIVER STRESS DETECTED - Empathetic Adaptations:
+- Acknowledge family concerns: "I can see your family is worried about you"
+- Validate caregiving burden: "It sounds like you have a lot of responsibility"
+- Include family perspective when appropriate
+- Address both patient and family needs""",
+    ),
+]
 
-    if "confus" in behavioral_cues.lower() or "uncertain" in behavioral_cues.lower():
-        empathy_adaptations += """
-        CONFUSION/UNCERTAINTY DETECTED - Empathetic Adaptations:
-        - Show patience: "Take your time, there's no rush"
-        - Normalize confusion: "It's completely normal to have trouble remembering exact timelines"
-        - Break down questions into smaller parts
-        - Offer gentle guidance: "Let's start with what you remember most clearly"
-        """
 
-    if "story" in behavioral_cues.lower() or "detail" in behavioral_cues.lower():
-        empathy_adaptations += """
-        STORYTELLING/DETAIL-SHARING DETECTED - Empathetic Adaptations:
-        - Show appreciation for context: "Thank you for giving me that background"
-        - Gently redirect when needed: "That's helpful context. Let me ask specifically about..."
-        - Acknowledge family/social connections they mention
-        - Validate their need to provide context
-        """
-
-    if "family" in behavioral_cues.lower() or "pressure" in behavioral_cues.lower():
-        empathy_adaptations += """
-        FAMILY PRESSURE/CAREGIVER STRESS DETECTED - Empathetic Adaptations:
-        - Acknowledge family concerns: "I can see your family is worried about you"
-        - Validate caregiving burden: "It sounds like you have a lot of responsibility"
-        - Include family perspective when appropriate
-        - Address both patient and family needs
-        """
-
-    combined_prompt = f"""
-    {base_empathy_instructions}
-    
-    CURRENT STAGE: {turn_stage.upper()}
-    {stage_specific_guidance[turn_stage]}
-    
-    {empathy_adaptations if empathy_adaptations else "Use standard empathetic communication approaches."}
-    
-    COMMUNICATION GUIDELINES:
-    - Ask ONE clear question at a time
-    - Include empathetic acknowledgment before your question
-    - Use warm, professional language
-    - Show genuine interest in the patient as a person
-    - Validate their experience before seeking more information
-    
-    {base_role}
+def generate_empathetic_questioning_prompt(
+    base_role, behavioral_cues="", turn_stage="early"
+):
     """
+    Generate questioning prompts that incorporate empathy based on detected behavioral cues.
 
-    return combined_prompt
+    Ordered from most to least stable: shared empathy instructions, the
+    (per-stage) base role, stage guidance, then the cue-specific adaptations.
+    """
+    cues = behavioral_cues.lower()
+    adaptations = [
+        block
+        for triggers, block in EMPATHY_ADAPTATIONS
+        if any(trigger in cues for trigger in triggers)
+    ]
 
+    return "\n\n".join(
+        [
+            EMPATHY_BASE_INSTRUCTIONS,
+            base_role.strip(),
+            f"CURRENT STAGE: {turn_stage.upper()}\n{STAGE_SPECIFIC_GUIDANCE[turn_stage]}",
+            "\n\n".join(adaptations)
+            if adaptations
+            else "Use standard empathetic communication approaches.",
+        ]
+    )
@@ -1,21 +1,29 @@
 import os
+import sys
 import json
 from openai import OpenAI
 import time
-import multiprocessing
+import threading
 import shutil
 from itertools import islice
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import random
 
+from conversation_state import VignetteSession, compact_json, record_session_tokens
+from stopping_policy import DifferentialConvergencePolicy
+from conversation_store import session_rows, write_conversations
+from script_loader import bounded_map, iter_roleplay_scripts
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "grpo_infra", "formatting"))
+from format_rewards import format_output, parse_output
+
 # Initialize OpenAI client
 client = OpenAI(
     api_key="api"
 )
 model = "gpt-4.1-nano"
 
-treatment_plans = []
-
-
 # === Patient Behavior Configurations ===
 PATIENT_BEHAVIORS = {
     "baseline": {
@@ -117,21 +125,13 @@ class PatientInterpreter:
         self.responder = RoleResponder(self.role_instruction)
 
     def interpret_patient_communication(
-        self, conversation_history, detected_behavior, current_vignette
+        self, history, detected_behavior, current_vignette
     ):
         """Analyze patient communication to extract unbiased clinical information using Chain of Thought reasoning"""
 
         interpretation_prompt = f"""
         TASK: Use Chain of Thought reasoning to analyze this patient's communication pattern and extract the true clinical picture.
         
-        DETECTED PATIENT BEHAVIOR: {detected_behavior}
-        
-        CONVERSATION HISTORY:
-        {json.dumps(conversation_history[-6:], indent=2)}  # Last 6 exchanges
-        
-        CURRENT VIGNETTE SUMMARY:
-        {current_vignette}
-        
         YOU MUST RESPOND IN THE FOLLOWING FORMAT:
         
         THINKING:
@@ -197,13 +197,21 @@ class PatientInterpreter:
         - Specific questions to ask: <targeted questions to get missing information + rationale>
         - Approach strategy: <how to ask sensitively + psychological reasoning>
         - Priority order: <which questions to ask first and why>
+        
+        DETECTED PATIENT BEHAVIOR: {detected_behavior}
+        
+        RECENT CONVERSATION:
+        {history.render_recent()}
+        
+        CURRENT VIGNETTE SUMMARY:
+        {current_vignette}
         """
 
         return self.responder.ask(interpretation_prompt)
 
 
 # Enhanced Chain of Thought detect_patient_behavior_cues function
-def detect_patient_behavior_cues_enhanced(conversation_history, patient_responses):
+def detect_patient_behavior_cues_enhanced(history):
     """Enhanced version that provides more detailed behavioral analysis using Chain of Thought reasoning"""
     cue_detector = RoleResponder(
         """You are a behavioral psychologist specializing in patient communication patterns.
@@ -213,17 +221,9 @@ def detect_patient_behavior_cues_enhanced(conversation_history, patient_response
         You use Chain of Thought reasoning to systematically analyze patient behavior patterns."""
     )
 
-    recent_responses = patient_responses[-3:]
-
     analysis = cue_detector.ask(
         f"""
-    Use Chain of Thought reasoning to analyze these patient responses for detailed behavioral patterns:
-    
-    RECENT PATIENT RESPONSES:
-    {json.dumps(recent_responses, indent=2)}
-    
-    CONVERSATION CONTEXT:
-    {json.dumps(conversation_history[-6:], indent=2)}
+    Use Chain of Thought reasoning to analyze the patient responses given at the end for detailed behavioral patterns.
     
     YOU MUST RESPOND IN THE FOLLOWING FORMAT:
     
@@ -292,6 +292,12 @@ def detect_patient_behavior_cues_enhanced(conversation_history, patient_response
     - Symptoms probably minimized: <what's worse than they say + evidence>
     - Concerns probably amplified: <what they're over-worried about + evidence>
     - True timeline: <actual progression vs reported progression + reasoning>
+    
+    RECENT PATIENT RESPONSES:
+    {history.render(history.replies("PATIENT", 3))}
+    
+    CONVERSATION CONTEXT:
+    {history.render_recent()}
     """
     )
 
@@ -299,10 +305,11 @@ def detect_patient_behavior_cues_enhanced(conversation_history, patient_response
 
 
 # Enhanced summarizer function that incorporates patient interpretation
-def generate_unbiased_vignette(
-    conversation_history, previous_vignette, patient_interpretation
-):
-    """Generate a vignette that accounts for patient communication biases"""
+def generate_unbiased_vignette(history, patient_interpretation):
+    """
+    Update the vignette with the turns since the previous one, accounting for
+    patient communication biases
+    """
 
     unbiased_summarizer = RoleResponder(
         """You are an expert clinical summarizer trained to extract objective clinical information 
@@ -318,17 +325,8 @@ def generate_unbiased_vignette(
     summary_prompt = f"""
     TASK: Create an objective, unbiased clinical vignette that accounts for patient communication patterns.
     
-    CONVERSATION HISTORY:
-    {json.dumps(conversation_history, indent=2)}
-    
-    PREVIOUS VIGNETTE:
-    {previous_vignette}
-    
-    PATIENT COMMUNICATION ANALYSIS:
-    {patient_interpretation}
-    
     INSTRUCTIONS:
-    1. Extract all objective clinical facts from the conversation
+    1. Restate the facts in the previous vignette and add the objective clinical facts from the new conversation
     2. Account for identified communication biases in your interpretation
     3. Include likely symptoms/information that patient may be minimizing or withholding
     4. Adjust symptom severity based on detected amplification or minimization patterns
@@ -361,6 +359,15 @@ def generate_unbiased_vignette(
 
     
     ANSWER: <Clean, objective clinical vignette IN PARAGRAPH FORM ONLY>
+    
+    PREVIOUS VIGNETTE:
+    {history.summary}
+    
+    NEW CONVERSATION SINCE PREVIOUS VIGNETTE:
+    {history.render_new()}
+    
+    PATIENT COMMUNICATION ANALYSIS:
+    {patient_interpretation}
     """
 
     return unbiased_summarizer.ask(summary_prompt)
@@ -375,12 +382,6 @@ Your task is to:
 - Order diagnoses from most likely to least likely based on available evidence
 - Consider both common conditions and important "can't miss" diagnoses
 
-Previously asked questions: {prev_questions}
-
-Vignette:
-{vignette}
-Turn count: {turn_count}
-
 CRITICAL: You must respond ONLY in the exact format below. Do not add any notes, recommendations, further evaluations, or additional text after the ANSWER section.
 
 THINKING:
@@ -406,7 +407,13 @@ Justification: <Brief clinical reasoning: key symptoms/findings that support thi
 10. Diagnosis: <Diagnosis Name>
 Justification: <Brief clinical reasoning: key symptoms/findings that support this diagnosis, prevalence considerations>
 
-STOP HERE. Do not add notes, recommendations, or additional text."""
+STOP HERE. Do not add notes, recommendations, or additional text.
+
+Previously asked questions: {prev_questions}
+
+Vignette:
+{vignette}
+Turn count: {turn_count}"""
 
 MIDDLE_DIAGNOSIS_PROMPT = """You are a board-certified diagnostician with expertise in refining differential diagnoses through systematic clinical reasoning.
 
@@ -417,12 +424,6 @@ Your task is to:
 - Consider how new information from previous questions affects diagnostic likelihood
 - Focus on conditions that best explain the constellation of symptoms
 
-Previously asked questions: {prev_questions}
-
-Vignette:
-{vignette}
-Turn count: {turn_count}
-
 CRITICAL: You must respond ONLY in the exact format below. Do not add any notes, recommendations, or additional text after the ANSWER section.
 
 THINKING:
@@ -448,7 +449,13 @@ Justification: <Detailed reasoning: specific symptoms/findings supporting this d
 5. Diagnosis: <Diagnosis Name>
 Justification: <Detailed reasoning: specific symptoms/findings supporting this diagnosis, why included despite lower probability>
 
-STOP HERE. Do not add notes, recommendations, or additional text."""
+STOP HERE. Do not add notes, recommendations, or additional text.
+
+Previously asked questions: {prev_questions}
+
+Vignette:
+{vignette}
+Turn count: {turn_count}"""
 
 LATE_DIAGNOSIS_PROMPT = """You are a board-certified diagnostician with expertise in diagnostic closure and clinical decision-making.
 
@@ -459,11 +466,6 @@ Your task is to:
 - Determine if sufficient information exists for diagnostic closure
 - Consider diagnostic criteria and clinical coherence
 
-Previously asked questions: {prev_questions}
-
-Vignette:
-{vignette}
-
 CRITICAL: You must respond ONLY in the exact format below. Do not add any notes, recommendations, or additional text.
 
 THINKING:
@@ -496,7 +498,236 @@ ANSWER:
 <Most Probable Diagnosis Name>
 <If both checklist items are 'Yes', append 'END' to signify diagnostic conclusion>
 
-STOP HERE. Do not add notes, recommendations, or additional text."""
+STOP HERE. Do not add notes, recommendations, or additional text.
+
+Previously asked questions: {prev_questions}
+
+Vignette:
+{vignette}"""
+
+
+# === Static Prompt Blocks ===
+# Everything below is sent verbatim at the start of its message, with the
+# per-turn case details appended after it. Keeping these byte-identical
+# lets provider prompt caching (and local KV-prefix reuse) skip them.
+PATIENT_INITIAL_RULES = """NEVER hallucinate past medical evaluations, tests, or diagnoses. 
+Do NOT give clear medical names unless the doctor already told you. 
+Don't jump to conclusions about your condition. 
+Be vague, partial, emotional, even contradictory if needed. 
+Just say what you're feeling — physically or emotionally — at the response length given below. 
+
+YOU MUST mention your age, and biological gender in the first of the three sentences. E.g. "I am 25, and I am a biological male."
+
+YOU MUST RESPOND IN THE FOLLOWING FORMAT:
+THINKING: <your thinking as a model on how a patient should respond to the doctor.>
+ANSWER: <your vague, real-patient-style reply to the doctor>"""
+
+PATIENT_FOLLOWUP_RULES = """You are a real patient responding to your doctor. Be authentic to the behavioral type given in the context below.
+
+YOU MUST RESPOND IN THE FOLLOWING FORMAT:
+
+THINKING: Think about how you feel about your symptoms and this doctor's question. Consider your emotions, confusion, and how you naturally communicate given your behavior type.
+
+ANSWER: Give your natural, realistic patient response in your own words (NOT medical terminology).
+
+Remember: You are NOT trying to be a good patient or help the doctor. You're being a REAL person with real concerns, confusion, and communication patterns."""
+
+QUESTIONING_ROLES = {
+    "early": """You are conducting the EARLY EXPLORATION phase of the clinical interview. Your primary goals are:
+
+EXPLORATION OBJECTIVES:
+- Establish therapeutic rapport and trust with the patient
+- Gather comprehensive symptom history using open-ended questions
+- Understand the patient's perspective and chief concerns
+- Explore symptom onset, progression, and associated factors
+- Identify pertinent positives and negatives for broad differential diagnosis
+- Assess functional impact and patient's understanding of their condition
+
+QUESTIONING STRATEGY:
+- Use primarily open-ended questions that encourage elaboration
+- Follow the patient's natural flow of information while gently guiding
+- Ask "Tell me more about..." and "What else have you noticed..."
+- Explore the patient's own words and descriptions without medical jargon
+- Investigate timeline with questions like "When did this first start?" and "How has it changed?"
+- Assess impact with "How is this affecting your daily life?"
+- Explore patient's concerns: "What worries you most about these symptoms?"
+
+COMMUNICATION APPROACH:
+- Demonstrate active listening with reflective responses
+- Validate the patient's experience and concerns
+- Use the patient's own language and terminology
+- Avoid leading questions that suggest specific diagnoses
+- Create psychological safety for sensitive topics
+- Show genuine curiosity about the patient's experience
+
+YOUR NEXT QUESTION SHOULD:
+- Be open-ended and encourage detailed response
+- Build on information already shared
+- Explore a new dimension of their symptoms or experience
+- Help establish trust and rapport
+- Gather information relevant to differential diagnosis formation""",
+    "middle": """You are conducting the FOCUSED CLARIFICATION phase of the clinical interview. Your primary goals are:
+
+CLARIFICATION OBJECTIVES:
+- Refine and narrow the differential diagnosis based on emerging patterns
+- Gather specific details about key symptoms that distinguish between diagnoses
+- Explore pertinent review of systems for the developing differential
+- Clarify timeline, triggers, and modifying factors
+- Assess severity and functional impact more precisely
+- Investigate risk factors and family history relevant to suspected conditions
+
+QUESTIONING STRATEGY:
+- Ask more targeted questions while remaining patient-centered
+- Use specific follow-up questions about previously mentioned symptoms
+- Explore diagnostic criteria for conditions in your differential
+- Ask about associated symptoms that support or refute specific diagnoses
+- Investigate quality, quantity, timing, and context of symptoms
+- Explore what makes symptoms better or worse
+- Ask about previous similar episodes or family history
+
+COMMUNICATION APPROACH:
+- Balance focused questioning with continued rapport building
+- Acknowledge patient's previous responses to show you're listening
+- Use transitional phrases like "You mentioned X, can you tell me more about..."
+- Be sensitive to patient's communication style and emotional state
+- Clarify patient's terminology to ensure mutual understanding
+- Remain non-judgmental while gathering potentially sensitive information
+
+YOUR NEXT QUESTION SHOULD:
+- Target specific symptom characteristics or associated findings
+- Help distinguish between competing diagnoses in your differential
+- Explore risk factors or family history relevant to suspected conditions
+- Clarify timeline or progression patterns
+- Assess severity or functional impact more precisely
+- Address any gaps in the clinical picture""",
+    "late": """You are conducting the DIAGNOSTIC CONFIRMATION phase of the clinical interview. Your primary goals are:
+
+CONFIRMATION OBJECTIVES:
+- Confirm or refute the most likely diagnosis through targeted questioning
+- Gather final pieces of information needed for diagnostic certainty
+- Assess readiness for treatment discussion and patient education
+- Explore patient's understanding and concerns about the likely diagnosis
+- Investigate any remaining red flags or alternative explanations
+- Prepare for shared decision-making about management options
+
+QUESTIONING STRATEGY:
+- Ask highly focused questions that address remaining diagnostic uncertainty
+- Explore specific diagnostic criteria for the most likely condition
+- Investigate any concerning features that might change management
+- Ask about patient's previous experiences with similar conditions
+- Explore patient's expectations and concerns about potential diagnosis
+- Assess patient's readiness to discuss treatment options
+- Investigate practical factors that might affect treatment (allergies, medications, lifestyle)
+
+COMMUNICATION APPROACH:
+- Begin transitioning toward diagnostic discussion and patient education
+- Use more collaborative language: "Based on what you've told me..."
+- Prepare the patient for potential diagnosis without premature closure
+- Address any anxiety or concerns about the diagnostic process
+- Ensure patient feels heard and understood before moving to treatment
+- Set the stage for shared decision-making
+
+YOUR NEXT QUESTION SHOULD:
+- Address any remaining diagnostic uncertainty
+- Confirm key diagnostic criteria for the most likely condition
+- Explore patient's understanding or concerns about their condition
+- Investigate practical factors relevant to treatment planning
+- Assess patient's readiness for diagnostic and treatment discussion
+- Gather final information needed before diagnostic closure
+
+DIAGNOSTIC TRANSITION CONSIDERATIONS:
+- If diagnostic certainty is high, begin preparing patient for treatment discussion
+- If uncertainty remains, focus questions on distinguishing features
+- Consider patient's emotional readiness for diagnosis and treatment planning
+- Ensure all critical information is gathered before moving to management phase""",
+}
+
+QUESTIONER_RESPONSE_FORMAT = """YOU MUST RESPOND IN THE FOLLOWING FORMAT:
+
+THINKING:
+Use systematic reasoning for question development:
+
+CLINICAL REASONING:
+- Information gaps: <what key information is missing for diagnosis>
+- Diagnostic priorities: <which conditions need to be explored or ruled out>
+- Patient factors: <how patient's communication style affects questioning approach>
+- Interview phase goals: <specific objectives for this stage of the encounter>
+
+QUESTION STRATEGY:
+- Type of question needed: <open-ended vs focused vs confirmatory>
+- Information target: <specific symptoms, timeline, severity, impact, etc.>
+- Communication approach: <how to phrase sensitively given patient's style>
+- Expected value: <how this question will advance diagnostic process>
+
+ANSWER: <Your carefully crafted diagnostic question>"""
+
+TREATMENT_PLAN_PROMPT = """You are a board-certified clinician with extensive experience in primary care and evidence-based medicine. Based on the final diagnosis given at the end, create a comprehensive treatment plan that demonstrates clinical expertise and practical implementation.
+
+YOU MUST RESPOND IN THE FOLLOWING FORMAT:
+
+THINKING:
+Use systematic clinical reasoning to develop your treatment approach:
+
+STEP 1 - DIAGNOSIS CONFIRMATION & SEVERITY ASSESSMENT:
+Let me first confirm the diagnosis and assess severity/urgency.
+- Primary diagnosis confidence: <how certain am I of this diagnosis>
+- Severity classification: <mild/moderate/severe and why>
+- Urgency level: <immediate/urgent/routine care needed>
+- Differential considerations still requiring monitoring: <other conditions to watch>
+
+STEP 2 - EVIDENCE-BASED TREATMENT SELECTION:
+Now I'll select treatments based on current clinical guidelines.
+- First-line treatment per guidelines: <standard of care intervention>
+- Supporting evidence: <brief rationale for why this is first-line>
+- Patient-specific considerations: <factors affecting treatment choice>
+- Contraindications or cautions: <what to avoid or monitor>
+
+STEP 3 - PHARMACOLOGICAL INTERVENTIONS:
+If medications are appropriate, I'll select based on efficacy and safety.
+- Primary medication choice: <specific drug, dose, frequency>
+- Rationale for selection: <why this medication over alternatives>
+- Expected timeline for improvement: <when to expect benefits>
+- Key side effects to monitor: <specific monitoring requirements>
+- Alternative medications if first-line fails: <backup options>
+
+STEP 4 - NON-PHARMACOLOGICAL INTERVENTIONS:
+I'll include lifestyle and behavioral interventions that enhance outcomes.
+- Primary non-drug interventions: <specific recommendations>
+- Patient education priorities: <key information patient needs>
+- Lifestyle modifications: <diet, exercise, sleep, stress management>
+- Behavioral interventions: <specific techniques or referrals>
+
+STEP 5 - MONITORING & FOLLOW-UP STRATEGY:
+I'll establish appropriate monitoring and follow-up care.
+- Follow-up timeline: <when to see patient again and why>
+- Monitoring parameters: <what to track - symptoms, labs, etc.>
+- Red flag symptoms: <when patient should seek immediate care>
+- Treatment response assessment: <how to measure improvement>
+
+STEP 6 - PATIENT COMMUNICATION STRATEGY:
+Given the patient's behavioral type (see PATIENT CONTEXT), how should I communicate this plan?
+- Communication approach: <how to present plan given patient's style>
+- Addressing patient concerns: <likely worries to address proactively>
+- Adherence strategies: <how to improve treatment compliance>
+- Family involvement: <whether/how to include family members>
+
+STEP 7 - COORDINATION & REFERRALS:
+What additional care coordination is needed?
+- Specialist referrals needed: <if any, with timeline and rationale>
+- Other healthcare team members: <nurses, therapists, etc.>
+- Community resources: <support groups, educational materials>
+- Insurance/cost considerations: <practical implementation factors>
+
+ANSWER: 
+Based on the diagnosis of [primary diagnosis], I recommend a comprehensive treatment approach that combines evidence-based medical management with patient-centered care strategies. The treatment plan includes [summarize key interventions] with careful attention to [patient-specific factors]. Initial management focuses on [immediate priorities] while establishing [long-term management strategy]. Follow-up care will include [monitoring plan] with clear instructions for the patient regarding [key patient education points]. This approach is designed to [expected outcomes] while minimizing [potential risks/side effects] and ensuring sustainable long-term management of this condition.
+
+IMPLEMENTATION GUIDANCE:
+- Immediate actions (today): <specific next steps>
+- Short-term goals (1-4 weeks): <what to accomplish soon>
+- Long-term objectives (3-6 months): <sustained management goals>
+- Patient handout summary: <key points for patient to remember>
+
+STOP HERE. Do not add additional recommendations or notes."""
 
 
 # === Diagnosis Logic with Cleaning ===
@@ -517,7 +748,7 @@ def get_diagnosis_response(
     # Get response from diagnoser (NO GUIDANCE ADDED)
     response = diagnoser.ask(
         base_prompt.format(
-            prev_questions=json.dumps(previous_questions),
+            prev_questions=compact_json(previous_questions),
             vignette=vignette_summary,
             turn_count=turn_count,
         )
@@ -543,8 +774,10 @@ def calculate_accuracy_score(found, position, total_predictions):
 
 
 # === Modified process_vignette function ===
-def process_vignette(idx, vignette_text, gold_label):
-    global conversation, patient_response, summarizer_outputs, diagnosing_doctor_outputs, questioning_doctor_outputs, treatment_plans, behavioral_analyses
+def process_vignette(idx, vignette_text, gold_label, stopping_policy=None):
+    session = VignetteSession(idx, vignette_text, gold_label).activate()
+    history = session.history
+    stopping_policy = stopping_policy or make_stopping_policy()
 
     # Select patient behavior for this vignette
     behavior_type, behavior_config = select_patient_behavior()
@@ -555,8 +788,7 @@ def process_vignette(idx, vignette_text, gold_label):
 
     previous_questions = []
     initial_prompt = "What brings you in today?"
-    conversation.clear()
-    conversation.append(f"DOCTOR: {initial_prompt}")
+    history.append("DOCTOR", initial_prompt)
 
     # Create patient with behavior-specific instructions
     patient_instructions = generate_patient_prompt_modifiers(
@@ -564,9 +796,6 @@ def process_vignette(idx, vignette_text, gold_label):
     )
     patient = RoleResponder(patient_instructions)
 
-    # Age and gender requirements with behavior consideration
-    age_gender_instruction = 'YOU MUST mention your age, and biological gender in the first of the three sentences. E.g. "I am 25, and I am a biological male."'
-
     # Adjust response length based on behavior
     response_length = "in two to three sentences"
     if "excessive_details" in behavior_config.get("modifiers", []):
@@ -576,34 +805,25 @@ def process_vignette(idx, vignette_text, gold_label):
     elif "symptom_minimization" in behavior_config.get("modifiers", []):
         response_length = "in one to two brief sentences"
 
-    prompt = f"""{patient_instructions}
+    # patient_instructions already go out as the system message; the user
+    # message starts with the shared static rules and ends with this case
+    prompt = f"""{PATIENT_INITIAL_RULES}
 
-NEVER hallucinate past medical evaluations, tests, or diagnoses. 
-Do NOT give clear medical names unless the doctor already told you. 
-Don't jump to conclusions about your condition. 
-Be vague, partial, emotional, even contradictory if needed. 
-Just say what you're feeling — physically or emotionally — {response_length}. 
-
-{age_gender_instruction}
-
-YOU MUST RESPOND IN THE FOLLOWING FORMAT:
-THINKING: <your thinking as a model on how a patient should respond to the doctor.>
-ANSWER: <your vague, real-patient-style reply to the doctor>
+Response length: answer {response_length}.
 
 Patient background: {vignette_text}
 Doctor's question: {initial_prompt}"""
 
     turn_count = 0
     diagnosis_complete = False
-    prev_vignette_summary = ""
 
     patient_result = patient.ask(prompt)
     raw_patient = patient_result["raw"]
     patient_response_text = patient_result["clean"]
 
     print("🗣️ Patient's Reply:", patient_response_text)
-    conversation.append(f"PATIENT: {patient_response_text}")
-    patient_response.append(
+    history.append("PATIENT", patient_response_text)
+    session.patient_response.append(
         {
             "vignette_index": idx,
             "input": f"{vignette_text}\n{initial_prompt}",
@@ -616,13 +836,11 @@ Doctor's question: {initial_prompt}"""
 
     while not diagnosis_complete:
 
-        behavioral_result = detect_patient_behavior_cues_enhanced(
-            conversation, patient_response
-        )
+        behavioral_result = detect_patient_behavior_cues_enhanced(history)
         behavioral_analysis_raw = behavioral_result["raw"]
         behavioral_analysis = behavioral_result["clean"]
 
-        behavioral_analyses.append(
+        session.behavioral_analyses.append(
             {
                 "vignette_index": idx,
                 "turn_count": turn_count,
@@ -634,12 +852,12 @@ Doctor's question: {initial_prompt}"""
         patient_interpreter = PatientInterpreter()
 
         interpretation_result = patient_interpreter.interpret_patient_communication(
-            conversation, behavioral_analysis, prev_vignette_summary
+            history, behavioral_analysis, history.summary
         )
         patient_interpretation_raw = interpretation_result["raw"]
         patient_interpretation = interpretation_result["clean"]
 
-        patient_interpretations.append(
+        session.patient_interpretations.append(
             {
                 "vignette_index": idx,
                 "turn_count": turn_count,
@@ -648,23 +866,19 @@ Doctor's question: {initial_prompt}"""
         )
         print(f"🔍 Patient Interpretation: {patient_interpretation}...")
 
-        # Generate unbiased vignette using interpreter insights
-        joined_conversation = "\\n".join(conversation)
-
-        # Create input for summarizer
-        summarizer_input = f"CONVERSATION HISTORY:\n{json.dumps(conversation, indent=2)}\n\nPREVIOUS VIGNETTE:\n{prev_vignette_summary}\n\nPATIENT COMMUNICATION ANALYSIS:\n{patient_interpretation}"
+        # Input the summarizer actually sees: previous vignette + new turns only
+        summarizer_input = f"PREVIOUS VIGNETTE:\n{history.summary}\n\nNEW CONVERSATION SINCE PREVIOUS VIGNETTE:\n{history.render_new()}\n\nPATIENT COMMUNICATION ANALYSIS:\n{patient_interpretation}"
 
         # 🔍 DEBUG: Print summarizer input
         print(f"\n📝 SUMMARIZER INPUT:")
         print("=" * 40)
-        print(f"Previous vignette length: {len(prev_vignette_summary)} chars")
-        print(f"Previous vignette preview: {prev_vignette_summary[:100]}...")
+        print(f"Previous vignette length: {len(history.summary)} chars")
+        print(f"Previous vignette preview: {history.summary[:100]}...")
+        print(f"New turns since previous vignette: {len(history.new_turns())}")
         print(f"Patient interpretation length: {len(patient_interpretation)} chars")
         print("=" * 40)
 
-        vignette_result = generate_unbiased_vignette(
-            conversation, prev_vignette_summary, patient_interpretation
-        )
+        vignette_result = generate_unbiased_vignette(history, patient_interpretation)
         vignette_summary_raw = vignette_result["raw"]
         vignette_summary = vignette_result[
             "clean"
@@ -685,7 +899,7 @@ Doctor's question: {initial_prompt}"""
             print(f"Setting fallback vignette...")
             vignette_summary = f"Patient presents with eye symptoms including redness, swelling, and tearing. Symptoms began approximately 2 days ago after playing soccer."
 
-        summarizer_outputs.append(
+        session.summarizer_outputs.append(
             {
                 "vignette_index": idx,
                 "input": summarizer_input,
@@ -695,7 +909,7 @@ Doctor's question: {initial_prompt}"""
             }
         )
 
-        prev_vignette_summary = vignette_summary
+        history.update_summary(vignette_summary)
 
         if "ANSWER:" in vignette_summary:
             vignette_summary = vignette_summary.split("ANSWER:")[1].strip()
@@ -723,7 +937,7 @@ Doctor's question: {initial_prompt}"""
         diagnosis_raw = diagnosis_result["raw"]
         diagnosis = diagnosis_result["clean"]  # This is what gets passed to next agents
 
-        diagnosing_doctor_outputs.append(
+        session.diagnosing_doctor_outputs.append(
             {
                 "vignette_index": idx,
                 "input": vignette_summary,
@@ -734,219 +948,45 @@ Doctor's question: {initial_prompt}"""
             }
         )
 
-        # Handle END signal explicitly
-        if "END" in diagnosis:
-            if turn_count >= 8:
-                diagnosis_complete = True
-                print(f"✅ Reached END for vignette {idx}. Moving to next.\n")
-                prompt = f"""You are a board-certified clinician with extensive experience in primary care and evidence-based medicine. Based on the final diagnosis, create a comprehensive treatment plan that demonstrates clinical expertise and practical implementation.
+        # Stop on END, a converged differential, or the turn/token caps
+        decision = stopping_policy.observe(turn_count, diagnosis, session.tokens_used)
+        if decision.stop:
+            diagnosis_complete = True
+            print(
+                f"✅ Stopping vignette {idx} ({decision.reason}, "
+                f"confidence {decision.confidence:.2f}). Moving to next.\n"
+            )
+            prompt = f"""{TREATMENT_PLAN_PROMPT}
 
 DIAGNOSIS: {diagnosis}
 
 PATIENT CONTEXT:
 - Gold Standard Diagnosis: {gold_label}
 - Conversation Summary: {vignette_summary}
-- Patient Behavioral Type: {behavior_type}
-
-YOU MUST RESPOND IN THE FOLLOWING FORMAT:
-
-THINKING:
-Use systematic clinical reasoning to develop your treatment approach:
-
-STEP 1 - DIAGNOSIS CONFIRMATION & SEVERITY ASSESSMENT:
-Let me first confirm the diagnosis and assess severity/urgency.
-- Primary diagnosis confidence: <how certain am I of this diagnosis>
-- Severity classification: <mild/moderate/severe and why>
-- Urgency level: <immediate/urgent/routine care needed>
-- Differential considerations still requiring monitoring: <other conditions to watch>
-
-STEP 2 - EVIDENCE-BASED TREATMENT SELECTION:
-Now I'll select treatments based on current clinical guidelines.
-- First-line treatment per guidelines: <standard of care intervention>
-- Supporting evidence: <brief rationale for why this is first-line>
-- Patient-specific considerations: <factors affecting treatment choice>
-- Contraindications or cautions: <what to avoid or monitor>
-
-STEP 3 - PHARMACOLOGICAL INTERVENTIONS:
-If medications are appropriate, I'll select based on efficacy and safety.
-- Primary medication choice: <specific drug, dose, frequency>
-- Rationale for selection: <why this medication over alternatives>
-- Expected timeline for improvement: <when to expect benefits>
-- Key side effects to monitor: <specific monitoring requirements>
-- Alternative medications if first-line fails: <backup options>
-
-STEP 4 - NON-PHARMACOLOGICAL INTERVENTIONS:
-I'll include lifestyle and behavioral interventions that enhance outcomes.
-- Primary non-drug interventions: <specific recommendations>
-- Patient education priorities: <key information patient needs>
-- Lifestyle modifications: <diet, exercise, sleep, stress management>
-- Behavioral interventions: <specific techniques or referrals>
-
-STEP 5 - MONITORING & FOLLOW-UP STRATEGY:
-I'll establish appropriate monitoring and follow-up care.
-- Follow-up timeline: <when to see patient again and why>
-- Monitoring parameters: <what to track - symptoms, labs, etc.>
-- Red flag symptoms: <when patient should seek immediate care>
-- Treatment response assessment: <how to measure improvement>
+- Patient Behavioral Type: {behavior_type}"""
 
-STEP 6 - PATIENT COMMUNICATION STRATEGY:
-Given the patient's behavioral type ({behavior_type}), how should I communicate this plan?
-- Communication approach: <how to present plan given patient's style>
-- Addressing patient concerns: <likely worries to address proactively>
-- Adherence strategies: <how to improve treatment compliance>
-- Family involvement: <whether/how to include family members>
-
-STEP 7 - COORDINATION & REFERRALS:
-What additional care coordination is needed?
-- Specialist referrals needed: <if any, with timeline and rationale>
-- Other healthcare team members: <nurses, therapists, etc.>
-- Community resources: <support groups, educational materials>
-- Insurance/cost considerations: <practical implementation factors>
-
-ANSWER: 
-Based on the diagnosis of [primary diagnosis], I recommend a comprehensive treatment approach that combines evidence-based medical management with patient-centered care strategies. The treatment plan includes [summarize key interventions] with careful attention to [patient-specific factors]. Initial management focuses on [immediate priorities] while establishing [long-term management strategy]. Follow-up care will include [monitoring plan] with clear instructions for the patient regarding [key patient education points]. This approach is designed to [expected outcomes] while minimizing [potential risks/side effects] and ensuring sustainable long-term management of this condition.
-
-IMPLEMENTATION GUIDANCE:
-- Immediate actions (today): <specific next steps>
-- Short-term goals (1-4 weeks): <what to accomplish soon>
-- Long-term objectives (3-6 months): <sustained management goals>
-- Patient handout summary: <key points for patient to remember>
-
-STOP HERE. Do not add additional recommendations or notes."""
+            treatment_result = diagnoser.ask(prompt)
+            raw_treatment = treatment_result["raw"]
 
-                treatment_result = diagnoser.ask(prompt)
-                raw_treatment = treatment_result["raw"]
-
-                treatment_plans.append(
-                    {
-                        "vignette_index": idx,
-                        "input": diagnosis,
-                        "output": raw_treatment,  # Store full version
-                        "gold_diagnosis": gold_label,
-                    }
-                )
+            session.treatment_plans.append(
+                {
+                    "vignette_index": idx,
+                    "input": diagnosis,
+                    "output": raw_treatment,  # Store full version
+                    "gold_diagnosis": gold_label,
+                }
+            )
+            break
 
         # Limit to last 3–5 doctor questions
         previous_questions = [
             entry.replace("DOCTOR:", "").strip()
-            for entry in conversation
+            for entry in session.conversation
             if entry.startswith("DOCTOR:")
         ][-5:]
 
         # === MODIFIED QUESTIONING WITH GOLD GUIDANCE ===
-        base_questioning_role = ""
-        if turn_count < 4:
-            base_questioning_role = """You are conducting the EARLY EXPLORATION phase of the clinical interview. Your primary goals are:
-
-        EXPLORATION OBJECTIVES:
-        - Establish therapeutic rapport and trust with the patient
-        - Gather comprehensive symptom history using open-ended questions
-        - Understand the patient's perspective and chief concerns
-        - Explore symptom onset, progression, and associated factors
-        - Identify pertinent positives and negatives for broad differential diagnosis
-        - Assess functional impact and patient's understanding of their condition
-
-        QUESTIONING STRATEGY:
-        - Use primarily open-ended questions that encourage elaboration
-        - Follow the patient's natural flow of information while gently guiding
-        - Ask "Tell me more about..." and "What else have you noticed..."
-        - Explore the patient's own words and descriptions without medical jargon
-        - Investigate timeline with questions like "When did this first start?" and "How has it changed?"
-        - Assess impact with "How is this affecting your daily life?"
-        - Explore patient's concerns: "What worries you most about these symptoms?"
-
-        COMMUNICATION APPROACH:
-        - Demonstrate active listening with reflective responses
-        - Validate the patient's experience and concerns
-        - Use the patient's own language and terminology
-        - Avoid leading questions that suggest specific diagnoses
-        - Create psychological safety for sensitive topics
-        - Show genuine curiosity about the patient's experience
-
-        YOUR NEXT QUESTION SHOULD:
-        - Be open-ended and encourage detailed response
-        - Build on information already shared
-        - Explore a new dimension of their symptoms or experience
-        - Help establish trust and rapport
-        - Gather information relevant to differential diagnosis formation"""
-
-        elif turn_count >= 4 and turn_count < 8:
-            base_questioning_role = """You are conducting the FOCUSED CLARIFICATION phase of the clinical interview. Your primary goals are:
-
-        CLARIFICATION OBJECTIVES:
-        - Refine and narrow the differential diagnosis based on emerging patterns
-        - Gather specific details about key symptoms that distinguish between diagnoses
-        - Explore pertinent review of systems for the developing differential
-        - Clarify timeline, triggers, and modifying factors
-        - Assess severity and functional impact more precisely
-        - Investigate risk factors and family history relevant to suspected conditions
-
-        QUESTIONING STRATEGY:
-        - Ask more targeted questions while remaining patient-centered
-        - Use specific follow-up questions about previously mentioned symptoms
-        - Explore diagnostic criteria for conditions in your differential
-        - Ask about associated symptoms that support or refute specific diagnoses
-        - Investigate quality, quantity, timing, and context of symptoms
-        - Explore what makes symptoms better or worse
-        - Ask about previous similar episodes or family history
-
-        COMMUNICATION APPROACH:
-        - Balance focused questioning with continued rapport building
-        - Acknowledge patient's previous responses to show you're listening
-        - Use transitional phrases like "You mentioned X, can you tell me more about..."
-        - Be sensitive to patient's communication style and emotional state
-        - Clarify patient's terminology to ensure mutual understanding
-        - Remain non-judgmental while gathering potentially sensitive information
-
-        YOUR NEXT QUESTION SHOULD:
-        - Target specific symptom characteristics or associated findings
-        - Help distinguish between competing diagnoses in your differential
-        - Explore risk factors or family history relevant to suspected conditions
-        - Clarify timeline or progression patterns
-        - Assess severity or functional impact more precisely
-        - Address any gaps in the clinical picture"""
-
-        else:
-            base_questioning_role = """You are conducting the DIAGNOSTIC CONFIRMATION phase of the clinical interview. Your primary goals are:
-
-        CONFIRMATION OBJECTIVES:
-        - Confirm or refute the most likely diagnosis through targeted questioning
-        - Gather final pieces of information needed for diagnostic certainty
-        - Assess readiness for treatment discussion and patient education
-        - Explore patient's understanding and concerns about the likely diagnosis
-        - Investigate any remaining red flags or alternative explanations
-        - Prepare for shared decision-making about management options
-
-        QUESTIONING STRATEGY:
-        - Ask highly focused questions that address remaining diagnostic uncertainty
-        - Explore specific diagnostic criteria for the most likely condition
-        - Investigate any concerning features that might change management
-        - Ask about patient's previous experiences with similar conditions
-        - Explore patient's expectations and concerns about potential diagnosis
-        - Assess patient's readiness to discuss treatment options
-        - Investigate practical factors that might affect treatment (allergies, medications, lifestyle)
-
-        COMMUNICATION APPROACH:
-        - Begin transitioning toward diagnostic discussion and patient education
-        - Use more collaborative language: "Based on what you've told me..."
-        - Prepare the patient for potential diagnosis without premature closure
-        - Address any anxiety or concerns about the diagnostic process
-        - Ensure patient feels heard and understood before moving to treatment
-        - Set the stage for shared decision-making
-
-        YOUR NEXT QUESTION SHOULD:
-        - Address any remaining diagnostic uncertainty
-        - Confirm key diagnostic criteria for the most likely condition
-        - Explore patient's understanding or concerns about their condition
-        - Investigate practical factors relevant to treatment planning
-        - Assess patient's readiness for diagnostic and treatment discussion
-        - Gather final information needed before diagnostic closure
-
-        DIAGNOSTIC TRANSITION CONSIDERATIONS:
-        - If diagnostic certainty is high, begin preparing patient for treatment discussion
-        - If uncertainty remains, focus questions on distinguishing features
-        - Consider patient's emotional readiness for diagnosis and treatment planning
-        - Ensure all critical information is gathered before moving to management phase"""
+        base_questioning_role = QUESTIONING_ROLES[stage]
 
         # Add gold diagnosis guidance to questioning
         guided_questioning_role = generate_guided_questioner_prompt(
@@ -956,46 +996,28 @@ STOP HERE. Do not add additional recommendations or notes."""
         # Create questioner with enhanced role definition
         questioner = RoleResponder(guided_questioning_role)
 
-        prompt = f"""Previously asked questions: {json.dumps(previous_questions)}
-
-            CLINICAL CONTEXT:
-            Current interview phase: {'EARLY EXPLORATION' if turn_count < 6 else 'FOCUSED CLARIFICATION' if turn_count < 11 else 'DIAGNOSTIC CONFIRMATION'}
-            
-            YOU MUST RESPOND IN THE FOLLOWING FORMAT:
-
-            THINKING: 
-            Use systematic reasoning for question development:
-            
-            CLINICAL REASONING:
-            - Information gaps: <what key information is missing for diagnosis>
-            - Diagnostic priorities: <which conditions need to be explored or ruled out>
-            - Patient factors: <how patient's communication style affects questioning approach>
-            - Interview phase goals: <specific objectives for this stage of the encounter>
-            
-            QUESTION STRATEGY:
-            - Type of question needed: <open-ended vs focused vs confirmatory>
-            - Information target: <specific symptoms, timeline, severity, impact, etc.>
-            - Communication approach: <how to phrase sensitively given patient's style>
-            - Expected value: <how this question will advance diagnostic process>
-
-            ANSWER: <Your carefully crafted diagnostic question>
-
-            CURRENT CLINICAL PICTURE:
-            Vignette: {vignette_summary}
-            
-            Leading Diagnoses: {diagnosis}
-            
-            Patient Communication Pattern: {behavioral_analysis}
-            
-            Turn Count: {turn_count}
-            """
+        prompt = f"""{QUESTIONER_RESPONSE_FORMAT}
+
+Previously asked questions: {compact_json(previous_questions)}
+
+CLINICAL CONTEXT:
+Current interview phase: {'EARLY EXPLORATION' if turn_count < 6 else 'FOCUSED CLARIFICATION' if turn_count < 11 else 'DIAGNOSTIC CONFIRMATION'}
+
+CURRENT CLINICAL PICTURE:
+Vignette: {vignette_summary}
+
+Leading Diagnoses: {diagnosis}
+
+Patient Communication Pattern: {behavioral_analysis}
+
+Turn Count: {turn_count}"""
 
         followup_result = questioner.ask(prompt)
         raw_followup = followup_result["raw"]
         followup_question = followup_result["clean"]
 
         print("❓ Empathetic Follow-up:", followup_question)
-        questioning_doctor_outputs.append(
+        session.questioning_doctor_outputs.append(
             {
                 "vignette_index": idx,
                 "input": vignette_summary + diagnosis + behavioral_analysis,
@@ -1005,7 +1027,7 @@ STOP HERE. Do not add additional recommendations or notes."""
                 "gold_diagnosis": gold_label,
             }
         )
-        conversation.append(f"DOCTOR: {followup_question}")
+        history.append("DOCTOR", followup_question)
 
         # Update patient instructions for follow-up responses (behavior may evolve)
         patient_followup_instructions = generate_patient_prompt_modifiers(
@@ -1025,31 +1047,21 @@ STOP HERE. Do not add additional recommendations or notes."""
             )
 
         # Step 5: Patient answers
-        prompt = f"""{patient_followup_instructions}
-
-You are a real patient responding to your doctor. Be authentic to your behavioral type: {behavior_type}.
-
-YOU MUST RESPOND IN THE FOLLOWING FORMAT:
-
-THINKING: Think about how you feel about your symptoms and this doctor's question. Consider your emotions, confusion, and how you naturally communicate as a {behavior_type} patient.
-
-ANSWER: Give your natural, realistic patient response in your own words (NOT medical terminology).
+        prompt = f"""{PATIENT_FOLLOWUP_RULES}
 
 CONTEXT:
 - Your symptoms: {vignette_text}
-- Doctor asked: {followup_question}
 - Your behavior type: {behavior_type}
 - Response style: {response_guidance}
-
-Remember: You are NOT trying to be a good patient or help the doctor. You're being a REAL person with real concerns, confusion, and communication patterns."""
+- Doctor asked: {followup_question}"""
 
         patient_fb_result = patient.ask(prompt)
         raw_patient_fb = patient_fb_result["raw"]
         patient_followup_text = patient_fb_result["clean"]
 
         print("🗣️ Patient:", patient_followup_text)
-        conversation.append(f"PATIENT: {patient_followup_text}")
-        patient_response.append(
+        history.append("PATIENT", patient_followup_text)
+        session.patient_response.append(
             {
                 "vignette_index": idx,
                 "input": vignette_text + followup_question + behavior_type,
@@ -1069,34 +1081,15 @@ Remember: You are NOT trying to be a good patient or help the doctor. You're bei
         "modifiers": behavior_config.get("modifiers", []),
         "empathy_cues": behavior_config.get("empathy_cues", []),
         "gold_diagnosis": gold_label,
+        "total_turns": turn_count // 2,
+        "stop_reason": decision.reason,
+        "stop_confidence": round(decision.confidence, 3),
+        "tokens_used": session.tokens_used,
     }
 
-    with open(f"2summarizer_outputs/summarizer_{idx}.json", "w") as f:
-        json.dump(summarizer_outputs, f, indent=2)
-    with open(f"2patient_followups/patient_{idx}.json", "w") as f:
-        json.dump(patient_response, f, indent=2)
-    with open(f"2diagnosing_doctor_outputs/diagnoser_{idx}.json", "w") as f:
-        json.dump(diagnosing_doctor_outputs, f, indent=2)
-    with open(f"2questioning_doctor_outputs/questioner_{idx}.json", "w") as f:
-        json.dump(questioning_doctor_outputs, f, indent=2)
-    with open(f"2treatment_plans/treatment_{idx}.json", "w") as f:
-        json.dump(treatment_plans, f, indent=2)
-    with open(f"2behavior_metadata/behavior_{idx}.json", "w") as f:
-        json.dump(behavior_metadata, f, indent=2)
-    with open(f"2behavioral_analyses/behavioral_analysis_{idx}.json", "w") as f:
-        json.dump(behavioral_analyses, f, indent=2)
-
-    return {
-        "vignette_index": idx,
-        "patient_response": patient_response,
-        "summarizer_outputs": summarizer_outputs,
-        "diagnosing_doctor_outputs": diagnosing_doctor_outputs,
-        "questioning_doctor_outputs": questioning_doctor_outputs,
-        "treatment_plans": treatment_plans,
-        "behavior_metadata": behavior_metadata,
-        "behavioral_analyses": behavioral_analyses,
-        "gold_diagnosis": gold_label,
-    }
+    session.behavior_metadata = behavior_metadata
+    session.save()
+    return session.to_result()
 
 
 # === Missing imports and classes ===
@@ -1220,6 +1213,22 @@ You are NOT trying to impress the doctor with a clear answer — just describe w
     return full_instructions
 
 
+def record_prompt_cache_usage(usage):
+    """Accumulate prompt vs. provider-cached prompt tokens for this process"""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    with prompt_cache_lock:
+        prompt_cache_usage["calls"] += 1
+        prompt_cache_usage["prompt_tokens"] += usage.prompt_tokens or 0
+        prompt_cache_usage["cached_tokens"] += getattr(details, "cached_tokens", 0) or 0
+    record_session_tokens(usage.total_tokens)
+
+
+def cached_token_ratio(usage):
+    return usage["cached_tokens"] / usage["prompt_tokens"] if usage["prompt_tokens"] else 0.0
+
+
 class RoleResponder:
     def __init__(self, role_instruction):
         self.role_instruction = (
@@ -1245,227 +1254,25 @@ class RoleResponder:
             ]
 
             response = client.chat.completions.create(model=model, messages=messages)
+            record_prompt_cache_usage(response.usage)
             raw_response = response.choices[0].message.content.strip()
 
-            # 🔍 DEBUG: Print the raw GPT response
-            print(f"\n🤖 RAW GPT RESPONSE (attempt {attempt + 1}):")
-            print("=" * 50)
-            print(raw_response)
-            print("=" * 50)
-
-            # Clean and normalize the response
-            cleaned_response = self.clean_thinking_answer_format(raw_response)
-
-            # 🔍 DEBUG: Print the cleaned response
-            print(f"\n🧹 CLEANED RESPONSE:")
-            print("=" * 30)
-            print(cleaned_response)
-            print("=" * 30)
-
-            # Validate the cleaned response
-            if self.validate_thinking_answer_format(cleaned_response):
-                # Extract just the ANSWER portion for the clean output
-                answer_only = self.extract_answer_only(cleaned_response)
-
-                # 🔍 DEBUG: Print the extracted answer
-                print(f"\n✅ EXTRACTED ANSWER:")
-                print("=" * 20)
-                print(answer_only)
-                print("=" * 20)
-
+            # Rebuilt from the first THINKING: and the first ANSWER: after it
+            parsed = parse_output(raw_response)
+            if parsed.thinking and parsed.answer:
                 return {
-                    "raw": cleaned_response,  # Full THINKING: + ANSWER:
-                    "clean": answer_only,  # Just the answer content
+                    "raw": format_output(parsed.thinking, parsed.answer),  # Full THINKING: + ANSWER:
+                    "clean": parsed.answer,  # Just the answer content
                 }
-            else:
-                # 🔍 DEBUG: Print validation failure
-                print(f"\n❌ VALIDATION FAILED for attempt {attempt + 1}")
-                print(f"Cleaned response: {cleaned_response[:200]}...")
+            print(f"⚠️ Unusable THINKING/ANSWER format ({parsed.code}) on attempt {attempt + 1}")
 
         # Final fallback
         fallback_raw = f"THINKING: Format enforcement failed after {max_retries} attempts\nANSWER: Unable to get properly formatted response."
         fallback_clean = "Unable to get properly formatted response."
-
-        # 🔍 DEBUG: Print fallback
-        print(f"\n💥 FALLBACK TRIGGERED after {max_retries} attempts")
-        print(f"Final raw response was: {raw_response[:200]}...")
+        print(f"💥 FALLBACK TRIGGERED after {max_retries} attempts")
 
         return {"raw": fallback_raw, "clean": fallback_clean}
 
-    def extract_answer_only(self, text):
-        """Extract just the content after ANSWER:"""
-        if "ANSWER:" in text:
-            extracted = text.split("ANSWER:", 1)[1].strip()
-            # 🔍 DEBUG: Print extraction process
-            print(f"\n🎯 EXTRACTING ANSWER from: {text[:100]}...")
-            print(f"🎯 EXTRACTED: {extracted[:100]}...")
-            return extracted
-
-        # 🔍 DEBUG: No ANSWER found
-        print(f"\n⚠️ NO 'ANSWER:' found in text: {text[:100]}...")
-        return text.strip()
-
-    def clean_thinking_answer_format(self, text):
-        """Clean and ensure exactly one THINKING and one ANSWER section"""
-
-        # 🔍 DEBUG: Print input to cleaning function
-        print(f"\n🧼 CLEANING INPUT:")
-        print(f"Input length: {len(text)} characters")
-        print(f"First 200 chars: {text[:200]}...")
-        print(f"Contains THINKING: {'THINKING:' in text}")
-        print(f"Contains ANSWER: {'ANSWER:' in text}")
-
-        # Remove any leading/trailing whitespace
-        text = text.strip()
-
-        # Find all THINKING and ANSWER positions
-        thinking_positions = []
-        answer_positions = []
-
-        lines = text.split("\n")
-        for i, line in enumerate(lines):
-            line_stripped = line.strip()
-            if line_stripped.startswith("THINKING:"):
-                thinking_positions.append(i)
-                print(f"🧠 Found THINKING at line {i}: {line_stripped[:50]}...")
-            elif line_stripped.startswith("ANSWER:"):
-                answer_positions.append(i)
-                print(f"💬 Found ANSWER at line {i}: {line_stripped[:50]}...")
-
-        print(f"📊 THINKING positions: {thinking_positions}")
-        print(f"📊 ANSWER positions: {answer_positions}")
-
-        # If we have exactly one of each, check if they're in the right order
-        if len(thinking_positions) == 1 and len(answer_positions) == 1:
-            thinking_idx = thinking_positions[0]
-            answer_idx = answer_positions[0]
-
-            if thinking_idx < answer_idx:
-                print(f"✅ Perfect format detected!")
-                # Perfect format, just clean up the content
-                thinking_content = lines[thinking_idx][9:].strip()  # Remove "THINKING:"
-                answer_content = []
-
-                # Collect thinking content (everything between THINKING and ANSWER)
-                for i in range(thinking_idx + 1, answer_idx):
-                    thinking_content += " " + lines[i].strip()
-
-                # Collect answer content (everything after ANSWER)
-                answer_content = lines[answer_idx][7:].strip()  # Remove "ANSWER:"
-                for i in range(answer_idx + 1, len(lines)):
-                    answer_content += " " + lines[i].strip()
-
-                result = f"THINKING: {thinking_content.strip()}\nANSWER: {answer_content.strip()}"
-                print(f"✅ Perfect format result: {result[:100]}...")
-                return result
-
-        print(f"⚠️ Format needs fixing...")
-
-        # If format is messed up, try to extract and rebuild
-        # Look for the first THINKING and first ANSWER after it
-        thinking_content = ""
-        answer_content = ""
-
-        first_thinking = -1
-        first_answer_after_thinking = -1
-
-        for i, line in enumerate(lines):
-            line_stripped = line.strip()
-            if line_stripped.startswith("THINKING:") and first_thinking == -1:
-                first_thinking = i
-                thinking_content = line_stripped[9:].strip()
-                print(f"🎯 Using THINKING from line {i}")
-            elif (
-                line_stripped.startswith("ANSWER:")
-                and first_thinking != -1
-                and first_answer_after_thinking == -1
-            ):
-                first_answer_after_thinking = i
-                answer_content = line_stripped[7:].strip()
-                print(f"🎯 Using ANSWER from line {i}")
-                break
-            elif first_thinking != -1 and first_answer_after_thinking == -1:
-                # Still collecting thinking content
-                thinking_content += " " + line_stripped
-
-        # Collect remaining answer content
-        if first_answer_after_thinking != -1:
-            for i in range(first_answer_after_thinking + 1, len(lines)):
-                line_stripped = lines[i].strip()
-                # Stop if we hit another THINKING or ANSWER
-                if line_stripped.startswith("THINKING:") or line_stripped.startswith(
-                    "ANSWER:"
-                ):
-                    break
-                answer_content += " " + line_stripped
-
-        print(f"🔧 Extracted thinking: {thinking_content[:50]}...")
-        print(f"🔧 Extracted answer: {answer_content[:50]}...")
-
-        # If we still don't have both parts, try to extract from the raw text
-        if not thinking_content or not answer_content:
-            print(f"🆘 Last resort extraction...")
-            # Last resort: split on the patterns
-            if "THINKING:" in text and "ANSWER:" in text:
-                parts = text.split("ANSWER:", 1)
-                if len(parts) == 2:
-                    thinking_part = parts[0]
-                    answer_part = parts[1]
-
-                    # Extract thinking content
-                    if "THINKING:" in thinking_part:
-                        thinking_content = thinking_part.split("THINKING:", 1)[
-                            1
-                        ].strip()
-
-                    # Clean answer content (remove any nested THINKING/ANSWER)
-                    answer_lines = answer_part.split("\n")
-                    clean_answer_lines = []
-                    for line in answer_lines:
-                        if not line.strip().startswith(
-                            "THINKING:"
-                        ) and not line.strip().startswith("ANSWER:"):
-                            clean_answer_lines.append(line)
-                    answer_content = " ".join(clean_answer_lines).strip()
-
-        # Fallback if we still don't have proper content
-        if not thinking_content:
-            print(f"❌ Failed to extract thinking content")
-            thinking_content = "Unable to extract thinking content properly"
-        if not answer_content:
-            print(f"❌ Failed to extract answer content")
-            answer_content = "Unable to extract answer content properly"
-
-        final_result = (
-            f"THINKING: {thinking_content.strip()}\nANSWER: {answer_content.strip()}"
-        )
-        print(f"🏁 Final cleaned result: {final_result[:100]}...")
-        return final_result
-
-    def validate_thinking_answer_format(self, text):
-        """Validate that the text has exactly one THINKING and one ANSWER in correct order"""
-        lines = text.split("\n")
-
-        thinking_count = 0
-        answer_count = 0
-        thinking_first = False
-
-        for line in lines:
-            line_stripped = line.strip()
-            if line_stripped.startswith("THINKING:"):
-                thinking_count += 1
-                if answer_count == 0:  # No ANSWER seen yet
-                    thinking_first = True
-            elif line_stripped.startswith("ANSWER:"):
-                answer_count += 1
-
-        is_valid = thinking_count == 1 and answer_count == 1 and thinking_first
-        print(
-            f"✅ VALIDATION: thinking_count={thinking_count}, answer_count={answer_count}, thinking_first={thinking_first}, valid={is_valid}"
-        )
-
-        return is_valid
-
 
 # === Use the Class for Roles ===
 # Patient will be dynamically created with behavior-specific instructions
@@ -1475,27 +1282,20 @@ summarizer = RoleResponder(
 
 diagnoser = RoleResponder("You are a board-certified diagnostician.")
 
-# === Store all transcripts ===
-summarizer_outputs = []
-diagnosing_doctor_outputs = []
-questioning_doctor_outputs = []
-patient_response = []
-conversation = []
-behavioral_analyses = []
-patient_interpretations = []
+# === Process-wide prompt cache accounting (shared by all vignette threads) ===
+prompt_cache_usage = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0}
+prompt_cache_lock = threading.Lock()
+
+# === Stopping policy (a fresh one per vignette) ===
+# Honors END from turn 8 on, stops earlier once the differential has
+# converged, and hard-caps each interview at 20 turns / 60k tokens.
+make_stopping_policy = partial(
+    DifferentialConvergencePolicy, min_turns=8, max_turns=20, max_tokens=60000
+)
 
 
 def run_vignette_task(args):
     idx, vignette_text, disease = args
-    global conversation, patient_response, summarizer_outputs, diagnosing_doctor_outputs, questioning_doctor_outputs, treatment_plans, behavioral_analyses
-    conversation = []
-    patient_response = []
-    summarizer_outputs = []
-    diagnosing_doctor_outputs = []
-    questioning_doctor_outputs = []
-    treatment_plans = []
-    behavioral_analyses = []
-    patient_interpretations = []
     return process_vignette(idx, vignette_text, disease)
 
 
@@ -1516,64 +1316,34 @@ if __name__ == "__main__":
             shutil.rmtree(directory)
         os.makedirs(directory, exist_ok=True)
 
-    # Load the JSON file with improved structure handling
-    with open(
-        "patient_roleplay_scripts.json",  # Change to your file name
-        "r",
-    ) as f:
-        data = json.load(f)
-
-    flattened_vignettes = []
-
     # 🎯 SPECIFY WHICH TYPES TO INCLUDE
     DESIRED_TYPES = ["typical", "severe"]  # Change these as needed
     # Options: "typical", "early", "severe", "mixed"
 
-    # Handle roleplay scripts structure: {"metadata": {...}, "roleplay_scripts": {"Disease": [scripts...]}}
-    if "roleplay_scripts" in data:
-        roleplay_dict = data["roleplay_scripts"]
-        for disease, scripts in roleplay_dict.items():
-            # Only process if we have a list of scripts
-            if not isinstance(scripts, list):
-                continue
-
-            # 📋 SELECT SPECIFIC TYPES
-            selected_scripts = []
-            for script in scripts:
-                if isinstance(script, dict) and "variation_type" in script:
-                    if script["variation_type"] in DESIRED_TYPES:
-                        selected_scripts.append(script)
-                else:
-                    # If no variation_type, include it (fallback)
-                    selected_scripts.append(script)
-
-            # Limit to 2 even from selected types
-            limited_scripts = selected_scripts[:2]
-
-            for script in limited_scripts:
-                # Extract the roleplay_script content as the vignette text
-                if isinstance(script, dict) and "roleplay_script" in script:
-                    flattened_vignettes.append((disease, script["roleplay_script"]))
-                else:
-                    # Fallback if script is just a string
-                    flattened_vignettes.append((disease, str(script)))
+    # Streamed (disease, script) pairs, at most 2 per disease from the selected
+    # types; the first vignette starts while the file is still being read
+    vignettes = iter_roleplay_scripts(
+        "patient_roleplay_scripts.json",  # Change to your file name (or its .jsonl log)
+        desired_types=DESIRED_TYPES,
+        per_disease=2,
+    )
 
-            print(
-                f"   {disease}: Selected {len(limited_scripts)} vignettes ({[s.get('variation_type', 'unknown') for s in limited_scripts]})"
+    # Each vignette owns its outputs (VignetteSession), so they can share one
+    # process and one OpenAI client across worker threads
+    # bounded_map keeps ~2 tasks per worker in flight instead of reading
+    # every vignette up front
+    max_workers = 12
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(
+            bounded_map(
+                executor,
+                run_vignette_task,
+                (
+                    (idx, vignette_text, disease)
+                    for idx, (disease, vignette_text) in enumerate(vignettes)
+                ),
+                window=2 * max_workers,
             )
-    else:
-        raise ValueError(
-            f"Expected 'roleplay_scripts' key in JSON structure. Found keys: {list(data.keys()) if isinstance(data, dict) else type(data)}"
-        )
-
-    # Launch multiprocessing pool with 1 worker
-    with multiprocessing.Pool(processes=12) as pool:
-        results = pool.map(
-            run_vignette_task,
-            [
-                (idx, vignette_text, disease)
-                for idx, (disease, vignette_text) in enumerate(flattened_vignettes)
-            ],
         )
 
     # Aggregate and save all results to JSON
@@ -1608,11 +1378,21 @@ if __name__ == "__main__":
         json.dump(all_behavior_metadata, f, indent=2)
     with open("2behavioral_analyses.json", "w") as f:
         json.dump(all_behavioral_analyses, f, indent=2)
+    write_conversations(
+        "2conversations.parquet",
+        (row for result in results for row in session_rows(result)),
+    )
 
     print(
         "\n✅ All role outputs saved with gold diagnosis guidance and empathetic behavioral adaptations."
     )
 
+    print(
+        f"\n🧊 Prompt cache: {prompt_cache_usage['cached_tokens']}/{prompt_cache_usage['prompt_tokens']} "
+        f"prompt tokens served from cache ({cached_token_ratio(prompt_cache_usage) * 100:.1f}%) "
+        f"over {prompt_cache_usage['calls']} calls"
+    )
+
     # Print behavior distribution summary
     behavior_counts = {}
     for metadata in all_behavior_metadata:
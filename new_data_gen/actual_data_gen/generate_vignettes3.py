@@ -5,7 +5,7 @@ import random
 from openai import OpenAI
 from typing import Dict, List, Any, Optional
 import multiprocessing
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
 
 # Initialize OpenAI client
@@ -14,6 +14,54 @@ client = OpenAI(
 )
 model = "gpt-4.1-nano"
 
+SCRIPT_WRITER_SYSTEM_PROMPT = """You are a medical training specialist creating ROLEPLAY SCRIPTS for AI agents to act as patients. 
+
+Your job is to create CHARACTER BRIEFS that tell an AI agent exactly how to roleplay a patient with a specific medical condition.
+
+CRITICAL REQUIREMENTS:
+- Write AS the patient character, not ABOUT them
+- Create acting instructions for the AI agent
+- Include specific dialogue, behaviors, and emotional responses
+- Make it medically accurate while being realistic for the character
+- Provide clear roleplay directions
+- Focus on how the character would naturally speak and act"""
+
+# Variation-specific roleplay instructions
+VARIATION_INSTRUCTIONS = {
+    "typical": """
+            ROLEPLAY FOCUS:
+            - Act as a classic presentation of this condition
+            - Show clear, recognizable symptoms
+            - Be cooperative and forthcoming with information
+            - Display appropriate concern for a typical case
+            """,
+    "early": """
+            ROLEPLAY FOCUS:
+            - Act uncertain about seeking medical care
+            - Minimize symptoms initially ("maybe it's nothing")
+            - Be hesitant to "waste the doctor's time"
+            - Show mild symptoms that are just starting to worry you
+            """,
+    "severe": """
+            ROLEPLAY FOCUS:
+            - Show distress and urgency
+            - Indicate symptoms have significantly worsened
+            - Express fear about serious complications
+            - May have delayed seeking care until symptoms became severe
+            """,
+    "mixed": """
+            ROLEPLAY FOCUS:
+            - Present with some unusual or atypical features
+            - Show varying symptom severity
+            - Be somewhat confused about your symptoms
+            - Include both early and more developed symptoms
+            """,
+}
+
+# Sections every complete script has; a multi-variant response missing them
+# for a variant falls back to a single call for that variant
+REQUIRED_SCRIPT_SECTIONS = ["ROLEPLAY INSTRUCTIONS", "OPENING STATEMENT"]
+
 
 class MedicallyAccurateVignetteGenerator:
     def __init__(self, api_key: str, model: str = "gpt-4.1-nano"):
@@ -70,20 +118,7 @@ class MedicallyAccurateVignetteGenerator:
             response = self.client.chat.completions.create(
                 model=self.model,
                 messages=[
-                    {
-                        "role": "system",
-                        "content": """You are a medical training specialist creating ROLEPLAY SCRIPTS for AI agents to act as patients. 
-
-Your job is to create CHARACTER BRIEFS that tell an AI agent exactly how to roleplay a patient with a specific medical condition.
-
-CRITICAL REQUIREMENTS:
-- Write AS the patient character, not ABOUT them
-- Create acting instructions for the AI agent
-- Include specific dialogue, behaviors, and emotional responses
-- Make it medically accurate while being realistic for the character
-- Provide clear roleplay directions
-- Focus on how the character would naturally speak and act""",
-                    },
+                    {"role": "system", "content": SCRIPT_WRITER_SYSTEM_PROMPT},
                     {"role": "user", "content": prompt},
                 ],
                 temperature=0.7,
@@ -99,8 +134,62 @@ CRITICAL REQUIREMENTS:
             return validated_vignette
 
         except Exception as e:
+            # Callers record a fallback script and mark it for retry on resume
             print(f"❌ Error generating roleplay script for {disease_name}: {str(e)}")
-            return self._create_fallback_vignette(disease_data, vignette_number)
+            raise
+
+    def generate_variants_with_medical_data(
+        self, disease_data: Dict, variants: List[tuple]
+    ) -> Dict[int, str]:
+        """
+        Generate several variants of a disease's roleplay script in one
+        JSON-mode call.
+
+        variants is a list of (script_number, variation_type). Returns the
+        validated scripts by script_number; variants that are missing,
+        mislabelled or incomplete are left out so the caller can fall back to
+        single calls for just those.
+        """
+        disease_name = disease_data.get("disease_name", "Unknown Disease")
+        prompt = self._create_multi_variant_prompt(disease_data, variants)
+
+        try:
+            self.rate_limit_delay()
+
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": SCRIPT_WRITER_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt},
+                ],
+                response_format={"type": "json_object"},
+                temperature=0.7,
+                max_tokens=800 * len(variants),
+            )
+            scripts = json.loads(response.choices[0].message.content)["scripts"]
+        except Exception as e:
+            print(f"❌ Multi-variant call failed for {disease_name}: {e}")
+            return {}
+
+        requested = dict(variants)
+        validated = {}
+        for entry in scripts if isinstance(scripts, list) else []:
+            if not isinstance(entry, dict):
+                continue
+            script_number = entry.get("script_number")
+            script = entry.get("roleplay_script")
+            if (
+                requested.get(script_number) != entry.get("variation_type")
+                or not isinstance(script, str)
+                or not all(section in script.upper() for section in REQUIRED_SCRIPT_SECTIONS)
+            ):
+                continue
+            validated[script_number] = self._validate_vignette(script, disease_name)
+
+        print(
+            f"✅ Generated {len(validated)}/{len(variants)} roleplay scripts for {disease_name} in one call"
+        )
+        return validated
 
     def _create_roleplay_script_prompt(
         self, disease_data: Dict, vignette_number: int, variation_type: str
@@ -113,18 +202,7 @@ CRITICAL REQUIREMENTS:
         risk_factors = disease_data.get("risk_factors", [])
         prognosis = disease_data.get("prognosis", "")
 
-        # Select different symptom combinations for variation
-        if variation_type == "typical":
-            selected_symptoms = symptoms[:5] if len(symptoms) >= 5 else symptoms
-        elif variation_type == "early":
-            selected_symptoms = symptoms[:3] if len(symptoms) >= 3 else symptoms
-        elif variation_type == "severe":
-            selected_symptoms = symptoms[:7] if len(symptoms) >= 7 else symptoms
-        else:  # mixed
-            if len(symptoms) >= 6:
-                selected_symptoms = symptoms[:2] + symptoms[3:6]
-            else:
-                selected_symptoms = symptoms
+        selected_symptoms = self._select_symptoms(symptoms, variation_type)
 
         # Medical accuracy instructions
         medical_accuracy_note = self._get_medical_accuracy_instructions(
@@ -148,7 +226,30 @@ CRITICAL REQUIREMENTS:
 
         FORMAT YOUR RESPONSE AS A ROLEPLAY SCRIPT:
 
-        **PATIENT CHARACTER:** [Name, age, brief background]
+{self._script_format(disease_name, variation_type)}"""
+
+        variation_instructions = VARIATION_INSTRUCTIONS.get(
+            variation_type, VARIATION_INSTRUCTIONS["mixed"]
+        )
+
+        return f"{base_prompt}\n{variation_instructions}\n\nGenerate the complete roleplay script for the AI agent:"
+
+    def _select_symptoms(self, symptoms: List[str], variation_type: str) -> List[str]:
+        """Select different symptom combinations for variation"""
+        if variation_type == "typical":
+            return symptoms[:5] if len(symptoms) >= 5 else symptoms
+        elif variation_type == "early":
+            return symptoms[:3] if len(symptoms) >= 3 else symptoms
+        elif variation_type == "severe":
+            return symptoms[:7] if len(symptoms) >= 7 else symptoms
+        else:  # mixed
+            if len(symptoms) >= 6:
+                return symptoms[:2] + symptoms[3:6]
+            return symptoms
+
+    def _script_format(self, disease_name: str, variation_type: str) -> str:
+        """The roleplay script layout the model is asked to fill in"""
+        return f"""        **PATIENT CHARACTER:** [Name, age, brief background]
         **SCENARIO:** {disease_name} - {variation_type} presentation
 
         **CHARACTER BACKGROUND:**
@@ -197,41 +298,52 @@ CRITICAL REQUIREMENTS:
         VARIATION TYPE: {variation_type.upper()}
         """
 
-        # Add variation-specific roleplay instructions
-        if variation_type == "typical":
-            variation_instructions = """
-            ROLEPLAY FOCUS:
-            - Act as a classic presentation of this condition
-            - Show clear, recognizable symptoms
-            - Be cooperative and forthcoming with information
-            - Display appropriate concern for a typical case
-            """
-        elif variation_type == "early":
-            variation_instructions = """
-            ROLEPLAY FOCUS:
-            - Act uncertain about seeking medical care
-            - Minimize symptoms initially ("maybe it's nothing")
-            - Be hesitant to "waste the doctor's time"
-            - Show mild symptoms that are just starting to worry you
-            """
-        elif variation_type == "severe":
-            variation_instructions = """
-            ROLEPLAY FOCUS:
-            - Show distress and urgency
-            - Indicate symptoms have significantly worsened
-            - Express fear about serious complications
-            - May have delayed seeking care until symptoms became severe
-            """
-        else:  # mixed
-            variation_instructions = """
-            ROLEPLAY FOCUS:
-            - Present with some unusual or atypical features
-            - Show varying symptom severity
-            - Be somewhat confused about your symptoms
-            - Include both early and more developed symptoms
-            """
+    def _create_multi_variant_prompt(
+        self, disease_data: Dict, variants: List[tuple]
+    ) -> str:
+        """
+        One prompt for several (script_number, variation_type) scripts of a
+        disease: the disease context and script layout are sent once, followed
+        by the per-variant symptoms and roleplay focus.
+        """
+        disease_name = disease_data.get("disease_name", "Unknown Disease")
+        symptoms = disease_data.get("symptoms", [])
+        causes = disease_data.get("causes", [])
+        risk_factors = disease_data.get("risk_factors", [])
+        prognosis = disease_data.get("prognosis", "")
 
-        return f"{base_prompt}\n{variation_instructions}\n\nGenerate the complete roleplay script for the AI agent:"
+        medical_accuracy_note = self._get_medical_accuracy_instructions(
+            disease_name, risk_factors
+        )
+
+        variant_sections = "\n".join(
+            f"""
+        SCRIPT {script_number} - VARIATION TYPE: {variation_type.upper()}
+        Primary symptoms: {', '.join(self._select_symptoms(symptoms, variation_type))}
+        {VARIATION_INSTRUCTIONS.get(variation_type, VARIATION_INSTRUCTIONS["mixed"])}"""
+            for script_number, variation_type in variants
+        )
+
+        return f"""
+        Create {len(variants)} ROLEPLAY SCRIPTS for AI agents to act as patients with: {disease_name}
+        Each script is a different patient character, written for the variation type listed below.
+
+        MEDICAL DATA TO INCORPORATE:
+        Risk factors: {', '.join(risk_factors[:4])}
+        Underlying causes: {', '.join(causes[:3])}
+        {f"Clinical context: {prognosis[:150]}..." if prognosis else ""}
+
+        DEMOGRAPHIC REQUIREMENTS:
+        {medical_accuracy_note}
+
+        FORMAT EACH SCRIPT AS A ROLEPLAY SCRIPT:
+
+{self._script_format(disease_name, "[variation type]")}
+        SCRIPTS TO WRITE:
+{variant_sections}
+
+        Respond with a JSON object only, one entry per script above:
+        {{"scripts": [{{"script_number": <number>, "variation_type": "<variation type>", "roleplay_script": "<the complete roleplay script>"}}]}}"""
 
     def _generate_patient_names(
         self, disease_name: str, risk_factors: List[str]
@@ -473,115 +585,173 @@ MAIN CONCERNS:
 (Fallback roleplay script {vignette_number})"""
 
 
-def save_current_progress(
-    results: Dict,
-    medical_data: List[Dict],
-    num_vignettes_per_disease: int,
-    medical_json_file: str,
-    output_file: str,
-    model: str,
-):
-    """Save current progress to JSON file with enhanced error handling"""
-    try:
-        current_time = time.strftime("%Y-%m-%d %H:%M:%S")
-
-        output_data = {
-            "metadata": {
-                "source_file": medical_json_file,
-                "total_diseases": len(medical_data),
-                "scripts_per_disease": num_vignettes_per_disease,
-                "total_scripts": len(medical_data) * num_vignettes_per_disease,
-                "completed_diseases": len(results),
-                "generation_model": model,
-                "variation_types": ["typical", "early", "severe", "mixed"],
-                "generation_timestamp": current_time,
-                "last_update": current_time,
-                "focus": "roleplay_scripts_for_ai_agents",
-                "format": "patient_character_briefs",
-                "status": (
-                    "in_progress" if len(results) < len(medical_data) else "completed"
-                ),
-            },
-            "roleplay_scripts": results,
-        }
-
-        # Create backup filename
-        backup_file = f"backup_{output_file}"
-
-        # Write to backup first
-        with open(backup_file, "w", encoding="utf-8") as f:
-            json.dump(output_data, f, indent=2, ensure_ascii=False)
-
-        # If backup successful, write to main file
-        with open(output_file, "w", encoding="utf-8") as f:
-            json.dump(output_data, f, indent=2, ensure_ascii=False)
-
-        # Print file size for confirmation
-        file_size = os.path.getsize(output_file) / 1024  # KB
-        print(
-            f"💾 SAVED: {output_file} ({file_size:.1f} KB) - {len(results)} diseases completed at {current_time}"
-        )
+VARIATION_TYPES = ["typical", "early", "severe", "mixed"]
 
-        # Remove backup after successful save
-        if os.path.exists(backup_file):
-            os.remove(backup_file)
 
-    except Exception as e:
-        print(f"❌ ERROR SAVING FILE: {e}")
-        print(f"   Attempted to save {len(results)} completed diseases")
-        print(f"   Check disk space and file permissions")
+def script_log_path(output_file: str) -> str:
+    """Append-only JSONL log that backs output_file (one line per generated script)"""
+    return os.path.splitext(output_file)[0] + ".jsonl"
 
 
-def generate_vignettes_for_disease_with_data(args):
-    """Generate multiple roleplay scripts for a single disease"""
-    disease_data, num_vignettes, api_key, model = args
-    generator = MedicallyAccurateVignetteGenerator(api_key, model)
+def script_key(record: Dict) -> tuple:
+    return (record["disease_name"], record["variation_type"], record["script_number"])
 
-    disease_name = disease_data.get("disease_name", "Unknown Disease")
 
-    # Variation types focused on medical presentation
-    variation_types = ["typical", "early", "severe", "mixed"]
+def load_completed_scripts(log_file: str) -> Dict[tuple, Dict]:
+    """
+    Read the script log, keyed by (disease, variation_type, script_number).
 
-    vignettes = []
-    for i in range(num_vignettes):
-        try:
-            variation_type = variation_types[i % len(variation_types)]
+    Scripts that failed (records with an "error") are left out so a restart
+    retries them; a torn last line from an interrupted run is skipped.
+    """
+    completed = {}
+    if not os.path.exists(log_file):
+        return completed
+    with open(log_file, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "error" not in record:
+                completed[script_key(record)] = record
+    return completed
 
-            print(
-                f"🔄 Generating {variation_type} script {i+1}/{num_vignettes} for: {disease_name}"
-            )
 
-            vignette = generator.generate_vignette_with_medical_data(
-                disease_data, i + 1, variation_type
-            )
-            vignettes.append(
+def append_script(log, lock: threading.Lock, record: Dict):
+    """O(1) save: one JSON line per script, flushed immediately"""
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with lock:
+        log.write(line)
+        log.flush()
+
+
+def generate_script(
+    generator: MedicallyAccurateVignetteGenerator,
+    disease_data: Dict,
+    script_number: int,
+    variation_type: str,
+) -> Dict:
+    """Generate one roleplay script as a log record"""
+    disease_name = disease_data.get("disease_name", "Unknown Disease")
+    print(f"🔄 Generating {variation_type} script {script_number} for: {disease_name}")
+    record = {
+        "disease_name": disease_name,
+        "variation_type": variation_type,
+        "script_number": script_number,
+    }
+    try:
+        record["roleplay_script"] = generator.generate_vignette_with_medical_data(
+            disease_data, script_number, variation_type
+        )
+    except Exception as e:
+        print(
+            f"❌ Failed to generate roleplay script {script_number} for {disease_name}: {e}"
+        )
+        record["roleplay_script"] = generator._create_fallback_vignette(
+            disease_data, script_number
+        )
+        record["error"] = str(e)
+    record["generated_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    return record
+
+
+def generate_disease_scripts(
+    generator: MedicallyAccurateVignetteGenerator,
+    disease_data: Dict,
+    variants: List[tuple],
+    batch_variants: bool = True,
+) -> List[Dict]:
+    """
+    Generate a disease's pending variants. With batch_variants they come from
+    one multi-variant call, falling back to a single call per variant the
+    batch didn't validate; otherwise every variant is a single call.
+    """
+    disease_name = disease_data.get("disease_name", "Unknown Disease")
+    batched = (
+        generator.generate_variants_with_medical_data(disease_data, variants)
+        if batch_variants and len(variants) > 1
+        else {}
+    )
+
+    records = []
+    for script_number, variation_type in variants:
+        if script_number in batched:
+            records.append(
                 {
-                    "roleplay_script": vignette,
+                    "disease_name": disease_name,
                     "variation_type": variation_type,
-                    "script_number": i + 1,
+                    "script_number": script_number,
+                    "roleplay_script": batched[script_number],
                     "generated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
                 }
             )
+        else:
+            records.append(
+                generate_script(generator, disease_data, script_number, variation_type)
+            )
+    return records
 
-            print(f"✅ Completed {variation_type} script {i+1} for: {disease_name}")
 
-        except Exception as e:
-            print(
-                f"❌ Failed to generate roleplay script {i+1} for {disease_name}: {e}"
-            )
-            vignettes.append(
-                {
-                    "roleplay_script": generator._create_fallback_vignette(
-                        disease_data, i + 1
-                    ),
-                    "variation_type": "fallback",
-                    "script_number": i + 1,
-                    "generated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
-                    "error": str(e),
-                }
-            )
+def export_roleplay_scripts(
+    completed: Dict[tuple, Dict],
+    medical_data: List[Dict],
+    num_vignettes_per_disease: int,
+    medical_json_file: str,
+    output_file: str,
+    model: str,
+):
+    """
+    Write the consolidated patient_roleplay_scripts.json from the script log.
 
-    return disease_name, vignettes
+    Done once at the end of a run (not after every disease), atomically via a
+    temp file, in the {"metadata", "roleplay_scripts": {disease: [...]}}
+    layout the conversation generators read.
+    """
+    results = {}
+    for disease_data in medical_data:
+        disease_name = disease_data.get("disease_name", "Unknown Disease")
+        scripts = sorted(
+            (r for key, r in completed.items() if key[0] == disease_name),
+            key=lambda r: r["script_number"],
+        )
+        if scripts:
+            results[disease_name] = [
+                {k: v for k, v in r.items() if k != "disease_name"} for r in scripts
+            ]
+
+    current_time = time.strftime("%Y-%m-%d %H:%M:%S")
+    total_scripts = len(medical_data) * num_vignettes_per_disease
+    output_data = {
+        "metadata": {
+            "source_file": medical_json_file,
+            "total_diseases": len(medical_data),
+            "scripts_per_disease": num_vignettes_per_disease,
+            "total_scripts": total_scripts,
+            "completed_diseases": len(results),
+            "generation_model": model,
+            "variation_types": VARIATION_TYPES,
+            "generation_timestamp": current_time,
+            "last_update": current_time,
+            "focus": "roleplay_scripts_for_ai_agents",
+            "format": "patient_character_briefs",
+            "status": (
+                "in_progress" if len(completed) < total_scripts else "completed"
+            ),
+        },
+        "roleplay_scripts": results,
+    }
+
+    tmp_file = f"{output_file}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(output_data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, output_file)
+
+    file_size = os.path.getsize(output_file) / 1024  # KB
+    print(
+        f"💾 SAVED: {output_file} ({file_size:.1f} KB) - {len(results)} diseases at {current_time}"
+    )
+    return results
 
 
 def generate_vignettes_from_medical_json(
@@ -590,8 +760,20 @@ def generate_vignettes_from_medical_json(
     num_vignettes_per_disease: int = 2,
     output_file: str = "patient_roleplay_scripts.json",
     max_workers: int = 12,
+    batch_variants: bool = True,
 ):
-    """Generate roleplay scripts for AI agents from medical JSON data with enhanced incremental saving"""
+    """
+    Generate roleplay scripts for AI agents from medical JSON data.
+
+    Every (disease, variation_type, script_number) is one work item, served
+    by a thread pool sharing a single generator/OpenAI client. Each finished
+    script is appended to the JSONL log next to output_file, so saving is
+    O(1) and a restart only generates what the log doesn't already hold.
+
+    With batch_variants, a disease's pending variants are requested together
+    in one structured call (see generate_disease_scripts) instead of one
+    call per variant.
+    """
 
     generator = MedicallyAccurateVignetteGenerator(api_key, model)
     medical_data = generator.load_medical_data(medical_json_file)
@@ -600,100 +782,59 @@ def generate_vignettes_from_medical_json(
         print("❌ No medical data loaded. Exiting.")
         return {}
 
+    log_file = script_log_path(output_file)
+    completed = load_completed_scripts(log_file)
+
+    # (disease_data, [(script_number, variation_type), ...]) per disease
+    work = []
+    for disease_data in medical_data:
+        disease_name = disease_data.get("disease_name", "Unknown Disease")
+        pending = []
+        for i in range(num_vignettes_per_disease):
+            variation_type = VARIATION_TYPES[i % len(VARIATION_TYPES)]
+            if (disease_name, variation_type, i + 1) not in completed:
+                pending.append((i + 1, variation_type))
+        if pending:
+            work.append((disease_data, pending))
+    pending_scripts = sum(len(pending) for _, pending in work)
+
+    total_scripts = len(medical_data) * num_vignettes_per_disease
     print(
         f"🎭 Generating {num_vignettes_per_disease} ROLEPLAY SCRIPTS for {len(medical_data)} diseases"
     )
     print(
-        f"📊 Total scripts to generate: {len(medical_data) * num_vignettes_per_disease}"
+        f"📊 Total scripts: {total_scripts} ({len(completed)} already in {log_file}, {pending_scripts} to generate)"
     )
-    print(f"💾 Progress will be saved IMMEDIATELY after each disease to: {output_file}")
-    print(f"⚡ You can monitor progress by checking the file size and content!")
-
-    args_list = [
-        (disease_data, num_vignettes_per_disease, api_key, model)
-        for disease_data in medical_data
-    ]
-
-    results = {}
-    completed = 0
-    save_lock = threading.Lock()  # Thread safety for saving
-
-    # Create initial file
-    print(f"\n📁 Creating initial empty file...")
-    save_current_progress(
-        results,
-        medical_data,
-        num_vignettes_per_disease,
-        medical_json_file,
-        output_file,
-        model,
+    print(
+        f"📦 {'One multi-variant call per disease' if batch_variants else 'One call per script'}"
     )
-
-    # Process diseases sequentially to ensure immediate saving
-    for i, args in enumerate(args_list):
-        disease_data = args[0]
-        disease_name = disease_data.get("disease_name", f"Disease_{i}")
-
-        print(f"\n🏥 Starting disease {i+1}/{len(args_list)}: {disease_name}")
-
-        try:
-            # Generate vignettes for this disease
-            disease_name, vignettes = generate_vignettes_for_disease_with_data(args)
-
-            # IMMEDIATELY save after each disease
-            with save_lock:
-                results[disease_name] = vignettes
-                completed += 1
-
-                # Save progress RIGHT NOW
-                save_current_progress(
-                    results,
-                    medical_data,
-                    num_vignettes_per_disease,
-                    medical_json_file,
-                    output_file,
-                    model,
-                )
-
-            progress = (completed / len(medical_data)) * 100
-            print(
-                f"📈 Progress: {completed}/{len(medical_data)} diseases completed ({progress:.1f}%)"
+    print(f"💾 Each script is appended to {log_file} as soon as it's done")
+
+    log_lock = threading.Lock()
+    done = 0
+    with open(log_file, "a", encoding="utf-8") as log, ThreadPoolExecutor(
+        max_workers=max_workers
+    ) as executor:
+        futures = [
+            executor.submit(
+                generate_disease_scripts, generator, disease_data, pending, batch_variants
             )
-            print(f"💾 File updated with {len(vignettes)} new scripts!")
-
-        except Exception as e:
-            print(f"❌ Failed to generate roleplay scripts for {disease_name}: {e}")
-
-            # Save fallback immediately
-            with save_lock:
-                fallback_vignettes = []
-                for j in range(num_vignettes_per_disease):
-                    fallback_vignettes.append(
-                        {
-                            "roleplay_script": f"Error generating roleplay script for {disease_name} (script {j+1})",
-                            "variation_type": "error",
-                            "script_number": j + 1,
-                            "generated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
-                            "error": str(e),
-                        }
+            for disease_data, pending in work
+        ]
+        for future in as_completed(futures):
+            for record in future.result():
+                append_script(log, log_lock, record)
+                if "error" not in record:
+                    completed[script_key(record)] = record
+                done += 1
+                if done % 25 == 0 or done == pending_scripts:
+                    print(
+                        f"📈 Progress: {len(completed)}/{total_scripts} scripts ({len(completed) / total_scripts * 100:.1f}%)"
                     )
-                results[disease_name] = fallback_vignettes
-                completed += 1
-
-                # Save even failed attempts immediately
-                save_current_progress(
-                    results,
-                    medical_data,
-                    num_vignettes_per_disease,
-                    medical_json_file,
-                    output_file,
-                    model,
-                )
 
-    # Final save with completed status
-    print(f"\n🏁 Doing final save...")
-    save_current_progress(
-        results,
+    print(f"\n🏁 Writing {output_file}...")
+    results = export_roleplay_scripts(
+        completed,
         medical_data,
         num_vignettes_per_disease,
         medical_json_file,
@@ -704,19 +845,14 @@ def generate_vignettes_from_medical_json(
     print(f"\n✅ Completed! Roleplay scripts saved to: {output_file}")
 
     # Summary statistics
-    total_scripts = sum(len(vignettes) for vignettes in results.values())
-    successful_diseases = sum(
-        1
-        for vignettes in results.values()
-        if not any("Error" in v.get("roleplay_script", "") for v in vignettes)
-    )
-
     print(f"\n📊 GENERATION SUMMARY:")
     print(f"   Total diseases processed: {len(medical_data)}")
-    print(f"   Successful diseases: {successful_diseases}")
-    print(f"   Total roleplay scripts generated: {total_scripts}")
+    print(
+        f"   Diseases with every script: {sum(1 for v in results.values() if len(v) == num_vignettes_per_disease)}"
+    )
+    print(f"   Total roleplay scripts generated: {len(completed)}/{total_scripts}")
+    print(f"   Failed scripts (retried on the next run): {total_scripts - len(completed)}")
     print(f"   Format: Character briefs for AI agent roleplay")
-    print(f"   💾 File saved after EVERY single disease completion!")
 
     return results
 
@@ -727,12 +863,13 @@ if __name__ == "__main__":
     MEDICAL_JSON_FILE = "combined.json"
     NUM_VIGNETTES_PER_DISEASE = 4
     OUTPUT_FILE = "patient_roleplay_scripts.json"
-    MAX_WORKERS = 12  # Sequential processing for immediate saving
+    MAX_WORKERS = 12  # Scripts generated concurrently (one shared client)
+    BATCH_VARIANTS = True  # All of a disease's variants in one structured call
 
     print("🎭 PATIENT ROLEPLAY SCRIPT GENERATOR")
     print("=" * 50)
     print("🎯 Creating character briefs for AI agents to roleplay patients")
-    print("💾 WITH IMMEDIATE SAVING - File updates after EVERY disease!")
+    print("💾 Append-only progress log; rerun to resume where it stopped")
 
     if not os.path.exists(MEDICAL_JSON_FILE):
         print(f"❌ Medical JSON file not found: {MEDICAL_JSON_FILE}")
@@ -744,6 +881,7 @@ if __name__ == "__main__":
         num_vignettes_per_disease=NUM_VIGNETTES_PER_DISEASE,
         output_file=OUTPUT_FILE,
         max_workers=MAX_WORKERS,
+        batch_variants=BATCH_VARIANTS,
     )
 
     print(f"\n🚀 Ready for AI agent training! Roleplay scripts in: {OUTPUT_FILE}")
@@ -1,13 +1,11 @@
-import json
+from collections import Counter
 
-with open("patient_roleplay_scripts.json", "r") as f:
-    data = json.load(f)
+from script_loader import iter_roleplay_scripts
 
-count = 0
-if "roleplay_scripts" in data:
-    for disease, scripts in data["roleplay_scripts"].items():
-        if isinstance(scripts, list):
-            count += len(scripts)
-            print(f"{disease}: {len(scripts)} vignettes")
+# Streamed, so only the per-disease counts are held in memory
+counts = Counter(disease for disease, _ in iter_roleplay_scripts("patient_roleplay_scripts.json"))
 
-print(f"Total: {count} vignettes")
+for disease, n in counts.items():
+    print(f"{disease}: {n} vignettes")
+
+print(f"Total: {sum(counts.values())} vignettes")
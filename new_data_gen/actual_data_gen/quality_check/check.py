@@ -1,7 +1,16 @@
 # This file is for checking the qaulity of the question generation data
 
+import os
+import sys
 import json
-import re
+from collections import Counter
+
+import pyarrow.compute as pc
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "grpo_infra", "formatting")
+)
+from format_rewards import parse_batch
 
 missing_count = 0
 
@@ -10,18 +19,19 @@ def extract_answers_from_json(json_path):
     with open(json_path, "r", encoding="utf-8") as f:
         data = json.load(f)
 
+    # One vectorized parse of every output; rows without a THINKING: followed
+    # by an ANSWER: have null sections
+    parsed = parse_batch([str(entry.get("output", "")) for entry in data])
+    has_sections = pc.is_valid(parsed["answer"]).to_pylist()
+    thinking = parsed["thinking"].to_pylist()
+    answers = parsed["answer"].to_pylist()
+
     extracted_answers = []
     valid_entries = []
     missing_entries = []
 
-    for entry in data:
-        output = entry.get("output", "")
-        thinking_match = re.search(r"THINKING:\s*(.*?)(?:ANSWER:|$)", output, re.DOTALL)
-        answer_match = re.search(r"ANSWER:\s*(.*)", output, re.DOTALL)
-
-        if thinking_match and answer_match:
-            thinking_text = thinking_match.group(1).strip()
-            answer_text = answer_match.group(1).strip()
+    for entry, ok, thinking_text, answer_text in zip(data, has_sections, thinking, answers):
+        if ok:
             extracted_answers.append(
                 {
                     "vignette_index": entry.get("vignette_index"),
@@ -38,6 +48,7 @@ def extract_answers_from_json(json_path):
 
     print(f"Total entries missing either THINKING or ANSWER: {len(missing_entries)}")
     print("Missing entry indices:", missing_entries)
+    print("Format codes:", dict(Counter(parsed["code"].to_pylist())))
     return extracted_answers
 
 
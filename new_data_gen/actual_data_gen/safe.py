@@ -1,19 +1,29 @@
 import os
+import sys
 import json
 from openai import OpenAI
 import time
-import multiprocessing
 import shutil
 from itertools import islice
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import random
 
+from conversation_state import VignetteSession, compact_json, render_memory, record_session_tokens
+from stopping_policy import END_RE, DifferentialConvergencePolicy, answer_section
+from conversation_store import session_rows, write_conversations
+from script_loader import bounded_map, iter_vignettes
+from empathy_infra.empathy import generate_empathetic_questioning_prompt
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "grpo_infra", "formatting"))
+from format_rewards import format_output, parse_output, strip_trailers
+
 # Initialize OpenAI client
 client = OpenAI(
     api_key="api"
 )
 model = "gpt-4.1-nano"
 
-treatment_plans = []
 
 # === Patient Behavior Configurations ===
 PATIENT_BEHAVIORS = {
@@ -980,10 +990,11 @@ def detect_patient_behavior_cues_enhanced(conversation_history, patient_response
 
 
 # Enhanced summarizer function that incorporates patient interpretation
-def generate_unbiased_vignette(
-    conversation_history, previous_vignette, patient_interpretation
-):
-    """Generate a vignette that accounts for patient communication biases"""
+def generate_unbiased_vignette(history, patient_interpretation):
+    """
+    Update the vignette with the turns since the previous one, accounting for
+    patient communication biases
+    """
 
     unbiased_summarizer = RoleResponder(
         """You are an expert clinical summarizer trained to extract objective clinical information 
@@ -999,17 +1010,17 @@ def generate_unbiased_vignette(
     summary_prompt = f"""
     TASK: Create an objective, unbiased clinical vignette that accounts for patient communication patterns.
     
-    CONVERSATION HISTORY:
-    {json.dumps(conversation_history, indent=2)}
-    
     PREVIOUS VIGNETTE:
-    {previous_vignette}
+    {history.summary}
+    
+    NEW CONVERSATION SINCE PREVIOUS VIGNETTE:
+    {history.render_new()}
     
     PATIENT COMMUNICATION ANALYSIS:
     {patient_interpretation}
     
     INSTRUCTIONS:
-    1. Extract all objective clinical facts from the conversation
+    1. Restate the facts in the previous vignette and add the objective clinical facts from the new conversation
     2. Account for identified communication biases in your interpretation
     3. Include likely symptoms/information that patient may be minimizing or withholding
     4. Adjust symptom severity based on detected amplification or minimization patterns
@@ -1232,34 +1243,12 @@ def is_diagnosis_match(predicted, gold):
 
 def clean_diagnosis_output(raw_output):
     """Clean diagnosis output to only include THINKING and ANSWER sections"""
-    lines = raw_output.split("\n")
-    cleaned_lines = []
-    in_valid_section = False
-
-    for line in lines:
-        line_stripped = line.strip()
-
-        # Check if we're starting THINKING or ANSWER section
-        if line_stripped.startswith("THINKING:") or line_stripped.startswith("ANSWER:"):
-            in_valid_section = True
-            cleaned_lines.append(line)
-        # Stop at unwanted content
-        elif (
-            line_stripped.startswith("**Note:")
-            or line_stripped.startswith("Note:")
-            or line_stripped.startswith("**Additional:")
-            or line_stripped.startswith("Additional:")
-            or line_stripped.startswith("**Further:")
-            or line_stripped.startswith("Further:")
-            or line_stripped.startswith("**Recommendation:")
-            or line_stripped.startswith("Recommendation:")
-        ):
-            break
-        # Continue adding lines if we're in a valid section
-        elif in_valid_section:
-            cleaned_lines.append(line)
-
-    return "\n".join(cleaned_lines).strip()
+    parsed = parse_output(raw_output, cut_trailers=True)
+    if parsed.thinking is None:
+        # No THINKING: followed by ANSWER: to rebuild from; keep the text so
+        # the dataset format checks can drop it later
+        return strip_trailers(raw_output).strip()
+    return format_output(parsed.thinking, parsed.answer)
 
 
 # === Updated Diagnosis Prompt Templates ===
@@ -1355,6 +1344,14 @@ ANSWER:
 STOP HERE. Do not add notes, recommendations, or additional text."""
 
 
+# === Questioner Output Format ===
+EMPATHETIC_QUESTION_FORMAT = """YOU MUST RESPOND IN THE FOLLOWING FORMAT:
+
+THINKING: <Why this question adds diagnostic value AND how you're being empathetic to the patient's needs>.
+EMPATHY: <How you're acknowledging the patient's emotional state or communication style>
+ANSWER: <Your empathetic, diagnostically valuable question>."""
+
+
 # === Diagnosis Logic with Cleaning ===
 def get_diagnosis_with_cleaning(
     turn_count, gold_label, vignette_summary, previous_questions, diagnoser
@@ -1379,7 +1376,7 @@ def get_diagnosis_with_cleaning(
     # Get raw diagnosis
     raw_diagnosis = diagnoser.ask(
         guided_prompt.format(
-            prev_questions=json.dumps(previous_questions),
+            prev_questions=compact_json(previous_questions),
             vignette=vignette_summary,
             turn_count=turn_count,
         )
@@ -1408,8 +1405,10 @@ def calculate_accuracy_score(found, position, total_predictions):
 
 
 # === Modified process_vignette function ===
-def process_vignette(idx, vignette_text, gold_label):
-    global conversation, patient_response, summarizer_outputs, diagnosing_doctor_outputs, questioning_doctor_outputs, treatment_plans, behavioral_analyses, patient_interpretations
+def process_vignette(idx, vignette_text, gold_label, stopping_policy=None):
+    session = VignetteSession(idx, vignette_text, gold_label).activate()
+    stopping_policy = stopping_policy or make_stopping_policy()
+    history = session.history
 
     # Select patient behavior for this vignette
     behavior_type, behavior_config = select_patient_behavior()
@@ -1420,8 +1419,7 @@ def process_vignette(idx, vignette_text, gold_label):
 
     previous_questions = []
     initial_prompt = "What brings you in today?"
-    conversation.clear()
-    conversation.append(f"DOCTOR: {initial_prompt}")
+    history.append("DOCTOR", initial_prompt)
 
     # Create patient with behavior-specific instructions
     patient_instructions = generate_patient_prompt_modifiers(
@@ -1465,8 +1463,8 @@ Doctor's question: {initial_prompt}"""
     else:
         patient_response_text = raw_patient
     print("🗣️ Patient's Reply:", patient_response_text)
-    conversation.append(f"PATIENT: {patient_response_text}")
-    patient_response.append(
+    history.append("PATIENT", patient_response_text)
+    session.patient_response.append(
         {
             "vignette_index": idx,
             "input": f"{vignette_text}\n{initial_prompt}",
@@ -1479,7 +1477,6 @@ Doctor's question: {initial_prompt}"""
     
     turn_count = 0
     diagnosis_complete = False
-    prev_vignette_summary = ""
     
     # NEW: Store all behavioral analyses for memory
     all_behavioral_analyses = []
@@ -1490,10 +1487,10 @@ Doctor's question: {initial_prompt}"""
         if turn_count <= 8:
             # Enhanced behavioral analysis with memory of previous analyses
             behavioral_analysis = detect_patient_behavior_cues_enhanced_with_memory(
-                conversation, patient_response, all_behavioral_analyses
+                history, all_behavioral_analyses
             )
             all_behavioral_analyses.append(behavioral_analysis)
-            behavioral_analyses.append(
+            session.behavioral_analyses.append(
                 {
                     "vignette_index": idx,
                     "turn_count": turn_count,
@@ -1505,10 +1502,10 @@ Doctor's question: {initial_prompt}"""
             # Patient Interpretation with memory of previous interpretations
             patient_interpreter = PatientInterpreter()
             patient_interpretation = patient_interpreter.interpret_patient_communication_with_memory(
-                conversation, behavioral_analysis, prev_vignette_summary, all_patient_interpretations
+                history, behavioral_analysis, history.summary, all_patient_interpretations
             )
             all_patient_interpretations.append(patient_interpretation)
-            patient_interpretations.append(
+            session.patient_interpretations.append(
                 {
                     "vignette_index": idx,
                     "turn_count": turn_count,
@@ -1517,15 +1514,13 @@ Doctor's question: {initial_prompt}"""
             )
             print(f"🔍 Patient Interpretation (Turn {turn_count//2 + 1}): {patient_interpretation[:200]}...")
 
-            # Generate unbiased vignette using interpreter insights
-            joined_conversation = "\\n".join(conversation)
-            vignette_summary = generate_unbiased_vignette(
-                conversation, prev_vignette_summary, patient_interpretation
-            )
+            # Update the vignette with the turns since the last one
+            new_conversation = history.render_new()
+            vignette_summary = generate_unbiased_vignette(history, patient_interpretation)
         else:
             # NEW: After turn 8, use standard summarizer without behavioral analysis
             print(f"🔄 Using standard summarizer (Turn {turn_count//2 + 1} - beyond behavioral analysis phase)")
-            joined_conversation = "\\n".join(conversation)
+            new_conversation = history.render_new()
             vignette_summary = summarizer.ask(
                 f"""You are a clinical summarizer trained to extract structured vignettes from doctor–patient dialogues.
 
@@ -1536,20 +1531,20 @@ YOU MUST RESPOND IN THE FOLLOWING FORMAT:
 THINKING: <Your reasoning about whether the conversation introduced new clinical details>. 
 ANSWER: <The Patient Vignette>.
 
-Latest conversation:
-{joined_conversation}
-
 Previous vignette summary:
-{prev_vignette_summary}
+{history.summary}
+
+New conversation since the previous vignette:
+{new_conversation}
 """
             )
             # Use last known behavioral analysis for empathy but no new interpretation
             behavioral_analysis = all_behavioral_analyses[-1] if all_behavioral_analyses else f"Expected behavioral cues: {', '.join(behavior_config.get('empathy_cues', []))}"
 
-        summarizer_outputs.append(
+        session.summarizer_outputs.append(
             {
                 "vignette_index": idx,
-                "input": joined_conversation,
+                "input": new_conversation,
                 "output": vignette_summary,
                 "patient_interpretation": all_patient_interpretations[-1] if all_patient_interpretations else "No interpretation - beyond behavioral phase",
                 "turn_count": turn_count,
@@ -1557,12 +1552,11 @@ Previous vignette summary:
             }
         )
 
-        prev_vignette_summary = vignette_summary
-
         if "ANSWER:" in vignette_summary:
             vignette_summary = vignette_summary.split("ANSWER:")[1].strip()
         else:
             vignette_summary = vignette_summary
+        history.update_summary(vignette_summary)
 
         # === UPDATED DIAGNOSIS LOGIC WITH CLEANING ===
         diagnosis = get_diagnosis_with_cleaning(
@@ -1587,7 +1581,7 @@ Previous vignette summary:
             stage = "late"
 
         print("🔍 Diagnosis:", diagnosis)
-        diagnosing_doctor_outputs.append(
+        session.diagnosing_doctor_outputs.append(
             {
                 "vignette_index": idx,
                 "input": vignette_summary,
@@ -1600,12 +1594,15 @@ Previous vignette summary:
             }
         )
 
-        # Handle END signal explicitly
-        if "END" in diagnosis:
-            if turn_count >= 15:
-                print(f"✅ Reached END for vignette {idx}. Moving to next.\n")
-                raw_treatment = diagnoser.ask(
-                    f"""You are a board-certified clinician. Based on the diagnosis provided below, suggest a concise treatment plan that could realistically be initiated by a primary care physician or psychiatrist.
+        # Stop on END, a converged differential, or the turn/token caps
+        decision = stopping_policy.observe(turn_count, diagnosis, session.tokens_used)
+        if decision.stop:
+            print(
+                f"✅ Stopping vignette {idx} ({decision.reason}, "
+                f"confidence {decision.confidence:.2f}). Moving to next.\n"
+            )
+            raw_treatment = diagnoser.ask(
+                f"""You are a board-certified clinician. Based on the diagnosis provided below, suggest a concise treatment plan that could realistically be initiated by a primary care physician or psychiatrist.
 
         Diagnosis: {diagnosis}
 
@@ -1616,29 +1613,29 @@ Previous vignette summary:
         THINKING: <your reasoning about why you chose this treatment>
         ANSWER: <the actual treatment plan>
         """
-                )
-                print("💊 Raw Treatment Plan:", raw_treatment)
-
-                treatment_plans.append(
-                    {
-                        "vignette_index": idx,
-                        "input": diagnosis,
-                        "output": raw_treatment,
-                        "gold_diagnosis": gold_label,
-                    }
-                )
-
-                diagnosis_complete = True
-                break
-            else:
-                print(
-                    f"⚠️ Model said END before 15 turns. Ignoring END due to insufficient conversation length."
-                )
+            )
+            print("💊 Raw Treatment Plan:", raw_treatment)
+
+            session.treatment_plans.append(
+                {
+                    "vignette_index": idx,
+                    "input": diagnosis,
+                    "output": raw_treatment,
+                    "gold_diagnosis": gold_label,
+                }
+            )
+
+            diagnosis_complete = True
+            break
+        if END_RE.search(answer_section(diagnosis)):
+            print(
+                f"⚠️ Model said END before {stopping_policy.min_turns} turns. Ignoring END due to insufficient conversation length."
+            )
 
         # Limit to last 3–5 doctor questions
         previous_questions = [
             entry.replace("DOCTOR:", "").strip()
-            for entry in conversation
+            for entry in session.conversation
             if entry.startswith("DOCTOR:")
         ][-5:]
 
@@ -1662,20 +1659,16 @@ Previous vignette summary:
         )
         questioner = RoleResponder(empathetic_prompt)
 
+        # Static format block first, per-turn context last (prefix-cacheable)
         raw_followup = questioner.ask(
-            f"""Previously asked questions: {json.dumps(previous_questions)}
-
-            YOU MUST RESPOND IN THE FOLLOWING FORMAT:
+            f"""{EMPATHETIC_QUESTION_FORMAT}
 
-            THINKING: <Why this question adds diagnostic value AND how you're being empathetic to the patient's needs>.
-            EMPATHY: <How you're acknowledging the patient's emotional state or communication style>
-            ANSWER: <Your empathetic, diagnostically valuable question>.
+Previously asked questions: {compact_json(previous_questions)}
 
-            Vignette:
-            {vignette_summary}
-            Current Estimated Diagnosis: {diagnosis}
-            Patient Behavioral Cues: {behavioral_analysis}
-            """
+Vignette:
+{vignette_summary}
+Current Estimated Diagnosis: {diagnosis}
+Patient Behavioral Cues: {behavioral_analysis}"""
         )
 
         if "ANSWER:" in raw_followup:
@@ -1684,7 +1677,7 @@ Previous vignette summary:
             followup_question = raw_followup
         print("❓ Empathetic Follow-up:", followup_question)
         question_input = f"Vignette:\n{vignette_summary}\nCurrent Estimated Diagnosis: {diagnosis}\nBehavioral Cues: {behavioral_analysis}"
-        questioning_doctor_outputs.append(
+        session.questioning_doctor_outputs.append(
             {
                 "vignette_index": idx,
                 "input": question_input,
@@ -1695,7 +1688,7 @@ Previous vignette summary:
                 "behavioral_phase": turn_count <= 8
             }
         )
-        conversation.append(f"DOCTOR: {followup_question}")
+        history.append("DOCTOR", followup_question)
 
         # Update patient instructions for follow-up responses (behavior may evolve)
         patient_followup_instructions = generate_patient_prompt_modifiers(
@@ -1737,8 +1730,8 @@ Doctor's question: {followup_question}"""
             patient_followup_text = raw_patient_fb
 
         print("🗣️ Patient:", patient_followup_text)
-        conversation.append(f"PATIENT: {patient_followup_text}")
-        patient_response.append(
+        history.append("PATIENT", patient_followup_text)
+        session.patient_response.append(
             {
                 "vignette_index": idx,
                 "input": vignette_text + followup_question,
@@ -1758,42 +1751,19 @@ Doctor's question: {followup_question}"""
         "empathy_cues": behavior_config.get("empathy_cues", []),
         "gold_diagnosis": gold_label,
         "behavioral_analysis_turns": len(all_behavioral_analyses),
-        "total_turns": turn_count // 2
+        "total_turns": turn_count // 2,
+        "stop_reason": decision.reason,
+        "stop_confidence": round(decision.confidence, 3),
+        "tokens_used": session.tokens_used,
     }
 
-    with open(f"2summarizer_outputs/summarizer_{idx}.json", "w") as f:
-        json.dump(summarizer_outputs, f, indent=2)
-    with open(f"2patient_followups/patient_{idx}.json", "w") as f:
-        json.dump(patient_response, f, indent=2)
-    with open(f"2diagnosing_doctor_outputs/diagnoser_{idx}.json", "w") as f:
-        json.dump(diagnosing_doctor_outputs, f, indent=2)
-    with open(f"2questioning_doctor_outputs/questioner_{idx}.json", "w") as f:
-        json.dump(questioning_doctor_outputs, f, indent=2)
-    with open(f"2treatment_plans/treatment_{idx}.json", "w") as f:
-        json.dump(treatment_plans, f, indent=2)
-    with open(f"2behavior_metadata/behavior_{idx}.json", "w") as f:
-        json.dump(behavior_metadata, f, indent=2)
-    with open(f"2behavioral_analyses/behavioral_analysis_{idx}.json", "w") as f:
-        json.dump(behavioral_analyses, f, indent=2)
-    with open(f"2patient_interpretations/interpretation_{idx}.json", "w") as f:
-        json.dump(patient_interpretations, f, indent=2)
-
-    return {
-        "vignette_index": idx,
-        "patient_response": patient_response,
-        "summarizer_outputs": summarizer_outputs,
-        "diagnosing_doctor_outputs": diagnosing_doctor_outputs,
-        "questioning_doctor_outputs": questioning_doctor_outputs,
-        "treatment_plans": treatment_plans,
-        "behavior_metadata": behavior_metadata,
-        "behavioral_analyses": behavioral_analyses,
-        "patient_interpretations": patient_interpretations,
-        "gold_diagnosis": gold_label,
-    }
+    session.behavior_metadata = behavior_metadata
+    session.save()
+    return session.to_result()
 
 
 # === Enhanced behavioral analysis with memory ===
-def detect_patient_behavior_cues_enhanced_with_memory(conversation_history, patient_responses, previous_analyses):
+def detect_patient_behavior_cues_enhanced_with_memory(history, previous_analyses):
     """Enhanced version that provides more detailed behavioral analysis using Chain of Thought reasoning with memory"""
     cue_detector = RoleResponder(
         """You are a behavioral psychologist specializing in patient communication patterns.
@@ -1804,15 +1774,13 @@ def detect_patient_behavior_cues_enhanced_with_memory(conversation_history, pati
         build on your previous analyses to create a consistent understanding of the patient over time."""
     )
 
-    recent_responses = patient_responses[-3:]
-    
     # Format previous analyses for context
     previous_analyses_context = ""
     if previous_analyses:
         previous_analyses_context = f"""
         
         PREVIOUS BEHAVIORAL ANALYSES:
-        {json.dumps(previous_analyses[-2:], indent=2)}  # Last 2 analyses for context
+        {render_memory(previous_analyses)}
         
         CONSISTENCY GOAL: Build on previous analyses to create a coherent understanding of this patient's communication style. 
         Note any changes in behavior or confirmation of previous patterns.
@@ -1823,10 +1791,10 @@ def detect_patient_behavior_cues_enhanced_with_memory(conversation_history, pati
     Use Chain of Thought reasoning to analyze these patient responses for detailed behavioral patterns:
     
     RECENT PATIENT RESPONSES:
-    {json.dumps(recent_responses, indent=2)}
+    {history.render(history.replies("PATIENT", 3))}
     
     CONVERSATION CONTEXT:
-    {json.dumps(conversation_history[-6:], indent=2)}
+    {history.render_recent()}
     
     {previous_analyses_context}
     
@@ -1926,7 +1894,7 @@ class PatientInterpreter:
         self.responder = RoleResponder(self.role_instruction)
 
     def interpret_patient_communication_with_memory(
-        self, conversation_history, detected_behavior, current_vignette, previous_interpretations
+        self, history, detected_behavior, current_vignette, previous_interpretations
     ):
         """Analyze patient communication to extract unbiased clinical information using Chain of Thought reasoning with memory"""
 
@@ -1936,7 +1904,7 @@ class PatientInterpreter:
             previous_context = f"""
             
             PREVIOUS INTERPRETATIONS:
-            {json.dumps(previous_interpretations[-2:], indent=2)}  # Last 2 interpretations for context
+            {render_memory(previous_interpretations)}
             
             STANDARDIZATION GOAL: Build on previous interpretations to create a consistent, evolving understanding
             of this patient's true clinical picture. Note how their communication patterns are stabilizing.
@@ -1947,8 +1915,8 @@ class PatientInterpreter:
         
         DETECTED PATIENT BEHAVIOR: {detected_behavior}
         
-        CONVERSATION HISTORY:
-        {json.dumps(conversation_history[-6:], indent=2)}  # Last 6 exchanges
+        RECENT CONVERSATION:
+        {history.render_recent()}
         
         CURRENT VIGNETTE SUMMARY:
         {current_vignette}
@@ -2033,111 +2001,13 @@ class PatientInterpreter:
         return self.responder.ask(interpretation_prompt)
 
     # Keep the old method for compatibility
-    def interpret_patient_communication(self, conversation_history, detected_behavior, current_vignette):
+    def interpret_patient_communication(self, history, detected_behavior, current_vignette):
         """Fallback method for compatibility"""
         return self.interpret_patient_communication_with_memory(
-            conversation_history, detected_behavior, current_vignette, []
+            history, detected_behavior, current_vignette, []
         )
 
 
-def generate_empathetic_questioning_prompt(
-    base_role, behavioral_cues="", turn_stage="early"
-):
-    """
-    Generate questioning prompts that incorporate empathy based on detected behavioral cues
-    """
-    base_empathy_instructions = """
-    You are a compassionate physician who recognizes that patients have different communication styles and emotional needs.
-    
-    CORE EMPATHY PRINCIPLES:
-    - Validate the patient's feelings and concerns
-    - Use language that matches the patient's emotional state
-    - Build trust through understanding
-    - Adapt your communication style to the patient's needs
-    """
-
-    stage_specific_guidance = {
-        "early": "Focus on building rapport and making the patient feel heard and safe.",
-        "middle": "Show understanding of their concerns while gathering focused information.",
-        "late": "Provide reassurance and clear communication about next steps.",
-    }
-
-    empathy_adaptations = ""
-    if "anxiety" in behavioral_cues.lower() or "fear" in behavioral_cues.lower():
-        empathy_adaptations += """
-        ANXIETY/FEAR DETECTED - Empathetic Adaptations:
-        - Acknowledge their fears explicitly: "I can see this is really worrying you..."
-        - Provide reassurance: "We're going to figure this out together"
-        - Explain your reasoning: "I'm asking this because..."
-        - Offer hope: "Many conditions that cause these symptoms are very treatable"
-        """
-
-    if "embarrass" in behavioral_cues.lower() or "hesitat" in behavioral_cues.lower():
-        empathy_adaptations += """
-        EMBARRASSMENT/HESITATION DETECTED - Empathetic Adaptations:
-        - Normalize their experience: "This is very common, and there's nothing to be embarrassed about"
-        - Create safe space: "Everything we discuss is confidential"
-        - Use gentle, non-judgmental language
-        - Thank them for sharing: "I appreciate you telling me about this"
-        """
-
-    if "minimiz" in behavioral_cues.lower() or "tough" in behavioral_cues.lower():
-        empathy_adaptations += """
-        STOICISM/MINIMIZATION DETECTED - Empathetic Adaptations:
-        - Acknowledge their strength: "I can see you're someone who handles things well"
-        - Respect their perspective: "I understand you don't like to make a big deal of things"
-        - Frame health-seeking as strength: "Taking care of this shows good judgment"
-        - Be direct and practical in your approach
-        """
-
-    if "confus" in behavioral_cues.lower() or "uncertain" in behavioral_cues.lower():
-        empathy_adaptations += """
-        CONFUSION/UNCERTAINTY DETECTED - Empathetic Adaptations:
-        - Show patience: "Take your time, there's no rush"
-        - Normalize confusion: "It's completely normal to have trouble remembering exact timelines"
-        - Break down questions into smaller parts
-        - Offer gentle guidance: "Let's start with what you remember most clearly"
-        """
-
-    if "story" in behavioral_cues.lower() or "detail" in behavioral_cues.lower():
-        empathy_adaptations += """
-        STORYTELLING/DETAIL-SHARING DETECTED - Empathetic Adaptations:
-        - Show appreciation for context: "Thank you for giving me that background"
-        - Gently redirect when needed: "That's helpful context. Let me ask specifically about..."
-        - Acknowledge family/social connections they mention
-        - Validate their need to provide context
-        """
-
-    if "family" in behavioral_cues.lower() or "pressure" in behavioral_cues.lower():
-        empathy_adaptations += """
-        FAMILY PRESSURE/CAREGIVER STRESS DETECTED - Empathetic Adaptations:
-        - Acknowledge family concerns: "I can see your family is worried about you"
-        - Validate caregiving burden: "It sounds like you have a lot of responsibility"
-        - Include family perspective when appropriate
-        - Address both patient and family needs
-        """
-
-    combined_prompt = f"""
-    {base_empathy_instructions}
-    
-    CURRENT STAGE: {turn_stage.upper()}
-    {stage_specific_guidance[turn_stage]}
-    
-    {empathy_adaptations if empathy_adaptations else "Use standard empathetic communication approaches."}
-    
-    COMMUNICATION GUIDELINES:
-    - Ask ONE clear question at a time
-    - Include empathetic acknowledgment before your question
-    - Use warm, professional language
-    - Show genuine interest in the patient as a person
-    - Validate their experience before seeking more information
-    
-    {base_role}
-    """
-
-    return combined_prompt
-
-
 def generate_patient_prompt_modifiers(behavior_config, is_initial=True):
     """Generate prompt modifiers based on selected patient behavior"""
     modifiers = behavior_config.get("modifiers", [])
@@ -2273,6 +2143,8 @@ class RoleResponder:
             },
         ]
         response = client.chat.completions.create(model=model, messages=messages)
+        if response.usage is not None:
+            record_session_tokens(response.usage.total_tokens)
         return response.choices[0].message.content.strip()
 
 
@@ -2284,27 +2156,18 @@ summarizer = RoleResponder(
 
 diagnoser = RoleResponder("You are a board-certified diagnostician.")
 
+# === Stopping policy (a fresh one per vignette) ===
+# Honors END from turn 15 on, stops earlier once the differential has
+# converged, and hard-caps each interview at 30 turns / 150k tokens.
+make_stopping_policy = partial(
+    DifferentialConvergencePolicy, min_turns=15, max_turns=30, max_tokens=150000
+)
+
 # === Store all transcripts ===
-summarizer_outputs = []
-diagnosing_doctor_outputs = []
-questioning_doctor_outputs = []
-patient_response = []
-conversation = []
-behavioral_analyses = []
-patient_interpretations = []
 
 
 def run_vignette_task(args):
     idx, vignette_text, disease = args
-    global conversation, patient_response, summarizer_outputs, diagnosing_doctor_outputs, questioning_doctor_outputs, treatment_plans, behavioral_analyses
-    conversation = []
-    patient_response = []
-    summarizer_outputs = []
-    diagnosing_doctor_outputs = []
-    questioning_doctor_outputs = []
-    treatment_plans = []
-    behavioral_analyses = []
-    patient_interpretations = []
     return process_vignette(idx, vignette_text, disease)
 
 
@@ -2325,73 +2188,28 @@ if __name__ == "__main__":
             shutil.rmtree(directory)
         os.makedirs(directory, exist_ok=True)
 
-    # Load the JSON file with improved structure handling
-    with open(
-        "new_data_gen/actual_data_gen/medical_vignettes_100_diseases.json",
-        "r",
-    ) as f:
-        data = json.load(f)
-
-    flattened_vignettes = []
-
-    # Check the structure of your JSON file
-    print(
-        "JSON keys:",
-        list(data.keys()) if isinstance(data, dict) else f"Type: {type(data)}",
+    # Streamed (disease, vignette) pairs, whatever the file's layout; the
+    # first vignette starts while the file is still being read
+    vignettes = iter_vignettes(
+        "new_data_gen/actual_data_gen/medical_vignettes_100_diseases.json"
     )
 
-    # Handle both possible structures
-    if "vignettes" in data:
-        # Structure like: {"metadata": {...}, "vignettes": {"Disease": [vignettes...]}}
-        vignette_dict = data["vignettes"]
-        for disease, vignettes in vignette_dict.items():
-            # Only process if we have a list of vignettes
-            if not isinstance(vignettes, list):
-                continue
-            for vignette in vignettes:
-                flattened_vignettes.append((disease, vignette))
-
-    elif isinstance(data, dict):
-        # Direct structure: {"Disease": [vignettes...]}
-        for disease, vignettes in data.items():
-            # Skip metadata if it exists
-            if disease == "metadata":
-                continue
-            # Only process if we have a list of vignettes
-            if not isinstance(vignettes, list):
-                continue
-            for vignette in vignettes:
-                flattened_vignettes.append((disease, vignette))
-
-    elif isinstance(data, list):
-        # List structure: [{"disease": "...", "vignette": "..."}, ...]
-        for item in data:
-            if isinstance(item, dict) and "disease" in item and "vignette" in item:
-                flattened_vignettes.append((item["disease"], item["vignette"]))
-            elif (
-                isinstance(item, dict)
-                and "gold_diagnosis" in item
-                and "vignette" in item
-            ):
-                flattened_vignettes.append((item["gold_diagnosis"], item["vignette"]))
-
-    else:
-        raise ValueError(f"Unexpected JSON structure. Top level is: {type(data)}")
-
-    print(f"Loaded {len(flattened_vignettes)} total vignettes")
-    if flattened_vignettes:
-        print(
-            f"First example: Disease='{flattened_vignettes[0][0]}', Vignette preview: '{flattened_vignettes[0][1][:100]}...'"
-        )
-
-    # Launch multiprocessing pool with 1 worker
-    with multiprocessing.Pool(processes=1) as pool:
-        results = pool.map(
-            run_vignette_task,
-            [
-                (idx, vignette_text, disease)
-                for idx, (disease, vignette_text) in enumerate(flattened_vignettes)
-            ],
+    # Each vignette owns its outputs (VignetteSession), so they can share one
+    # process and one OpenAI client across worker threads
+    # bounded_map keeps ~2 tasks per worker in flight instead of reading
+    # every vignette up front
+    max_workers = 1
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(
+            bounded_map(
+                executor,
+                run_vignette_task,
+                (
+                    (idx, vignette_text, disease)
+                    for idx, (disease, vignette_text) in enumerate(vignettes)
+                ),
+                window=2 * max_workers,
+            )
         )
 
     # Aggregate and save all results to JSON
@@ -2426,6 +2244,10 @@ if __name__ == "__main__":
         json.dump(all_behavior_metadata, f, indent=2)
     with open("2behavioral_analyses.json", "w") as f:
         json.dump(all_behavioral_analyses, f, indent=2)
+    write_conversations(
+        "2conversations.parquet",
+        (row for result in results for row in session_rows(result)),
+    )
 
     print(
         "\n✅ All role outputs saved with gold diagnosis guidance and empathetic behavioral adaptations."
@@ -0,0 +1,146 @@
+"""
+Streaming readers for the roleplay-script and vignette files.
+
+Items are yielded one at a time so generation can start on the first script
+while the rest of the file is still being read:
+
+  - *.jsonl: the append-only log generate_vignettes3.py writes next to
+    patient_roleplay_scripts.json, read line by line;
+  - *.json: parsed incrementally with ijson when it is installed (one
+    disease's scripts in memory at a time), otherwise with json.load.
+
+bounded_map() hands such a stream to an executor without draining it:
+Executor.map and Pool.imap both read the whole iterable up front.
+"""
+
+import json
+from collections import deque
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def _json_items(path, prefix):
+    """(key, value) pairs of the object at `prefix` ("" = top level)"""
+    if ijson is not None:
+        with open(path, "rb") as f:
+            yield from ijson.kvitems(f, prefix, use_float=True)
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    yield from (data.get(prefix, {}) if prefix else data).items()
+
+
+def _first_char(path):
+    with open(path, "r", encoding="utf-8") as f:
+        while True:
+            ch = f.read(1)
+            if not ch or not ch.isspace():
+                return ch
+
+
+def _script_records(path):
+    """(disease, script record) pairs from a roleplay-script JSON or JSONL file"""
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn last line of an interrupted run
+                if "error" not in record:
+                    yield record["disease_name"], record
+        return
+
+    found = False
+    for disease, scripts in _json_items(path, "roleplay_scripts"):
+        found = True
+        if isinstance(scripts, list):
+            for script in scripts:
+                yield disease, script
+    if not found:
+        raise ValueError(f"Expected 'roleplay_scripts' key in JSON structure of {path}")
+
+
+def iter_roleplay_scripts(path, desired_types=None, per_disease=None):
+    """
+    Yield (disease, roleplay script text) from patient_roleplay_scripts.json
+    (or its .jsonl log).
+
+    desired_types keeps only those variation types (scripts without one are
+    kept); per_disease caps how many scripts each disease contributes.
+    """
+    taken = {}
+    for disease, script in _script_records(path):
+        if isinstance(script, dict):
+            variation_type = script.get("variation_type")
+            if desired_types and variation_type is not None and variation_type not in desired_types:
+                continue
+            text = script.get("roleplay_script", str(script))
+        else:
+            text = str(script)
+
+        if per_disease is not None:
+            if taken.get(disease, 0) >= per_disease:
+                continue
+            taken[disease] = taken.get(disease, 0) + 1
+        yield disease, text
+
+
+def iter_vignettes(path):
+    """
+    Yield (disease, vignette) from a vignette file in any of its layouts:
+    {"metadata": ..., "vignettes": {disease: [...]}}, {disease: [...]}, or
+    [{"disease" | "gold_diagnosis": ..., "vignette": ...}, ...].
+    """
+    if _first_char(path) == "[":
+        if ijson is not None:
+            with open(path, "rb") as f:
+                yield from _list_vignettes(ijson.items(f, "item", use_float=True))
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                yield from _list_vignettes(json.load(f))
+        return
+
+    found = False
+    for disease, vignettes in _json_items(path, "vignettes"):
+        found = True
+        yield from _disease_vignettes(disease, vignettes)
+    if not found:
+        # No "vignettes" wrapper: diseases are the top-level keys
+        for disease, vignettes in _json_items(path, ""):
+            if disease != "metadata":
+                yield from _disease_vignettes(disease, vignettes)
+
+
+def _disease_vignettes(disease, vignettes):
+    if isinstance(vignettes, list):
+        for vignette in vignettes:
+            yield disease, vignette
+
+
+def _list_vignettes(items):
+    for item in items:
+        if not isinstance(item, dict) or "vignette" not in item:
+            continue
+        if "disease" in item:
+            yield item["disease"], item["vignette"]
+        elif "gold_diagnosis" in item:
+            yield item["gold_diagnosis"], item["vignette"]
+
+
+def bounded_map(executor, fn, items, window):
+    """
+    Ordered executor.map(fn, items) with at most `window` items submitted
+    but not yet yielded, so items are read from the iterator only as
+    results are consumed.
+    """
+    pending = deque()
+    for item in items:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(fn, item))
+    while pending:
+        yield pending.popleft().result()
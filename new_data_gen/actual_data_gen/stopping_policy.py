@@ -0,0 +1,146 @@
+import re
+from collections import namedtuple
+
+# Word-bounded, so RECOMMEND / ENDOCRINE / "endometriosis" don't count as END
+END_RE = re.compile(r"\bEND\b")
+# Items start a line ("1. ...", "**2. ...") so "3.5 days" or "2. times daily"
+# inside a justification are not read as diagnoses
+DIFFERENTIAL_ITEM_RE = re.compile(
+    r"^[\s*#-]*\d+\.(?!\d)\s*(Diagnosis:)?\s*([^\n]+?)(?:\s*Justification|$)", re.IGNORECASE | re.MULTILINE
+)
+LABEL_PREFIX_RE = re.compile(r"^(Diagnosis:?|Condition:?)\s*", re.IGNORECASE)
+
+StopDecision = namedtuple("StopDecision", "stop reason confidence")
+
+
+def normalize_diagnosis(name):
+    """Lowercase, strip markdown/punctuation and a trailing END marker"""
+    name = END_RE.sub("", LABEL_PREFIX_RE.sub("", name.strip()))
+    return " ".join(re.sub(r"[^\w\s'-]", " ", name.lower()).split())
+
+
+def answer_section(diagnosis_text):
+    """Text after ANSWER: (the whole text if the THINKING part was already stripped)"""
+    return diagnosis_text.split("ANSWER:", 1)[-1]
+
+
+def parse_differential(diagnosis_text):
+    """
+    Ranked diagnosis names from a diagnoser output.
+
+    Early/middle answers are numbered lists ("1. Diagnosis: X ..."); the
+    late-stage answer is a single name, optionally followed by END.
+    """
+    diagnosis_text = answer_section(diagnosis_text).strip()
+    items = DIFFERENTIAL_ITEM_RE.findall(diagnosis_text)
+    if any(label for label, _ in items):
+        # Labelled list: a numbered line without "Diagnosis:" is a wrapped justification
+        items = [item for item in items if item[0]]
+    names = [normalize_diagnosis(name) for _, name in items]
+    if not names:
+        names = [normalize_diagnosis(line) for line in diagnosis_text.splitlines()[:1]]
+    return [name for name in names if name]
+
+
+def same_diagnosis(a, b):
+    """Fuzzy match: identical, or most of the shorter name's words shared"""
+    if a == b:
+        return True
+    a_words, b_words = set(a.split()), set(b.split())
+    if not a_words or not b_words:
+        return False
+    return len(a_words & b_words) >= 0.7 * min(len(a_words), len(b_words))
+
+
+def list_overlap(current, previous):
+    """Share of the current top-k that also appears in the previous top-k"""
+    if not current or not previous:
+        return 0.0
+    matched = sum(1 for a in current if any(same_diagnosis(a, b) for b in previous))
+    return matched / len(current)
+
+
+class StoppingPolicy:
+    """
+    Decides after each diagnosis whether the interview should stop.
+
+    observe() is called once per loop iteration with the turn count, the
+    diagnoser's answer and the tokens the vignette has used so far, and
+    returns a StopDecision(stop, reason, confidence). Subclasses keep
+    whatever per-vignette state they need, so create one per vignette.
+    An END from the diagnoser before `min_turns` is ignored.
+    """
+
+    min_turns = 0
+
+    def observe(self, turn_count, diagnosis, tokens_used=0):
+        raise NotImplementedError
+
+
+class EndMarkerPolicy(StoppingPolicy):
+    """The original behaviour: stop when the diagnoser says END after min_turns"""
+
+    def __init__(self, min_turns=8):
+        self.min_turns = min_turns
+
+    def observe(self, turn_count, diagnosis, tokens_used=0):
+        if END_RE.search(answer_section(diagnosis)) and turn_count >= self.min_turns:
+            return StopDecision(True, "end_marker", 1.0)
+        return StopDecision(False, None, 0.0)
+
+
+class DifferentialConvergencePolicy(StoppingPolicy):
+    """
+    Stop once further questioning stops changing the differential.
+
+    Confidence mixes two signals over the last `patience` diagnoses:
+      - top-1 stability: how many of them keep the current leading diagnosis;
+      - list convergence: overlap of the current top-k with the previous one
+        (skipped once the diagnoser narrows to a single late-stage answer).
+    The interview stops when confidence reaches `threshold` (or the
+    diagnoser says END, if `honor_end`) after `min_turns`, and always at
+    the `max_turns` / `max_tokens` hard caps.
+    """
+
+    def __init__(self, min_turns=8, max_turns=20, max_tokens=None, patience=2,
+                 threshold=0.8, top_k=5, stability_weight=0.6, honor_end=True):
+        self.min_turns = min_turns
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.patience = patience
+        self.threshold = threshold
+        self.top_k = top_k
+        self.stability_weight = stability_weight
+        self.honor_end = honor_end
+        self.differentials = []
+
+    def confidence(self):
+        recent = self.differentials[-(self.patience + 1):]
+        if len(recent) <= self.patience or not recent[-1]:
+            return 0.0
+
+        leader = recent[-1][0]
+        earlier = recent[:-1]
+        stability = sum(1 for d in earlier if d and same_diagnosis(d[0], leader)) / len(earlier)
+
+        current, previous = recent[-1][:self.top_k], recent[-2][:self.top_k]
+        if len(current) == 1 or len(previous) == 1:
+            return stability
+        convergence = list_overlap(current, previous)
+        return self.stability_weight * stability + (1 - self.stability_weight) * convergence
+
+    def observe(self, turn_count, diagnosis, tokens_used=0):
+        self.differentials.append(parse_differential(diagnosis))
+        confidence = self.confidence()
+
+        if self.max_turns is not None and turn_count >= self.max_turns:
+            return StopDecision(True, "max_turns", confidence)
+        if self.max_tokens is not None and tokens_used >= self.max_tokens:
+            return StopDecision(True, "max_tokens", confidence)
+        if turn_count < self.min_turns:
+            return StopDecision(False, None, confidence)
+        if self.honor_end and END_RE.search(answer_section(diagnosis)):
+            return StopDecision(True, "end_marker", confidence)
+        if confidence >= self.threshold:
+            return StopDecision(True, "converged", confidence)
+        return StopDecision(False, None, confidence)
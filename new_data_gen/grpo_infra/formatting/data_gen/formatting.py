@@ -1,6 +1,11 @@
 from datasets import load_dataset, Dataset
 import pandas as pd
 from huggingface_hub import HfApi, login
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from format_rewards import valid_format_mask
 
 # OPTIONAL: log in to Hugging Face
 # login(token="your_huggingface_token")
@@ -17,22 +22,10 @@ filtered_dataset = raw_dataset.filter(
 )
 
 
-# Define formatting check
-def has_proper_format(row):
-    output = row["output"].strip()
-    has_thinking = "THINKING:" in output
-    has_answer = "ANSWER:" in output
-    correct_order = (
-        output.find("THINKING:") < output.find("ANSWER:")
-        if has_thinking and has_answer
-        else False
-    )
-    return has_thinking and has_answer and correct_order
-
-
-# Mark which rows are well-formatted
+# Add the format check flag (batched, single regex scan per output)
 formatted_dataset = filtered_dataset.map(
-    lambda row: {"has_correct_format": has_proper_format(row)}
+    lambda batch: {"has_correct_format": valid_format_mask(batch["output"])},
+    batched=True,
 )
 
 # Convert to pandas and keep only good rows
@@ -1,51 +1,43 @@
-from datasets import load_dataset, Dataset
-import pandas as pd
-from huggingface_hub import HfApi, login
-
-# OPTIONAL: log in to Hugging Face
-# login(token="your_huggingface_token")
-
-# Load the full dataset
-raw_dataset = load_dataset("CodCodingCode/clinical-conversations", split="train")
-
-# Remove unwanted examples
-unwanted_instruction = (
-    "You are simulating a real patient in conversation with their doctor."
-)
-filtered_dataset = raw_dataset.filter(
-    lambda row: row["instruction"].strip() != unwanted_instruction
+from datasets import load_dataset
+import pyarrow.compute as pc
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "actual_data_gen")
 )
+from format_rewards import valid_format_array
+from dataset_publish import HubTarget, LocalTarget, publish, write_shards
 
+SOURCE_REPO = "CodCodingCode/clinical-conversations"
+TARGET_REPO = "CodCodingCode/misformatted-clinical-conversations"
+UNWANTED_INSTRUCTION = "You are simulating a real patient in conversation with their doctor."
 
-# Define formatting check
-def has_proper_format(row):
-    output = row["output"].strip()
-    has_thinking = "THINKING:" in output
-    has_answer = "ANSWER:" in output
-    correct_order = (
-        output.find("THINKING:") < output.find("ANSWER:")
-        if has_thinking and has_answer
-        else False
-    )
-    return has_thinking and has_answer and correct_order
+parser = argparse.ArgumentParser(description="Publish the misformatted examples of a dataset")
+parser.add_argument("--local-dir", default="publish/misformatted-clinical-conversations")
+parser.add_argument("--target-dir", default=None, help="Publish to this directory instead of the Hub")
+parser.add_argument("--max-shard-mb", type=int, default=256)
+args = parser.parse_args()
 
+# OPTIONAL: log in to Hugging Face
+# from huggingface_hub import login; login(token="your_huggingface_token")
 
-# Add the format check flag
-formatted_dataset = filtered_dataset.map(
-    lambda row: {"has_correct_format": has_proper_format(row)}
-)
+# Load the full dataset as one (memory-mapped) Arrow table
+table = load_dataset(SOURCE_REPO, split="train").with_format("arrow")[:]
 
-# Convert to pandas and isolate the bad examples
-df_formatted = formatted_dataset.to_pandas()
-df_bad = df_formatted[df_formatted["has_correct_format"] == False].drop(
-    columns=["has_correct_format"]
-)
+# Remove unwanted examples
+is_wanted = pc.not_equal(pc.utf8_trim_whitespace(table["instruction"]), UNWANTED_INSTRUCTION)
+table = table.filter(pc.fill_null(is_wanted, True))
 
-# Convert bad examples back to Hugging Face Dataset format
-bad_hf_dataset = Dataset.from_pandas(df_bad)
+# Keep only the examples with a broken THINKING/ANSWER format
+bad_table = table.filter(pc.invert(valid_format_array(table["output"])))
 
-# Upload to the Hub (optional: change name)
-bad_hf_dataset.push_to_hub("CodCodingCode/misformatted-clinical-conversations")
+# Shard locally, then upload only the shards that changed
+write_shards(bad_table.to_batches(), args.local_dir, max_shard_bytes=args.max_shard_mb * 1024 * 1024)
+target = LocalTarget(args.target_dir) if args.target_dir else HubTarget(TARGET_REPO)
+publish(args.local_dir, target)
 
 # Confirm
-print(f"❗ Uploaded {len(df_bad)} misformatted examples to Hugging Face.")
+print(f"❗ Published {bad_table.num_rows} misformatted examples.")
@@ -0,0 +1,348 @@
+"""
+Shared THINKING:/ANSWER: parsing and format scoring, for the generators'
+RoleResponders, dataset quality checks and filtering, and GRPO rewards.
+
+Every completion is scanned once with a single precompiled regex that finds all
+THINKING:/ANSWER: markers in order; all checks (presence, count, ordering, empty
+sections) are derived from that one scan. parse_output() returns the sections
+and an error code for one text; parse_batch() computes the same over a whole
+Arrow string column with pyarrow.compute kernels. Stats are accumulated per
+batch and printed as a single aggregate line instead of one debug line per
+sample.
+"""
+
+import re
+from collections import namedtuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = pc = None
+
+# ─── Compiled markers ───────────────────────────────────────────────
+MARKER_RE = re.compile(r"(THINKING|ANSWER):")
+MARKER_RE_I = re.compile(r"(thinking|answer):", re.IGNORECASE)
+
+# Partial-credit weights; a fully valid completion always scores 1.0
+CREDIT = {
+    "has_thinking": 0.25,
+    "has_answer": 0.25,
+    "ordered": 0.25,
+    "single": 0.25,
+}
+
+# Failure codes (first failing check wins, in this order)
+OK = "ok"
+MISSING_THINKING = "missing_thinking"
+MISSING_ANSWER = "missing_answer"
+MISORDERED = "misordered"
+DUPLICATED = "duplicated"
+EMPTY_THINKING = "empty_thinking"
+EMPTY_ANSWER = "empty_answer"
+
+# Trailing commentary the generators' models append after the ANSWER
+TRAILER_PATTERN = r"(?m)^[ \t]*\*{0,2}(?:Note|Additional|Further|Recommendation):"
+TRAILER_RE = re.compile(TRAILER_PATTERN)
+ParsedOutput = namedtuple("ParsedOutput", "thinking answer code")
+
+
+def _completion_text(completion):
+    """TRL passes plain strings, or message lists for conversational datasets."""
+    if isinstance(completion, str):
+        return completion
+    if isinstance(completion, list) and completion:
+        last = completion[-1]
+        if isinstance(last, dict):
+            return last.get("content", "") or ""
+    return str(completion or "")
+
+
+def score_format(text, ignore_case=True, require_answer_text=False):
+    """
+    Score a single completion.
+
+    Returns (score, code) where score is in [0, 1] with partial credit and
+    code is one of the failure codes above (OK for a valid completion).
+    """
+    pattern = MARKER_RE_I if ignore_case else MARKER_RE
+    markers = [m.group(1).lower() for m in pattern.finditer(text)]
+
+    n_thinking = markers.count("thinking")
+    n_answer = markers.count("answer")
+    has_thinking = n_thinking > 0
+    has_answer = n_answer > 0
+    ordered = has_thinking and has_answer and markers.index("thinking") < markers.index("answer")
+    single = n_thinking <= 1 and n_answer <= 1
+
+    score = (
+        CREDIT["has_thinking"] * has_thinking
+        + CREDIT["has_answer"] * has_answer
+        + CREDIT["ordered"] * ordered
+        + CREDIT["single"] * (single and (has_thinking or has_answer))
+    )
+
+    if not has_thinking:
+        code = MISSING_THINKING
+    elif not has_answer:
+        code = MISSING_ANSWER
+    elif not ordered:
+        code = MISORDERED
+    elif not single:
+        code = DUPLICATED
+    else:
+        code = OK
+        if require_answer_text:
+            answer_body = pattern.split(text)[-1]
+            if not answer_body.strip():
+                code = EMPTY_ANSWER
+                score -= CREDIT["single"]
+
+    return score, code
+
+
+def strip_trailers(text):
+    """Text up to the first trailing "Note:" / "Recommendation:"-style line"""
+    trailer = TRAILER_RE.search(text)
+    return text[:trailer.start()] if trailer else text
+
+
+def parse_output(text, ignore_case=False, cut_trailers=False):
+    """
+    Parse one THINKING:/ANSWER: output into ParsedOutput(thinking, answer, code).
+
+    thinking is the text between the first THINKING: and the first ANSWER:
+    after it, answer the text from there to the next marker (or the end),
+    both stripped; both are None when no THINKING: is followed by an
+    ANSWER:. code is the first failing check (missing, misordered,
+    duplicated, empty section) or OK. cut_trailers drops everything from a
+    "Note:" / "Recommendation:"-style line on.
+    """
+    text = text or ""
+    if cut_trailers:
+        text = strip_trailers(text)
+
+    pattern = MARKER_RE_I if ignore_case else MARKER_RE
+    markers = [(m.group(1).lower(), m.start(), m.end()) for m in pattern.finditer(text)]
+    kinds = [kind for kind, _, _ in markers]
+
+    thinking = answer = None
+    if "thinking" in kinds:
+        t = kinds.index("thinking")
+        a = next((i for i in range(t + 1, len(kinds)) if kinds[i] == "answer"), None)
+        if a is not None:
+            thinking = text[markers[t][2]:markers[a][1]].strip()
+            end = markers[a + 1][1] if a + 1 < len(markers) else len(text)
+            answer = text[markers[a][2]:end].strip()
+
+    if "thinking" not in kinds:
+        code = MISSING_THINKING
+    elif "answer" not in kinds:
+        code = MISSING_ANSWER
+    elif kinds.index("answer") < kinds.index("thinking"):
+        code = MISORDERED
+    elif kinds.count("thinking") > 1 or kinds.count("answer") > 1:
+        code = DUPLICATED
+    elif not thinking:
+        code = EMPTY_THINKING
+    elif not answer:
+        code = EMPTY_ANSWER
+    else:
+        code = OK
+    return ParsedOutput(thinking, answer, code)
+
+
+def format_output(thinking, answer):
+    """The canonical two-section layout"""
+    return f"THINKING: {thinking}\nANSWER: {answer}"
+
+
+def parse_batch(texts, ignore_case=False, cut_trailers=False):
+    """
+    parse_output over a whole column: a pyarrow Table with thinking, answer
+    and code columns, one row per text (nulls parse as empty strings).
+    """
+    if pc is None:
+        raise ImportError("pyarrow is required for parse_batch")
+    if isinstance(texts, pa.ChunkedArray):
+        texts = texts.combine_chunks()
+    elif not isinstance(texts, pa.Array):
+        texts = pa.array(texts, pa.string())
+    texts = pc.fill_null(texts, "")
+    if cut_trailers:
+        texts = pc.replace_substring_regex(texts, TRAILER_PATTERN + "(?s:.*)", "", max_replacements=1)
+
+    n_thinking = pc.count_substring(texts, "THINKING:", ignore_case=ignore_case)
+    n_answer = pc.count_substring(texts, "ANSWER:", ignore_case=ignore_case)
+    first_thinking = pc.find_substring(texts, "THINKING:", ignore_case=ignore_case)
+    first_answer = pc.find_substring(texts, "ANSWER:", ignore_case=ignore_case)
+
+    # Same sections as parse_output, by splitting at markers (much faster than
+    # a capturing regex): first THINKING:, first ANSWER: after it, next marker
+    _, after_thinking = _split_once(texts, "THINKING:", ignore_case)
+    thinking, after_answer = _split_once(pc.fill_null(after_thinking, ""), "ANSWER:", ignore_case)
+    answer, _ = _split_once(pc.fill_null(after_answer, ""), "THINKING:", ignore_case)
+    answer, _ = _split_once(answer, "ANSWER:", ignore_case)
+    has_sections = pc.is_valid(after_answer)
+    missing = pa.scalar(None, pa.string())
+    thinking = pc.if_else(has_sections, pc.utf8_trim_whitespace(thinking), missing)
+    answer = pc.if_else(has_sections, pc.utf8_trim_whitespace(answer), missing)
+
+    checks = [
+        (MISSING_THINKING, pc.equal(n_thinking, 0)),
+        (MISSING_ANSWER, pc.equal(n_answer, 0)),
+        (MISORDERED, pc.less(first_answer, first_thinking)),
+        (DUPLICATED, pc.or_(pc.greater(n_thinking, 1), pc.greater(n_answer, 1))),
+        (EMPTY_THINKING, pc.equal(thinking, "")),
+        (EMPTY_ANSWER, pc.equal(answer, "")),
+    ]
+    conditions = pc.make_struct(
+        *(pc.fill_null(condition, False) for _, condition in checks),
+        field_names=[code for code, _ in checks],
+    )
+    code = pc.case_when(conditions, *(code for code, _ in checks), OK)
+    return pa.table({"thinking": thinking, "answer": answer, "code": code})
+
+
+def _split_once(texts, marker, ignore_case):
+    """(text before, text after) the first marker; after is null where it is absent"""
+    if ignore_case:
+        parts = pc.split_pattern_regex(texts, "(?i)" + re.escape(marker), max_splits=1)
+    else:
+        parts = pc.split_pattern(texts, marker, max_splits=1)
+    pairs = pc.list_flatten(pc.list_slice(parts, 0, 2, return_fixed_size_list=True))
+    return pairs[0::2], pairs[1::2]
+
+
+def labeled_segments(text, labels):
+    """
+    [(label, value), ...] for "LABEL: value" fields in text, in order, in
+    one scan; values run to the next label, text before the first one is
+    returned with label None. Works for one-field-per-line and single-line
+    layouts alike.
+    """
+    label_re = _label_re(tuple(labels))
+    segments = []
+    label, start = None, 0
+    for match in label_re.finditer(text):
+        segments.append((label, text[start:match.start()].strip()))
+        label, start = match.group(1), match.end()
+    segments.append((label, text[start:].strip()))
+    return [(label, value) for label, value in segments if label or value]
+
+
+_LABEL_RES = {}
+
+
+def _label_re(labels):
+    if labels not in _LABEL_RES:
+        _LABEL_RES[labels] = re.compile(r"\b(" + "|".join(map(re.escape, labels)) + r"):")
+    return _LABEL_RES[labels]
+
+
+def has_valid_format(text, ignore_case=False, strict=False):
+    """
+    Boolean check used for dataset filtering (THINKING: ... ANSWER: ...).
+
+    strict=False keeps the original filter semantics, where repeated markers
+    are tolerated as long as the first THINKING: precedes the first ANSWER:.
+    """
+    code = score_format(text.strip(), ignore_case=ignore_case)[1]
+    return code == OK or (not strict and code == DUPLICATED)
+
+
+def valid_format_mask(texts, ignore_case=False, strict=False):
+    """Batched has_valid_format, for `Dataset.filter(..., batched=True)`."""
+    return [has_valid_format(text, ignore_case=ignore_case, strict=strict) for text in texts]
+
+
+def valid_format_array(texts):
+    """
+    has_valid_format (default, non-strict) over a whole Arrow string array:
+    the first THINKING: must come before the first ANSWER:. Nulls are invalid.
+    """
+    thinking = pc.find_substring(texts, "THINKING:")
+    answer = pc.find_substring(texts, "ANSWER:")
+    valid = pc.and_(pc.greater_equal(thinking, 0), pc.greater(answer, thinking))
+    return pc.fill_null(valid, False)
+
+
+class FormatStats:
+    """Running aggregate of format scores, printed once per `log_every` batches."""
+
+    def __init__(self, name="reward", log_every=1):
+        self.name = name
+        self.log_every = log_every
+        self.batches = 0
+        self.reset()
+
+    def reset(self):
+        self.total = 0
+        self.score_sum = 0.0
+        self.codes = {}
+
+    def update(self, scores, codes):
+        self.total += len(scores)
+        self.score_sum += sum(scores)
+        for code in codes:
+            self.codes[code] = self.codes.get(code, 0) + 1
+        self.batches += 1
+        if self.log_every and self.batches % self.log_every == 0:
+            self.log()
+            self.reset()
+
+    def log(self):
+        if not self.total:
+            return
+        valid = self.codes.get(OK, 0)
+        failures = ", ".join(
+            f"{code}={count}" for code, count in sorted(self.codes.items()) if code != OK
+        )
+        print(
+            f"[{self.name}] n={self.total} valid={valid}/{self.total} "
+            f"({valid / self.total * 100:.1f}%) mean={self.score_sum / self.total:.3f}"
+            + (f" | {failures}" if failures else "")
+        )
+
+
+def score_batch(completions, ignore_case=True, partial_credit=True, require_answer_text=False, stats=None):
+    """
+    Score a batch of completions, one marker scan per row (a plain loop;
+    parse_batch is the Arrow-kernel path for whole columns), and record
+    the batch in `stats`.
+
+    With partial_credit=False the result is binary (1.0 valid / 0.0 otherwise),
+    matching the original binary format reward.
+    """
+    scores = []
+    codes = []
+    for completion in completions:
+        score, code = score_format(
+            _completion_text(completion).strip(),
+            ignore_case=ignore_case,
+            require_answer_text=require_answer_text,
+        )
+        if not partial_credit:
+            score = 1.0 if code == OK else 0.0
+        scores.append(score)
+        codes.append(code)
+
+    if stats is not None:
+        stats.update(scores, codes)
+    return scores, codes
+
+
+def make_thinking_answer_reward(partial_credit=True, ignore_case=True, log_every=10):
+    """Build a TRL-compatible reward function with its own aggregate stats."""
+    stats = FormatStats(name="reward", log_every=log_every)
+
+    def thinking_answer_reward(prompts, completions, **kwargs):
+        scores, _ = score_batch(
+            completions,
+            ignore_case=ignore_case,
+            partial_credit=partial_credit,
+            stats=stats,
+        )
+        return scores
+
+    return thinking_answer_reward
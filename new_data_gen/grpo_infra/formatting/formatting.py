@@ -5,6 +5,8 @@ from datasets import load_dataset
 from transformers import AutoTokenizer, AutoModelForCausalLM
 from trl import GRPOConfig, GRPOTrainer
 
+from format_rewards import make_thinking_answer_reward
+
 # 1. Load base model & tokenizer
 model_name = "CodCodingCode/llama-3.1-8b-clinical"
 tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=False)
@@ -35,18 +37,8 @@ tokenized = prompt_ds.map(
     remove_columns=["prompt"],
 )
 
-# 5. Define your THINKING/ANSWER reward fn
-def thinking_answer_reward(prompts, completions, **kwargs):
-    rewards = []
-    for text in completions:
-        t = text.strip().lower()
-        ok = (
-            t.count("thinking:") == 1 and
-            t.count("answer:")   == 1 and
-            t.find("thinking:") < t.find("answer:")
-        )
-        rewards.append(1.0 if ok else 0.0)
-    return rewards
+# 5. Define your THINKING/ANSWER reward fn (binary, as before)
+thinking_answer_reward = make_thinking_answer_reward(partial_credit=False)
 
 # 6. Configure GRPO
 config = GRPOConfig(
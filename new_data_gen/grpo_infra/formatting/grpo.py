@@ -6,6 +6,8 @@ from transformers import AutoTokenizer, AutoModelForCausalLM
 from trl import GRPOConfig, GRPOTrainer
 import torch
 
+from format_rewards import make_thinking_answer_reward
+
 # ─── 0. HF TOKEN ─────────────────────────────────────────────────
 HF_TOKEN = os.getenv("HUGGINGFACE_HUB_TOKEN")
 print("[debug] HF_TOKEN:", HF_TOKEN[:8] + "…" if HF_TOKEN else None)
@@ -92,22 +94,8 @@ print(
 
 
 # ─── 6. Define your thinking:/answer reward fn ────────────────────
-def thinking_answer_reward(prompts, completions, **kwargs):
-    rewards = []
-    for idx, text in enumerate(completions):
-        t = text.strip().lower()
-        ok = (
-            t.count("thinking:") == 1
-            and t.count("answer:") == 1
-            and t.find("thinking:") < t.find("answer:")
-        )
-        score = 1.0 if ok else 0.0
-        print(
-            f"[debug reward] #{idx} → thinking_count,answer_count,order ="
-            f" {t.count('thinking:')}, {t.count('answer:')}, {t.find('thinking:') < t.find('answer:')} => {score}"
-        )
-        rewards.append(score)
-    return rewards
+# Graded partial credit; aggregate stats are printed every 10 reward batches
+thinking_answer_reward = make_thinking_answer_reward(partial_credit=True, log_every=10)
 
 
 # ─── 7. Configure GRPO ───────────────────────────────────────────
@@ -0,0 +1,173 @@
+"""
+Structured-output (JSON schema) mode for the generators' agent roles.
+
+A role opted in through STRUCTURED_ROLES (e.g. STRUCTURED_ROLES=patient,
+diagnoser,test_questioner) asks the API for strict JSON matching its schema
+instead of free THINKING:/ANSWER: text, so there is no format to repair and
+nothing to retry. The reply is still validated locally, and rendered back
+to the usual ANSWER layout so stored outputs and downstream parsing do not
+change:
+
+    spec = role_schema("test_questioner")
+    fields, errors = parse_structured(content, spec)
+    answer = spec.render(fields)   # "TEST_REQUEST: Yes\nREQUESTED_TEST: ...\nQUESTION: ..."
+"""
+
+import os
+import json
+from collections import namedtuple
+
+RoleSchema = namedtuple("RoleSchema", "name schema render")
+
+# Replaces the THINKING/ANSWER format requirement in structured mode
+STRUCTURED_INSTRUCTION = """
+
+        Respond with a JSON object matching the provided schema. Put your
+        step-by-step reasoning in "thinking" and your actual response in the
+        remaining fields.
+        """
+
+THINKING = {"type": "string", "description": "Your reasoning"}
+
+
+def _object(**properties):
+    """Strict-mode object schema: every property required, nothing extra"""
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+def _render_test_request(fields):
+    return (
+        f"TEST_REQUEST: {'Yes' if fields['test_request'] else 'No'}\n"
+        f"REQUESTED_TEST: {fields['requested_test'] or 'None'}\n"
+        f"QUESTION: {fields['question']}"
+    )
+
+
+def _render_differential(fields):
+    lines = []
+    for i, item in enumerate(fields["diagnoses"], 1):
+        lines.append(f"{i}. Diagnosis: {item['diagnosis']}")
+        lines.append(f"Justification: {item['justification']}")
+    if fields["end"]:
+        lines.append("END")
+    return "\n".join(lines)
+
+
+ROLE_SCHEMAS = {
+    spec.name: spec
+    for spec in (
+        RoleSchema(
+            "answer",
+            _object(thinking=THINKING, answer={"type": "string"}),
+            lambda fields: fields["answer"],
+        ),
+        RoleSchema(
+            "patient",
+            _object(thinking=THINKING, answer={"type": "string", "description": "What the patient says"}),
+            lambda fields: fields["answer"],
+        ),
+        RoleSchema(
+            "questioner",
+            _object(thinking=THINKING, question={"type": "string"}),
+            lambda fields: fields["question"],
+        ),
+        RoleSchema(
+            "test_questioner",
+            _object(
+                thinking=THINKING,
+                test_request={"type": "boolean", "description": "Order a diagnostic test instead of asking"},
+                requested_test={"type": "string", "description": 'Name of the test, or "None"'},
+                question={"type": "string", "description": "The question, or a sentence explaining the test"},
+            ),
+            _render_test_request,
+        ),
+        RoleSchema(
+            "diagnoser",
+            _object(
+                thinking=THINKING,
+                diagnoses={
+                    "type": "array",
+                    "minItems": 1,
+                    "items": _object(diagnosis={"type": "string"}, justification={"type": "string"}),
+                },
+                end={"type": "boolean", "description": "True when no more questioning is necessary"},
+            ),
+            _render_differential,
+        ),
+    )
+}
+
+STRUCTURED_ROLES = set(filter(None, os.getenv("STRUCTURED_ROLES", "").split(",")))
+
+
+def role_schema(role):
+    """The role's RoleSchema if it is opted in to structured output, else None"""
+    return ROLE_SCHEMAS[role] if role in STRUCTURED_ROLES else None
+
+
+def response_format(spec):
+    """response_format argument for chat.completions.create"""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": spec.name, "strict": True, "schema": spec.schema},
+    }
+
+
+JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "integer": int,
+    "number": (int, float),
+    "null": type(None),
+}
+
+
+def validate(value, schema, path="$"):
+    """Errors of value against the JSON-schema subset the role schemas use"""
+    expected = schema.get("type")
+    if expected is not None:
+        types = expected if isinstance(expected, list) else [expected]
+        is_bool = isinstance(value, bool)
+        if not any(
+            isinstance(value, JSON_TYPES[t]) and (t == "boolean" or not is_bool) for t in types
+        ):
+            return [f"{path}: expected {expected}, got {type(value).__name__}"]
+
+    errors = []
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: {value!r} not in {schema['enum']}")
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        errors += [f"{path}: missing {key!r}" for key in schema.get("required", []) if key not in value]
+        if schema.get("additionalProperties") is False:
+            errors += [f"{path}: unexpected {key!r}" for key in value if key not in properties]
+        for key, subschema in properties.items():
+            if key in value:
+                errors += validate(value[key], subschema, f"{path}.{key}")
+    elif isinstance(value, list):
+        if len(value) < schema.get("minItems", 0):
+            errors.append(f"{path}: fewer than {schema['minItems']} items")
+        for i, item in enumerate(value):
+            errors += validate(item, schema.get("items", {}), f"{path}[{i}]")
+    return errors
+
+
+def parse_structured(content, spec):
+    """(fields, errors) for a structured reply; fields is None when it is unusable"""
+    if not content:
+        return None, ["empty or refused response"]
+    try:
+        fields = json.loads(content)
+    except json.JSONDecodeError as e:
+        return None, [f"invalid JSON: {e}"]
+    errors = validate(fields, spec.schema)
+    if not errors and not str(fields.get("thinking", "")).strip():
+        errors.append("$.thinking: empty")
+    return (None if errors else fields), errors
@@ -1,4 +1,6 @@
 import os
+import re
+import sys
 import json
 from openai import OpenAI
 import time
@@ -31,6 +33,12 @@ from prompts import (
     MODIFIED_QUESTION_GENERATION_PROMPT,
 )
 
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "new_data_gen", "grpo_infra", "formatting")
+)
+from format_rewards import format_output, labeled_segments, parse_output
+from structured_output import STRUCTURED_INSTRUCTION, parse_structured, response_format, role_schema
+
 # Initialize OpenAI client
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 model = "gpt-4.1-nano"
@@ -184,184 +192,85 @@ def calculate_accuracy_score(found, position, total_predictions):
 
 
 # === ROBUST TEST REQUEST PARSING ===
+QUESTIONER_FIELDS = ("TEST_REQUEST", "REQUESTED_TEST", "QUESTION")
+YES_VALUES = ("yes", "true", "1")
+# Test cues in the THINKING section / in the question itself
+# Whole words only (both ends bounded): "labor", "testimony" or "scant" are not cues
+THINKING_TEST_RE = re.compile(
+    r"\b(?:diagnostic testing|testing would be|test would be|examinations?|fluorescein"
+    r"|slit-lamp|ct scans?|mri|ultrasounds?|blood tests?|cultures?|biops(?:y|ies))\b"
+)
+QUESTION_TEST_RE = re.compile(
+    r"\b(?:examinations?|tests?|scans?|imaging|labs?|cultures?|fluorescein|slit[- ]lamp|ct|mri"
+    r"|ultrasounds?|blood ?work)\b"
+)
+# First cue found in the response names the requested test
+TEST_NAME_PATTERNS = {
+    "fluorescein": "Fluorescein staining",
+    "slit-lamp": "Slit-lamp examination",
+    "slit lamp": "Slit-lamp examination",
+    "ct scan": "CT scan",
+    "mri": "MRI",
+    "ultrasound": "Ultrasound",
+    "culture": "Culture",
+    "blood test": "Blood test",
+    "examination": "Physical examination",
+}
+
+
 def parse_questioner_response_robust(response_text):
     """
-    Robust parser that handles multiple test request formats and patterns
+    (test_request, requested_test, question) from a questioner response.
+
+    TEST_REQUEST / REQUESTED_TEST / QUESTION fields are read in one scan
+    (one per line or all on one line); without an explicit request, test
+    cues in the THINKING section or the question still flag one.
     """
-    
-    # Initialize defaults
-    test_request = False
-    requested_test = "None"
-    question = response_text.strip()
-    
-    print(f"\n🔍 PARSING QUESTIONER RESPONSE:")
-    print(f"Input length: {len(response_text)} chars")
-    print(f"First 300 chars: {response_text[:300]}...")
-    
-    try:
-        # Method 1: Look for explicit TEST_REQUEST format
-        if "TEST_REQUEST:" in response_text:
-            lines = response_text.strip().split('\n')
-            for line in lines:
-                line = line.strip()
-                
-                if line.startswith("TEST_REQUEST:"):
-                    test_value = line.split(":", 1)[1].strip().lower()
-                    test_request = test_value in ["yes", "true", "1"]
-                    print(f"✅ Found TEST_REQUEST: {test_request}")
-                
-                elif line.startswith("REQUESTED_TEST:"):
-                    requested_test = line.split(":", 1)[1].strip()
-                    if requested_test.lower() in ["none", "n/a", ""]:
-                        requested_test = "None"
-                    print(f"✅ Found REQUESTED_TEST: '{requested_test}'")
-                
-                elif line.startswith("QUESTION:"):
-                    question = line.split(":", 1)[1].strip()
-                    print(f"✅ Found QUESTION: '{question[:50]}...'")
-            
-            # Handle single-line format: "TEST_REQUEST: Yes REQUESTED_TEST: XYZ QUESTION: ABC"
-            if not test_request:
-                for line in lines:
-                    if "TEST_REQUEST:" in line and "REQUESTED_TEST:" in line:
-                        parts = line.split()
-                        for i, part in enumerate(parts):
-                            if part == "TEST_REQUEST:" and i + 1 < len(parts):
-                                test_request = parts[i + 1].lower() in ["yes", "true", "1"]
-                                print(f"✅ Single-line TEST_REQUEST: {test_request}")
-                            elif part == "REQUESTED_TEST:" and i + 1 < len(parts):
-                                # Collect test name (might be multiple words)
-                                test_parts = []
-                                for j in range(i + 1, len(parts)):
-                                    if parts[j].startswith("QUESTION:"):
-                                        break
-                                    test_parts.append(parts[j])
-                                if test_parts:
-                                    requested_test = " ".join(test_parts)
-                                    print(f"✅ Single-line REQUESTED_TEST: '{requested_test}'")
-                            elif part == "QUESTION:" and i + 1 < len(parts):
-                                question_parts = parts[i + 1:]
-                                question = " ".join(question_parts)
-                                print(f"✅ Single-line QUESTION: '{question[:50]}...'")
-        
-        # Method 2: Look for test indicators in THINKING section
-        if not test_request and "THINKING:" in response_text:
-            thinking_section = response_text.split("THINKING:")[1]
-            if "ANSWER:" in thinking_section:
-                thinking_section = thinking_section.split("ANSWER:")[0]
-            
-            # Check for test-related keywords in thinking
-            test_indicators = [
-                "diagnostic testing",
-                "testing would be",
-                "test would be",
-                "examination",
-                "fluorescein",
-                "slit-lamp",
-                "CT scan",
-                "MRI",
-                "ultrasound",
-                "blood test",
-                "culture",
-                "biopsy"
-            ]
-            
-            thinking_lower = thinking_section.lower()
-            for indicator in test_indicators:
-                if indicator in thinking_lower:
-                    test_request = True
-                    print(f"✅ Found test indicator in THINKING: '{indicator}'")
-                    break
-        
-        # Method 3: Look for test requests in the question/answer text
-        if not test_request:
-            question_lower = question.lower()
-            test_phrases = [
-                "examination",
-                "test",
-                "scan",
-                "imaging",
-                "lab",
-                "culture",
-                "fluorescein",
-                "slit lamp",
-                "ct",
-                "mri",
-                "ultrasound",
-                "blood work"
-            ]
-            
-            for phrase in test_phrases:
-                if phrase in question_lower:
-                    test_request = True
-                    print(f"✅ Found test phrase in question: '{phrase}'")
-                    break
-        
-        # Method 4: Extract test name from various locations
-        if test_request and requested_test == "None":
-            # Look in the full response for test names
-            full_text_lower = response_text.lower()
-            
-            # Common test patterns
-            test_patterns = {
-                "fluorescein": "Fluorescein staining",
-                "slit-lamp": "Slit-lamp examination", 
-                "slit lamp": "Slit-lamp examination",
-                "ct scan": "CT scan",
-                "mri": "MRI",
-                "ultrasound": "Ultrasound",
-                "culture": "Culture",
-                "blood test": "Blood test",
-                "examination": "Physical examination"
-            }
-            
-            for pattern, test_name in test_patterns.items():
-                if pattern in full_text_lower:
-                    requested_test = test_name
-                    print(f"✅ Extracted test name: '{test_name}' from pattern '{pattern}'")
-                    break
-        
-        # Method 5: Clean up the question text
-        if "ANSWER:" in response_text:
-            answer_section = response_text.split("ANSWER:", 1)[1].strip()
-            
-            # Remove TEST_REQUEST and REQUESTED_TEST lines from question
-            answer_lines = answer_section.split('\n')
-            clean_lines = []
-            
-            for line in answer_lines:
-                line_stripped = line.strip()
-                if not line_stripped.startswith(("TEST_REQUEST:", "REQUESTED_TEST:")):
-                    if line_stripped.startswith("QUESTION:"):
-                        clean_lines.append(line_stripped.split(":", 1)[1].strip())
-                    elif line_stripped and not line_stripped.startswith(("THINKING:", "ANSWER:")):
-                        clean_lines.append(line_stripped)
-            
-            if clean_lines:
-                question = " ".join(clean_lines).strip()
-        
-        # Final cleanup
-        if not question or question == response_text:
-            # Extract the cleanest sentence as fallback
-            sentences = response_text.replace('\n', ' ').split('.')
-            for sentence in sentences:
-                sentence = sentence.strip()
-                if (sentence and 
-                    len(sentence) > 10 and 
-                    not sentence.startswith(("THINKING", "ANSWER", "TEST_REQUEST", "REQUESTED_TEST"))):
-                    question = sentence
-                    break
-        
-        print(f"🎯 FINAL RESULTS:")
-        print(f"   test_request: {test_request}")
-        print(f"   requested_test: '{requested_test}'")
-        print(f"   question: '{question[:100]}...'")
-        
-    except Exception as e:
-        print(f"❌ Error in robust parsing: {e}")
-        # Ultra-safe fallback
-        question = response_text.strip()
-    
+    parsed = parse_output(response_text)
+    fields = {}
+    for label, value in labeled_segments(response_text, QUESTIONER_FIELDS):
+        fields.setdefault(label, value)
+
+    test_value = (fields.get("TEST_REQUEST") or "").lower().split()
+    test_request = bool(test_value) and test_value[0].strip(".,;") in YES_VALUES
+    requested_test = fields.get("REQUESTED_TEST") or "None"
+    if requested_test.lower() in ("none", "n/a"):
+        requested_test = "None"
+    question = fields.get("QUESTION") or response_text.strip()
+
+    if not test_request and parsed.thinking and THINKING_TEST_RE.search(parsed.thinking.lower()):
+        test_request = True
+    if not test_request and QUESTION_TEST_RE.search(question.lower()):
+        test_request = True
+
+    if test_request and requested_test == "None":
+        full_text_lower = response_text.lower()
+        requested_test = next(
+            (name for pattern, name in TEST_NAME_PATTERNS.items() if pattern in full_text_lower),
+            "None",
+        )
+
+    # The question is the ANSWER minus the test fields
+    if parsed.answer is not None or "ANSWER:" in response_text:
+        answer = parsed.answer if parsed.answer is not None else response_text.split("ANSWER:", 1)[1]
+        clean_parts = [
+            value
+            for label, value in labeled_segments(answer, QUESTIONER_FIELDS)
+            if label in (None, "QUESTION")
+        ]
+        if clean_parts:
+            question = " ".join(" ".join(clean_parts).split())
+
+    # Fall back to the first substantial sentence
+    if not question or question == response_text.strip():
+        for sentence in response_text.replace("\n", " ").split("."):
+            sentence = sentence.strip()
+            if len(sentence) > 10 and not sentence.startswith(
+                ("THINKING", "ANSWER", "TEST_REQUEST", "REQUESTED_TEST")
+            ):
+                question = sentence
+                break
+
     return test_request, requested_test, question
 
 
@@ -385,7 +294,7 @@ def process_vignette(idx, vignette_text, gold_label):
     patient_instructions = generate_patient_prompt_modifiers(
         behavior_config, is_initial=True
     )
-    patient = RoleResponder(patient_instructions)
+    patient = RoleResponder(patient_instructions, structured=role_schema("patient"))
 
     # Age and gender requirements with behavior consideration
     age_gender_instruction = 'YOU MUST mention your age, and biological gender in the first of the three sentences. E.g. "I am 25, and I am a biological male."'
@@ -563,7 +472,7 @@ def process_vignette(idx, vignette_text, gold_label):
                     behavior_type=behavior_type,
                 )
 
-                treatment_result = diagnoser.ask(prompt)
+                treatment_result = diagnoser.ask(prompt, structured=False)
                 raw_treatment = treatment_result["raw"]
 
                 treatment_plans.append(
@@ -600,7 +509,7 @@ def process_vignette(idx, vignette_text, gold_label):
         )
 
         # Create questioner with enhanced role definition
-        questioner = RoleResponder(guided_questioning_role)
+        questioner = RoleResponder(guided_questioning_role, structured=role_schema("test_questioner"))
 
         # Use modified prompt with test request detection
         prompt = MODIFIED_QUESTION_GENERATION_PROMPT.format(
@@ -620,8 +529,14 @@ def process_vignette(idx, vignette_text, gold_label):
         raw_followup = followup_result["raw"]
         followup_clean = followup_result["clean"]
 
-        # ✅ FIXED: Use robust parsing function
-        test_request, requested_test, followup_question = parse_questioner_response_robust(followup_clean)
+        fields = followup_result.get("fields")
+        if fields:
+            # Structured reply: the TEST_REQUEST fields are already typed
+            test_request = fields["test_request"]
+            requested_test = (fields["requested_test"].strip() or "None") if test_request else "None"
+            followup_question = fields["question"].strip()
+        else:
+            test_request, requested_test, followup_question = parse_questioner_response_robust(followup_clean)
 
         print("❓ Doctor's Request:", followup_question)
         if test_request:
@@ -670,7 +585,7 @@ def process_vignette(idx, vignette_text, gold_label):
             patient_followup_instructions = generate_patient_prompt_modifiers(
                 behavior_config, is_initial=False
             )
-            patient = RoleResponder(patient_followup_instructions)
+            patient = RoleResponder(patient_followup_instructions, structured=role_schema("patient"))
 
             # Adjust response style based on behavior and conversation stage
             response_guidance = "in one or two sentences"
@@ -762,7 +677,10 @@ def select_patient_behavior():
 
 
 class RoleResponder:
-    def __init__(self, role_instruction):
+    def __init__(self, role_instruction, structured=None):
+        # Opt-in JSON-schema replies (see structured_output.role_schema)
+        self.structured = structured
+        self.structured_instruction = role_instruction + STRUCTURED_INSTRUCTION
         self.role_instruction = (
             role_instruction
             + """
@@ -776,8 +694,12 @@ class RoleResponder:
         """
         )
 
-    def ask(self, user_input, max_retries=3):
+    def ask(self, user_input, max_retries=3, structured=True):
         """Ask with guaranteed THINKING/ANSWER format and return both raw and clean outputs"""
+        if structured and self.structured is not None:
+            result = self.ask_structured(user_input)
+            if result is not None:
+                return result
 
         for attempt in range(max_retries):
             messages = [
@@ -788,224 +710,42 @@ class RoleResponder:
             response = client.chat.completions.create(model=model, messages=messages)
             raw_response = response.choices[0].message.content.strip()
 
-            # 🔍 DEBUG: Print the raw GPT response
-            print(f"\n🤖 RAW GPT RESPONSE (attempt {attempt + 1}):")
-            print("=" * 50)
-            print(raw_response)
-            print("=" * 50)
-
-            # Clean and normalize the response
-            cleaned_response = self.clean_thinking_answer_format(raw_response)
-
-            # 🔍 DEBUG: Print the cleaned response
-            print(f"\n🧹 CLEANED RESPONSE:")
-            print("=" * 30)
-            print(cleaned_response)
-            print("=" * 30)
-
-            # Validate the cleaned response
-            if self.validate_thinking_answer_format(cleaned_response):
-                # Extract just the ANSWER portion for the clean output
-                answer_only = self.extract_answer_only(cleaned_response)
-
-                # 🔍 DEBUG: Print the extracted answer
-                print(f"\n✅ EXTRACTED ANSWER:")
-                print("=" * 20)
-                print(answer_only)
-                print("=" * 20)
-
+            # Rebuilt from the first THINKING: and the first ANSWER: after it
+            parsed = parse_output(raw_response)
+            if parsed.thinking and parsed.answer:
                 return {
-                    "raw": cleaned_response,  # Full THINKING: + ANSWER:
-                    "clean": answer_only,  # Just the answer content
+                    "raw": format_output(parsed.thinking, parsed.answer),  # Full THINKING: + ANSWER:
+                    "clean": parsed.answer,  # Just the answer content
                 }
-            else:
-                # 🔍 DEBUG: Print validation failure
-                print(f"\n❌ VALIDATION FAILED for attempt {attempt + 1}")
-                print(f"Cleaned response: {cleaned_response[:200]}...")
+            print(f"⚠️ Unusable THINKING/ANSWER format ({parsed.code}) on attempt {attempt + 1}")
 
         # Final fallback
         fallback_raw = f"THINKING: Format enforcement failed after {max_retries} attempts\nANSWER: Unable to get properly formatted response."
         fallback_clean = "Unable to get properly formatted response."
-
-        # 🔍 DEBUG: Print fallback
-        print(f"\n💥 FALLBACK TRIGGERED after {max_retries} attempts")
-        print(f"Final raw response was: {raw_response[:200]}...")
+        print(f"💥 FALLBACK TRIGGERED after {max_retries} attempts")
 
         return {"raw": fallback_raw, "clean": fallback_clean}
 
-    def extract_answer_only(self, text):
-        """Extract just the content after ANSWER:"""
-        if "ANSWER:" in text:
-            extracted = text.split("ANSWER:", 1)[1].strip()
-            # 🔍 DEBUG: Print extraction process
-            print(f"\n🎯 EXTRACTING ANSWER from: {text[:100]}...")
-            print(f"🎯 EXTRACTED: {extracted[:100]}...")
-            return extracted
-
-        # 🔍 DEBUG: No ANSWER found
-        print(f"\n⚠️ NO 'ANSWER:' found in text: {text[:100]}...")
-        return text.strip()
-
-    def clean_thinking_answer_format(self, text):
-        """Clean and ensure exactly one THINKING and one ANSWER section"""
-
-        # 🔍 DEBUG: Print input to cleaning function
-        print(f"\n🧼 CLEANING INPUT:")
-        print(f"Input length: {len(text)} characters")
-        print(f"First 200 chars: {text[:200]}...")
-        print(f"Contains THINKING: {'THINKING:' in text}")
-        print(f"Contains ANSWER: {'ANSWER:' in text}")
-
-        # Remove any leading/trailing whitespace
-        text = text.strip()
-
-        # Find all THINKING and ANSWER positions
-        thinking_positions = []
-        answer_positions = []
-
-        lines = text.split("\n")
-        for i, line in enumerate(lines):
-            line_stripped = line.strip()
-            if line_stripped.startswith("THINKING:"):
-                thinking_positions.append(i)
-                print(f"🧠 Found THINKING at line {i}: {line_stripped[:50]}...")
-            elif line_stripped.startswith("ANSWER:"):
-                answer_positions.append(i)
-                print(f"💬 Found ANSWER at line {i}: {line_stripped[:50]}...")
-
-        print(f"📊 THINKING positions: {thinking_positions}")
-        print(f"📊 ANSWER positions: {answer_positions}")
-
-        # If we have exactly one of each, check if they're in the right order
-        if len(thinking_positions) == 1 and len(answer_positions) == 1:
-            thinking_idx = thinking_positions[0]
-            answer_idx = answer_positions[0]
-
-            if thinking_idx < answer_idx:
-                print(f"✅ Perfect format detected!")
-                # Perfect format, just clean up the content
-                thinking_content = lines[thinking_idx][9:].strip()  # Remove "THINKING:"
-                answer_content = []
-
-                # Collect thinking content (everything between THINKING and ANSWER)
-                for i in range(thinking_idx + 1, answer_idx):
-                    thinking_content += " " + lines[i].strip()
-
-                # Collect answer content (everything after ANSWER)
-                answer_content = lines[answer_idx][7:].strip()  # Remove "ANSWER:"
-                for i in range(answer_idx + 1, len(lines)):
-                    answer_content += " " + lines[i].strip()
-
-                result = f"THINKING: {thinking_content.strip()}\nANSWER: {answer_content.strip()}"
-                print(f"✅ Perfect format result: {result[:100]}...")
-                return result
-
-        print(f"⚠️ Format needs fixing...")
-
-        # If format is messed up, try to extract and rebuild
-        # Look for the first THINKING and first ANSWER after it
-        thinking_content = ""
-        answer_content = ""
-
-        first_thinking = -1
-        first_answer_after_thinking = -1
-
-        for i, line in enumerate(lines):
-            line_stripped = line.strip()
-            if line_stripped.startswith("THINKING:") and first_thinking == -1:
-                first_thinking = i
-                thinking_content = line_stripped[9:].strip()
-                print(f"🎯 Using THINKING from line {i}")
-            elif (
-                line_stripped.startswith("ANSWER:")
-                and first_thinking != -1
-                and first_answer_after_thinking == -1
-            ):
-                first_answer_after_thinking = i
-                answer_content = line_stripped[7:].strip()
-                print(f"🎯 Using ANSWER from line {i}")
-                break
-            elif first_thinking != -1 and first_answer_after_thinking == -1:
-                # Still collecting thinking content
-                thinking_content += " " + line_stripped
-
-        # Collect remaining answer content
-        if first_answer_after_thinking != -1:
-            for i in range(first_answer_after_thinking + 1, len(lines)):
-                line_stripped = lines[i].strip()
-                # Stop if we hit another THINKING or ANSWER
-                if line_stripped.startswith("THINKING:") or line_stripped.startswith(
-                    "ANSWER:"
-                ):
-                    break
-                answer_content += " " + line_stripped
-
-        print(f"🔧 Extracted thinking: {thinking_content[:50]}...")
-        print(f"🔧 Extracted answer: {answer_content[:50]}...")
-
-        # If we still don't have both parts, try to extract from the raw text
-        if not thinking_content or not answer_content:
-            print(f"🆘 Last resort extraction...")
-            # Last resort: split on the patterns
-            if "THINKING:" in text and "ANSWER:" in text:
-                parts = text.split("ANSWER:", 1)
-                if len(parts) == 2:
-                    thinking_part = parts[0]
-                    answer_part = parts[1]
-
-                    # Extract thinking content
-                    if "THINKING:" in thinking_part:
-                        thinking_content = thinking_part.split("THINKING:", 1)[
-                            1
-                        ].strip()
-
-                    # Clean answer content (remove any nested THINKING/ANSWER)
-                    answer_lines = answer_part.split("\n")
-                    clean_answer_lines = []
-                    for line in answer_lines:
-                        if not line.strip().startswith(
-                            "THINKING:"
-                        ) and not line.strip().startswith("ANSWER:"):
-                            clean_answer_lines.append(line)
-                    answer_content = " ".join(clean_answer_lines).strip()
-
-        # Fallback if we still don't have proper content
-        if not thinking_content:
-            print(f"❌ Failed to extract thinking content")
-            thinking_content = "Unable to extract thinking content properly"
-        if not answer_content:
-            print(f"❌ Failed to extract answer content")
-            answer_content = "Unable to extract answer content properly"
-
-        final_result = (
-            f"THINKING: {thinking_content.strip()}\nANSWER: {answer_content.strip()}"
-        )
-        print(f"🏁 Final cleaned result: {final_result[:100]}...")
-        return final_result
-
-    def validate_thinking_answer_format(self, text):
-        """Validate that the text has exactly one THINKING and one ANSWER in correct order"""
-        lines = text.split("\n")
-
-        thinking_count = 0
-        answer_count = 0
-        thinking_first = False
-
-        for line in lines:
-            line_stripped = line.strip()
-            if line_stripped.startswith("THINKING:"):
-                thinking_count += 1
-                if answer_count == 0:  # No ANSWER seen yet
-                    thinking_first = True
-            elif line_stripped.startswith("ANSWER:"):
-                answer_count += 1
-
-        is_valid = thinking_count == 1 and answer_count == 1 and thinking_first
-        print(
-            f"✅ VALIDATION: thinking_count={thinking_count}, answer_count={answer_count}, thinking_first={thinking_first}, valid={is_valid}"
+    def ask_structured(self, user_input):
+        """One schema-constrained call; None (fall back to text) if the reply doesn't validate"""
+        messages = [
+            {"role": "system", "content": self.structured_instruction},
+            {"role": "user", "content": user_input},
+        ]
+        response = client.chat.completions.create(
+            model=model, messages=messages, response_format=response_format(self.structured)
         )
+        fields, errors = parse_structured(response.choices[0].message.content, self.structured)
+        if fields is None:
+            print(f"⚠️ Structured {self.structured.name} reply rejected ({'; '.join(errors[:3])}), using text format")
+            return None
 
-        return is_valid
+        answer = self.structured.render(fields)
+        return {
+            "raw": format_output(fields["thinking"].strip(), answer),
+            "clean": answer,
+            "fields": fields,
+        }
 
 
 # === Use the Class for Roles ===
@@ -1014,7 +754,7 @@ summarizer = RoleResponder(
     "You are a clinical summarizer trained to extract structured vignettes from doctor–patient dialogues."
 )
 
-diagnoser = RoleResponder("You are a board-certified diagnostician.")
+diagnoser = RoleResponder("You are a board-certified diagnostician.", structured=role_schema("diagnoser"))
 
 # === Store all transcripts ===
 summarizer_outputs = []